@@ -1,8 +1,7 @@
 import asyncio
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from redis.asyncio.client import PubSub
-from settings.my_redis import cache_manager, pubsub_manager
+from settings.my_redis import Subscription, cache_manager, pubsub_manager
 from settings.my_websocket import admin_ws_manager, settings_ws_manager
 from utility.my_enums import PubSubTopics
 from utility.my_logger import my_logger
@@ -36,19 +35,16 @@ async def settings_statistics_websocket(websocket: WebSocket):
 
     statistics: StatisticsSchema = await cache_manager.get_statistics()
     my_logger.info(f"🚧 statistics: {statistics}")
-    pubsub: PubSub = await pubsub_manager.subscribe(topic=PubSubTopics.SETTINGS_STATS.value)
+    pubsub: Subscription = await pubsub_manager.subscribe(topic=PubSubTopics.SETTINGS_STATS.value)
     await settings_ws_manager.broadcast(data=statistics.model_dump())
 
     async def listen_pubsub():
         my_logger.debug("📡 Subscribed and listening to 'settings:stats'...")
-        while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-            if message:
-                my_logger.debug(f"message: {message}, type: {type(message)}")
-                if message["type"] == "message":
-                    updated_statistics = await cache_manager.get_statistics()
-                    my_logger.debug(f"updated_statistics: {updated_statistics}")
-                    await websocket.send_json(updated_statistics.model_dump())
+        async for message in pubsub.listen():
+            my_logger.debug(f"message: {message}, type: {type(message)}")
+            updated_statistics = await cache_manager.get_statistics()
+            my_logger.debug(f"updated_statistics: {updated_statistics}")
+            await websocket.send_json(updated_statistics.model_dump())
 
     listener_task = asyncio.create_task(listen_pubsub())
 
@@ -16,8 +16,8 @@ from apps.users_app.schemas import ResultSchema
 from settings.my_database import DBSession
 from settings.my_dependency import strictJwtDependency
 from settings.my_exceptions import ApiException
-from settings.my_redis import cache_manager, chat_cache_manager, pubsub_manager
-from utility.my_enums import ChatEvent
+from settings.my_redis import cache_manager, chat_cache_manager, stream_manager
+from utility.my_enums import ChatEvent, PubSubTopics
 from utility.my_logger import my_logger
 
 chats_router = APIRouter()
@@ -70,20 +70,20 @@ async def create_chat_route(jwt: strictJwtDependency, session: DBSession, schema
 
         is_online = await chat_cache_manager.is_online(participant_id=participant_id.hex)
 
-        if is_online:
-            data = {
-                **mapping,
-                "type": ChatEvent.created_chat.value,
-                "participant": {
-                    "id": jwt.user_id.hex,
-                    "name": participant_profile.get("name"),
-                    "username": participant_profile.get("username"),
-                    "avatar_url": participant_profile.get("avatar_url"),
-                    "last_seen_at": now_timestamp,
-                    "is_online": True,
-                },
-            }
-            await pubsub_manager.publish(topic=f"chats:home:{participant_id.hex}", data=data)
+        # Written to the participant's stream even while offline, their next connection replays it
+        data = {
+            **mapping,
+            "type": ChatEvent.created_chat.value,
+            "participant": {
+                "id": jwt.user_id.hex,
+                "name": participant_profile.get("name"),
+                "username": participant_profile.get("username"),
+                "avatar_url": participant_profile.get("avatar_url"),
+                "last_seen_at": now_timestamp,
+                "is_online": True,
+            },
+        }
+        await stream_manager.publish(streams=[PubSubTopics.CHAT_STREAM.value.format(user_id=participant_id.hex)], data=data)
 
         response = ChatSchema(
             id=chat_id,
@@ -4,17 +4,27 @@ from typing import Optional
 from uuid import uuid4, UUID
 
 from fastapi import APIRouter, WebSocket
-from redis.asyncio.client import PubSub
 
 from apps.chats_app.app_tasks import create_chat_message_task
+from settings.my_config import get_settings
 from settings.my_dependency import websocketDependency
-from settings.my_redis import chat_cache_manager, pubsub_manager
-from settings.my_websocket import WebSocketContextManager, chat_ws_manager
-from utility.my_enums import ChatEvent
+from settings.my_redis import chat_cache_manager, stream_manager
+from settings.my_websocket import WebSocketContextManager, chat_connection_registry, chat_event_router, chat_presence_batcher, chat_ws_manager
+from utility.local_cache import LocalCache
+from utility.my_enums import ChatEvent, PubSubTopics
 from utility.my_logger import my_logger
 
+settings = get_settings()
+
 chat_ws_router = APIRouter()
 
+# The last typing event relayed per user and chat, a repeat within the throttle window is dropped
+typing_state = LocalCache(name="chat_typing_state", max_size=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.TYPING_THROTTLE_SECONDS)
+# Online participants per chat, reused by the typing events of the same window instead of one SINTER per keystroke
+online_participants_cache = LocalCache(name="chat_online_participants", max_size=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.TYPING_THROTTLE_SECONDS)
+# Offline announcements waiting out the debounce window, a reconnect to this node cancels them
+pending_offline: dict[str, asyncio.Task] = {}
+
 
 @chat_ws_router.websocket("/home")
 async def enter_home(websocket_dependency: websocketDependency):
@@ -35,8 +45,10 @@ async def enter_home(websocket_dependency: websocketDependency):
             user_id=user_id,
             connect_handler=chat_connect,
             disconnect_handler=chat_disconnect,
-            pubsub_generator=chat_pubsub_generator,
             message_handlers=message_handlers,
+            stream=chat_stream(user_id=user_id),
+            # Clients pass the stream_id of the last event they saw and get everything after it replayed instead of reloading their chats
+            last_id=websocket.query_params.get("last_id"),
     ) as connection:
         await connection.wait_until_disconnected()
 
@@ -44,56 +56,135 @@ async def enter_home(websocket_dependency: websocketDependency):
 # Connection setup
 async def chat_connect(user_id: str, websocket: WebSocket):
     await chat_ws_manager.connect(user_id=user_id, websocket=websocket)
-    results: tuple[set[str], set[str]] = await chat_cache_manager.add_user_to_chats(user_id=user_id)
-    if all(results):
-        my_logger.debug("results has some data")
-        tasks = [pubsub_manager.publish(topic=f"chats:home:{pid}", data={"id": chid, "type": ChatEvent.goes_online.value}) for chid, pid in zip(results[0], results[1])]
-        await asyncio.gather(*tasks)
+    await chat_connection_registry.register(user_id=user_id)
+    if pending := pending_offline.pop(user_id, None):
+        pending.cancel()
+
+    online_partners: dict[str, str] = await chat_cache_manager.add_user_to_chats(user_id=user_id)
+    # A reconnect inside the debounce window never announced going offline, so it has nothing to announce either
+    if await chat_cache_manager.set_presence(user_id=user_id, online=True) and online_partners:
+        events = {partner_id: {"type": ChatEvent.goes_online.value, "user_id": user_id, "id": chat_id} for partner_id, chat_id in online_partners.items()}
+        chat_presence_batcher.add(events=events)
 
 
 async def chat_disconnect(user_id: str, websocket: WebSocket):
     await chat_ws_manager.disconnect(user_id=user_id, websocket=websocket)
-    results: tuple[set[str], set[str]] = await chat_cache_manager.remove_user_from_chats(user_id=user_id)
-    if all(results):
-        tasks = [pubsub_manager.publish(topic=f"chats:home:{pid}", data={"id": chid, "type": ChatEvent.goes_offline.value}) for chid, pid in zip(results[0], results[1])]
-        await asyncio.gather(*tasks)
-
+    # Other tabs of the user on this node keep it registered and online
+    if user_id in chat_ws_manager.authorized_connections:
+        return
+    await chat_connection_registry.unregister(user_id=user_id)
+    pending_offline[user_id] = asyncio.create_task(announce_offline(user_id=user_id))
+
+
+async def announce_offline(user_id: str):
+    """Announce going offline once the debounce window passed without the user reconnecting."""
+    try:
+        await asyncio.sleep(settings.PRESENCE_DEBOUNCE_SECONDS)
+        await go_offline(user_id=user_id)
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        my_logger.exception(f"Exception while announcing {user_id} offline: {e}")
+    finally:
+        if pending_offline.get(user_id) is asyncio.current_task():
+            pending_offline.pop(user_id, None)
+
+
+async def go_offline(user_id: str):
+    """Take the user offline and tell its online partners, unless it is connected on any node."""
+    if await chat_connection_registry.locate(user_ids=[user_id]):
+        return
 
-async def chat_pubsub_generator(user_id: str) -> PubSub:
-    return await pubsub_manager.subscribe(topic=f"chats:home:{user_id}")
+    last_seen_at = int(datetime.now(UTC).timestamp())
+    online_partners: dict[str, str] = await chat_cache_manager.remove_user_from_chats(user_id=user_id, last_seen_at=last_seen_at)
+    # Batched per partner with the other transitions of the window, then published once per node that holds any of them
+    if await chat_cache_manager.set_presence(user_id=user_id, online=False) and online_partners:
+        events = {
+            partner_id: {"type": ChatEvent.goes_offline.value, "user_id": user_id, "id": chat_id, "last_seen_at": last_seen_at}
+            for partner_id, chat_id in online_partners.items()
+        }
+        chat_presence_batcher.add(events=events)
+
+
+async def flush_pending_offline():
+    """Announce the debounced offlines and the presence batch right away on shutdown, they would die with the process otherwise."""
+    user_ids: list[str] = list(pending_offline)
+    for task in pending_offline.values():
+        task.cancel()
+    pending_offline.clear()
+    for user_id, result in zip(user_ids, await asyncio.gather(*(go_offline(user_id=user_id) for user_id in user_ids), return_exceptions=True)):
+        if isinstance(result, Exception):
+            my_logger.error(f"Exception while flushing {user_id} offline: {result}")
+    try:
+        await chat_presence_batcher.flush()
+    except Exception as e:
+        my_logger.error(f"Exception while flushing the presence batch: {e}")
+
+
+async def sweep_presence():
+    """Take offline the users left online by nodes that died before announcing them, one node sweeps per interval."""
+    while True:
+        await asyncio.sleep(settings.PRESENCE_SWEEP_INTERVAL)
+        try:
+            if not await chat_cache_manager.claim_presence_sweep(ttl=settings.PRESENCE_SWEEP_INTERVAL / 2):
+                continue
+            async for user_ids in chat_cache_manager.scan_online_users(batch_size=settings.PRESENCE_SWEEP_BATCH_SIZE):
+                located: dict[str, list[str]] = await chat_connection_registry.locate(user_ids=user_ids)
+                # Users waiting out the debounce here are announced by their own task
+                stale: list[str] = [user_id for user_id in user_ids if user_id not in located and user_id not in pending_offline]
+                await asyncio.gather(*(go_offline(user_id=user_id) for user_id in stale))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            my_logger.exception(f"Presence sweep failed: {e}")
+
+
+def chat_stream(user_id: str) -> str:
+    return PubSubTopics.CHAT_STREAM.value.format(user_id=user_id)
 
 
 # Event handlers
 async def handle_goes_online(user_id: str, data: dict[str, str]):
-    await chat_ws_manager.send_personal_message(user_id=user_id, data=data)
+    await chat_event_router.deliver(user_ids=[user_id], data=data)
 
 
 async def handle_goes_offline(user_id: str, data: dict):
-    await chat_ws_manager.send_personal_message(user_id=user_id, data=data)
+    await chat_event_router.deliver(user_ids=[user_id], data=data)
 
 
 async def handle_typing_start(user_id: str, data: dict):
     my_logger.debug(f"User started typing in {data.get('id')}")
-    chat_id: Optional[str] = data.get("id")
-    if not chat_id:
-        await chat_ws_manager.send_personal_message(user_id=user_id, data={"detail": "You must provider chat id!"})
-
-    online_participants: set[str] = await chat_cache_manager.get_chat_participants(chat_id=chat_id, user_id=user_id, online=True)
-    if online_participants:
-        tasks = [chat_ws_manager.send_personal_message(user_id=pid, data=data) for pid in online_participants]
-        await asyncio.gather(*tasks)
+    await relay_typing(user_id=user_id, data=data)
 
 
 async def handle_typing_stop(user_id: str, data: dict):
     my_logger.debug(f"User stopped typing in {data.get('id')}")
+    await relay_typing(user_id=user_id, data=data)
+
+
+async def relay_typing(user_id: str, data: dict):
     chat_id: Optional[str] = data.get("id")
     if not chat_id:
-        await chat_ws_manager.send_personal_message(user_id=user_id, data={"detail": "You must provider chat id!"})
+        await chat_event_router.deliver(user_ids=[user_id], data={"detail": "You must provider chat id!"})
+        return
 
-    online_participants: set[str] = await chat_cache_manager.get_chat_participants(chat_id=chat_id, user_id=user_id, online=True)
-    if online_participants:
-        tasks = [chat_ws_manager.send_personal_message(user_id=pid, data=data) for pid in online_participants]
-        await asyncio.gather(*tasks)
+    # Keystrokes repeat typing_start, only the first one within the window and the stop after it reach the other side
+    state_key = f"{user_id}:{chat_id}"
+    if typing_state.get(state_key) == data.get("type"):
+        return
+    typing_state.set(state_key, data.get("type"))
+
+    online_participants: Optional[set[str]] = online_participants_cache.get(chat_id)
+    if online_participants is None:
+        online_participants = await chat_cache_manager.get_chat_participants(chat_id=chat_id, online=True)
+        online_participants_cache.set(chat_id, online_participants)
+
+    # The sender is online, so it is in the set only when it actually belongs to the chat
+    if user_id not in online_participants:
+        return
+    recipients: set[str] = online_participants - {user_id}
+    if recipients:
+        await chat_event_router.deliver(user_ids=recipients, data=data)
 
 
 async def handle_sent_message(user_id: str, data: dict):
@@ -129,12 +220,12 @@ async def handle_sent_message(user_id: str, data: dict):
 
     my_logger.debug(f"data type: {type(data)}")
 
-    await chat_ws_manager.send_personal_message(user_id=user_id, data=data)
-    await chat_ws_manager.send_personal_message(user_id=participant_id, data=data)
+    # Both sides get it through their streams, so a reconnecting participant still receives it
+    await stream_manager.publish(streams=[chat_stream(user_id=user_id), chat_stream(user_id=participant_id)], data=data)
 
 
 async def handle_created_chat(user_id: str, data: dict):
     participant_id = data.get("participant", {}).get("id")
     chat_id = data.get("id")
     my_logger.debug(f"User {participant_id} created a chat room (ID: {chat_id}) with you ({user_id})")
-    await chat_ws_manager.send_personal_message(user_id=user_id, data=data)
+    await chat_event_router.deliver(user_ids=[user_id], data=data)
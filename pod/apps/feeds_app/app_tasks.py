@@ -1,4 +1,5 @@
 import asyncio
+import time
 from typing import Annotated, Optional
 from uuid import UUID
 
@@ -7,12 +8,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from taskiq import TaskiqDepends
 
 from apps.feeds_app.models import EngagementModel
+from settings.my_config import get_settings
 from settings.my_database import get_session
 from settings.my_redis import cache_manager, pubsub_manager
 from settings.my_taskiq import broker
 from utility.my_enums import EngagementType, PubSubTopics
 from utility.my_logger import my_logger
 
+settings = get_settings()
+
 
 @broker.task(task_name="notify_followers_task")
 async def notify_followers_task(user_id: str):
@@ -37,15 +41,122 @@ async def notify_followers_task(user_id: str):
     my_logger.info(f"📣 Notified {len(online_followers)} followers of {user_id}")
 
 
-# # @broker.task(task_name="recalculate_feed_stats", schedule=[{"cron": "*/360 * * * *"}])
-# @broker.task(task_name="notify_followers_task")
-# async def recalculate_feed_stats(cache: Annotated[Redis, TaskiqDepends(lambda: my_cache_redis)]):
-#     my_logger.debug(f"recalculate_feed_stats starting...")
-#     # my_logger.debug(f"cache users count: {await cache.hget(name='users', key='count')}")
-#     # await cache.hincrby(name="users", key="count")
-#     # TODO get feeds
-#
-#     return {"ok": True}
+@broker.task(task_name="fanout_feed_task", retry_on_error=True, max_retries=5)
+async def fanout_feed_task(author_id: str, feed_id: str, notify: bool = False):
+    """Retries resume from the cursor recorded in fanout:{feed_id}, so already written chunks are not repeated."""
+    delivered: int = await cache_manager.fanout_feed(author_id=author_id, feed_id=feed_id)
+    my_logger.info(f"📬 Fanned out feed {feed_id} to {delivered} followers of {author_id}")
+
+    # create_feed only asks a pull author for a fan-out once it dropped below the exit threshold
+    if await cache_manager.is_pull_author(author_id=author_id):
+        backfilled: int = await cache_manager.leave_pull_authors(author_id=author_id)
+        my_logger.info(f"📬 {author_id} left the pull authors, recent feeds copied to {backfilled} followers")
+
+    if notify:
+        await notify_followers_task.kiq(user_id=author_id)
+
+    return {"ok": True, "delivered": delivered}
+
+
+@broker.task(task_name="publish_scheduled_feeds_task", schedule=[{"cron": "* * * * *"}])
+async def publish_scheduled_feeds_task(window: float = 60, batch_size: int = 500):
+    """
+    Drains scheduled_feeds for one cron minute, sleeping until the next due feed but never longer than the poll interval,
+    so feeds are released within a second of their time however many are due in the same minute.
+    A feed is acked once published and queued again when publishing fails, so it is never lost with the claim.
+    """
+    deadline = time.time() + window
+    released = 0
+    while True:
+        now = time.time()
+        due_feeds: list[tuple[str, dict]] = await cache_manager.claim_due_feeds(now=now, limit=batch_size)
+        for feed_id, payload in due_feeds:
+            mapping: dict = payload["mapping"]
+            # The feed shows up in timelines at its publishing time rather than when it was written
+            mapping["created_at"] = int(now)
+            try:
+                await publish_feed(mapping=mapping, notify=payload.get("notify", False))
+            except Exception as e:
+                my_logger.error(f"Exception while publishing scheduled feed {feed_id}: {e}")
+                await cache_manager.requeue_scheduled_feed(feed_id=feed_id, due_at=time.time() + settings.SCHEDULED_FEEDS_POLL_INTERVAL)
+                continue
+            await cache_manager.ack_scheduled_feeds(feed_ids=[feed_id])
+            released += 1
+
+        if len(due_feeds) == batch_size:
+            continue
+        if time.time() >= deadline:
+            break
+        next_due_at: Optional[float] = await cache_manager.get_next_due_at()
+        wake_at = min(next_due_at if next_due_at is not None else deadline, deadline, time.time() + settings.SCHEDULED_FEEDS_POLL_INTERVAL)
+        await asyncio.sleep(max(wake_at - time.time(), 0))
+
+    if released:
+        my_logger.info(f"⏰ Released {released} scheduled feeds")
+    return {"ok": True, "released": released}
+
+
+async def publish_feed(mapping: dict, notify: bool):
+    """Put a feed into the caches and start its fan-out, followers are notified once their timelines contain it."""
+    author_id: str = mapping.get("author", {}).get("id", "")
+    feed_id: str = mapping.get("id", "")
+    fanout_required: bool = await cache_manager.create_feed(mapping=mapping)
+    if fanout_required:
+        await fanout_feed_task.kiq(author_id=author_id, feed_id=feed_id, notify=notify)
+    elif notify:
+        await notify_followers_task.kiq(user_id=author_id)
+
+
+@broker.task(task_name="backfill_engagement_counts_task", retry_on_error=True, max_retries=3)
+async def backfill_engagement_counts_task():
+    """Enqueued once after the deploy by main.ROLLOUT_TASKS, safe to run again since every counter is rewritten from its set atomically."""
+    backfilled: int = await cache_manager.backfill_engagement_counts()
+    my_logger.info(f"🧮 Engagement counters backfilled for {backfilled} feeds and comments")
+
+    return {"ok": True, "backfilled": backfilled}
+
+
+@broker.task(task_name="migrate_user_engagement_indexes_task", retry_on_error=True, max_retries=3)
+async def migrate_user_engagement_indexes_task(session: Annotated[AsyncSession, TaskiqDepends(get_session)]):
+    """
+    Convert users:{id}:{engagement} sets into zsets scored by the engagement time recorded in the database.
+    Enqueued once after the deploy by main.ROLLOUT_TASKS, sets already converted are skipped when it runs again.
+    """
+    migrated = 0
+    async for batch in cache_manager.scan_legacy_engagement_indexes():
+        user_ids: set[UUID] = {UUID(hex=user_id) for user_id, _ in batch}
+        stmt = select(EngagementModel.user_id, EngagementModel.feed_id, EngagementModel.engagement_type, EngagementModel.created_at).where(EngagementModel.user_id.in_(user_ids))
+        result = await session.execute(stmt)
+
+        engaged_at: dict[tuple[str, str], dict[str, float]] = {}
+        for user_id, feed_id, engagement_type, created_at in result.all():
+            engaged_at.setdefault((user_id.hex, engagement_type.value), {})[feed_id.hex] = created_at.timestamp()
+
+        for user_id, engagement_type in batch:
+            migrated += await cache_manager.migrate_user_engagement_index(user_id=user_id, engagement_type=engagement_type, engaged_at=engaged_at.get((user_id, engagement_type), {}))
+
+    my_logger.info(f"🗂️ Migrated {migrated} engagements into time-ordered user indexes")
+    return {"ok": True, "migrated": migrated}
+
+
+@broker.task(task_name="migrate_hash_encoding_task")
+async def migrate_hash_encoding_task():
+    """Run after flipping COMPACT_CACHE_ENCODING, in either direction."""
+    report: dict[str, dict[str, int]] = await cache_manager.migrate_hash_encoding()
+    for name, totals in report.items():
+        saved = totals["bytes_before"] - totals["bytes_after"]
+        ratio = totals["bytes_after"] / totals["bytes_before"] if totals["bytes_before"] else 1
+        my_logger.info(f"🗜️ {name}: {totals['keys']} keys, {totals['bytes_before']} → {totals['bytes_after']} bytes ({saved} saved, {ratio:.0%} of before)")
+
+    return {"ok": True, "report": report}
+
+
+@broker.task(task_name="rerank_global_timeline_task", schedule=[{"cron": "*/10 * * * *"}])
+async def rerank_global_timeline_task():
+    reranked: int = await cache_manager.rerank_global_timeline()
+    my_logger.info(f"📈 Re-ranked {reranked} feeds in global_timeline")
+
+    return {"ok": True, "reranked": reranked}
 
 
 @broker.task(task_name="set_engagement_task")
@@ -1,6 +1,5 @@
-import asyncio
 from datetime import UTC, datetime, timedelta
-from typing import Annotated, Optional
+from typing import Annotated, Literal, Optional
 from uuid import UUID
 
 import aiofiles
@@ -9,12 +8,12 @@ from ffmpeg.asyncio import FFmpeg
 from sqlalchemy import Result, select
 from sqlalchemy.orm import selectinload
 
-from apps.feeds_app.app_tasks import (notify_followers_task,
-                                      remove_engagement_task, set_engagement_task)
+from apps.feeds_app.app_tasks import (publish_feed, remove_engagement_task,
+                                      set_engagement_task)
 from apps.feeds_app.models import (CategoryModel, EngagementType, FeedModel,
                                    TagModel, ReportModel)
-from apps.feeds_app.schemas import (EngagementSchema, FeedResponseSchema,
-                                    FeedSchema, ReportOut)
+from apps.feeds_app.schemas import (EngagementSchema, FanoutStatusSchema,
+                                    FeedResponseSchema, FeedSchema, ReportOut)
 from apps.users_app.schemas import ResultSchema
 from settings.my_boto3 import put_file_to_boto3
 from settings.my_config import get_settings
@@ -23,7 +22,7 @@ from settings.my_dependency import jwtDependency, strictJwtDependency
 from settings.my_exceptions import NotFoundException, ValidationException
 from settings.my_minio import (put_object_to_minio,
                                remove_objects_from_minio)
-from settings.my_redis import cache_manager
+from settings.my_redis import cache_manager, is_timeline_cursor
 from utility.my_enums import CommentPolicy, FeedVisibility, ReportReason
 from utility.my_logger import my_logger
 from utility.validators import (allowed_image_extension,
@@ -59,6 +58,8 @@ async def create_feed_route(
             raise ValidationException(detail="body is exceeded max 300 character limit.")
 
         if scheduled_at is not None:
+            if parent_id is not None:
+                raise ValidationException("Comments cannot be scheduled.")
             now = datetime.now(UTC)
             max_future = now + timedelta(days=7)
             if scheduled_at < now:
@@ -111,12 +112,11 @@ async def create_feed_route(
         mapping = feed_schema.model_dump(exclude_unset=True, exclude_defaults=True, exclude_none=True, mode="json")
         my_logger.debug(f"mapping: {mapping}")
 
-        await cache_manager.create_feed(mapping=mapping)
-
-        my_logger.warning("notification is starting...")
-        if feed.feed_visibility in [FeedVisibility.public, FeedVisibility.followers] and parent_id is None:
-            my_logger.warning("notification is processing...")
-            await notify_followers_task.kiq(user_id=jwt.user_id.hex)
+        notify: bool = feed.feed_visibility in [FeedVisibility.public, FeedVisibility.followers] and parent_id is None
+        if scheduled_at is not None:
+            await cache_manager.schedule_feed(mapping=mapping, due_at=scheduled_at.timestamp(), notify=notify)
+        else:
+            await publish_feed(mapping=mapping, notify=notify)
 
         return feed_schema
     except Exception as e:
@@ -151,7 +151,7 @@ async def update_feed_route(
         my_logger.debug(f"feed_visibility: {feed_visibility}")
         my_logger.debug(f"comment_policy: {comment_policy}")
 
-        stmt = select(FeedModel).where(FeedModel.id == feed_id)
+        stmt = select(FeedModel).where(FeedModel.id == feed_id).options(selectinload(FeedModel.tags))
         result: Result = await session.execute(stmt)
         feed: Optional[FeedModel] = result.scalar_one_or_none()
         if feed is None:
@@ -168,12 +168,15 @@ async def update_feed_route(
                 await cache_manager.update_feed(feed_id=feed_id.hex, key="body", value=body)
 
         now = datetime.now(UTC)
-        if scheduled_at is not None and feed.scheduled_at > now:
+        # Only feeds that are still waiting for their time can be rescheduled
+        is_scheduled: bool = feed.scheduled_at is not None and feed.scheduled_at.replace(tzinfo=feed.scheduled_at.tzinfo or UTC) > now
+        if scheduled_at is not None and is_scheduled:
             max_future = now + timedelta(days=7)
             if scheduled_at < now:
                 raise ValidationException("Scheduled time cannot be in the past.")
             if scheduled_at > max_future:
                 raise ValidationException("Scheduled time cannot be more than 7 days in the future.")
+            feed.scheduled_at = scheduled_at
 
         if feed_visibility is not None and feed.feed_visibility != feed_visibility:
             feed.feed_visibility = feed_visibility
@@ -188,7 +191,8 @@ async def update_feed_route(
             if not category_exists:
                 raise HTTPException(status_code=400, detail="Invalid category ID.")
             feed.category_id = category_exists.id
-            await cache_manager.update_feed(feed_id=feed.id.hex, key="category_id", value=category_id)
+            await cache_manager.update_feed(feed_id=feed.id.hex, key="category_id", value=category_exists.id.hex)
+            await cache_manager.update_feed(feed_id=feed.id.hex, key="category", value=category_exists.name)
 
         if tags:
             tag_ids_in_db = await session.scalars(select(TagModel.id).where(TagModel.id.in_(tags)))
@@ -199,7 +203,7 @@ async def update_feed_route(
 
             db_tags = await session.scalars(select(TagModel).where(TagModel.id.in_(tags)))
             feed.tags.extend(db_tags.all())
-            await cache_manager.update_feed(feed_id=feed.id.hex, key="tags", value=tags)
+            await cache_manager.update_feed(feed_id=feed.id.hex, key="tags", value=[tag.name for tag in feed.tags])
 
         if remove_image and feed.image_url:
             await remove_objects_from_minio([feed.image_url])
@@ -237,6 +241,10 @@ async def update_feed_route(
         await session.refresh(instance=feed, attribute_names=["id", "created_at", "updated_at", "author", "tags", "category"])
 
         feed_schema = FeedSchema.model_validate(obj=feed)
+        if is_scheduled:
+            mapping = feed_schema.model_dump(exclude_unset=True, exclude_defaults=True, exclude_none=True, mode="json")
+            notify: bool = feed.feed_visibility in [FeedVisibility.public, FeedVisibility.followers]
+            await cache_manager.schedule_feed(mapping=mapping, due_at=feed.scheduled_at.replace(tzinfo=feed.scheduled_at.tzinfo or UTC).timestamp(), notify=notify)
         return feed_schema
     except Exception as e:
         my_logger.exception(f"Exception while creating post media, e: {e}")
@@ -258,10 +266,21 @@ async def delete_feed_route(jwt: strictJwtDependency, feed_id: UUID, session: DB
     await cache_manager.delete_feed(author_id=jwt.user_id.hex, feed_id=feed_id.hex)
 
 
+@feed_router.get(path="/fanout/{feed_id}", response_model=FanoutStatusSchema, status_code=200)
+async def fanout_status_route(jwt: strictJwtDependency, feed_id: UUID):
+    progress: dict[str, str] = await cache_manager.get_fanout_progress(feed_id=feed_id.hex)
+    if progress.get("author_id") != jwt.user_id.hex:
+        raise NotFoundException(detail="Fan-out job not found")
+
+    return {"status": progress.get("status"), "delivered": int(progress.get("delivered", 0))}
+
+
 @feed_router.get(path="/timeline/discover", response_model=FeedResponseSchema, response_model_exclude_none=True, response_model_exclude_defaults=True, status_code=200)
-async def discover_timeline_route(jwt: jwtDependency, start: int = 0, end: int = 9):
+async def discover_timeline_route(jwt: jwtDependency, start: int = 0, end: int = 9, cursor: Optional[str] = None):
+    if cursor and not is_timeline_cursor(cursor=cursor):
+        raise ValidationException(detail="Invalid timeline cursor")
     try:
-        feeds = await cache_manager.get_discover_timeline(user_id=jwt.user_id.hex if jwt is not None else None, start=start, end=end)
+        feeds = await cache_manager.get_discover_timeline(user_id=jwt.user_id.hex if jwt is not None else None, start=start, end=end, cursor=cursor)
         return feeds
     except Exception as e:
         print(f"Exception in discover_timeline_route: {e}")
@@ -269,9 +288,11 @@ async def discover_timeline_route(jwt: jwtDependency, start: int = 0, end: int =
 
 
 @feed_router.get(path="/timeline/following", response_model=FeedResponseSchema, response_model_exclude_none=True, response_model_exclude_defaults=True, status_code=200)
-async def following_timeline_route(jwt: strictJwtDependency, start: int = 0, end: int = 9):
+async def following_timeline_route(jwt: strictJwtDependency, start: int = 0, end: int = 9, cursor: Optional[str] = None):
+    if cursor and not is_timeline_cursor(cursor=cursor):
+        raise ValidationException(detail="Invalid timeline cursor")
     try:
-        feeds = await cache_manager.get_following_timeline(user_id=jwt.user_id.hex, start=start, end=end)
+        feeds = await cache_manager.get_following_timeline(user_id=jwt.user_id.hex, start=start, end=end, cursor=cursor)
         return feeds
     except Exception as e:
         my_logger.critical(f"Exception in following_timeline_route: {e}")
@@ -279,9 +300,13 @@ async def following_timeline_route(jwt: strictJwtDependency, start: int = 0, end
 
 
 @feed_router.get(path="/timeline/user", response_model=FeedResponseSchema, response_model_exclude_none=True, response_model_exclude_defaults=True, status_code=200)
-async def user_timeline_route(jwt: strictJwtDependency, engagement_type: EngagementType, user_id: Optional[UUID] = None, start: int = 0, end: int = 9):
+async def user_timeline_route(jwt: strictJwtDependency, engagement_type: EngagementType, user_id: Optional[UUID] = None, start: int = 0, end: int = 9, cursor: Optional[str] = None):
+    if cursor and not is_timeline_cursor(cursor=cursor):
+        raise ValidationException(detail="Invalid timeline cursor")
     try:
-        feeds = await cache_manager.get_user_timeline(user_id=user_id.hex if user_id else jwt.user_id.hex, engagement_type=engagement_type, start=start, end=end)
+        feeds = await cache_manager.get_user_timeline(
+            user_id=user_id.hex if user_id else jwt.user_id.hex, engagement_type=engagement_type, start=start, end=end, cursor=cursor
+        )
         return feeds
     except Exception as e:
         my_logger.debug(f"Exception in user_timeline route: {e}")
@@ -306,9 +331,8 @@ async def get_comments(jwt: strictJwtDependency, feed_id: UUID, session: DBSessi
             my_logger.debug(f"comments: {comments}, comments[0].__dict__: {comments[0].__dict__}")
             my_logger.debug(f"comments: {comments}, comments[0].author.username: {comments[0].author.username}")
 
-        end: int = await cache_manager.get_comments_count(feed_id=feed_id.hex)
+        end, engagements = await cache_manager.get_comments_engagements(feed_id=feed_id.hex, comment_ids=[comment.id.hex for comment in comments], user_id=jwt.user_id.hex)
         my_logger.debug(f"end: {end}")
-        engagements: list[dict] = await asyncio.gather(*[cache_manager.get_engagement(user_id=jwt.user_id.hex, feed_id=comment.id.hex, is_comment=True) for comment in comments])
         schemas: list[FeedSchema] = [FeedSchema.model_validate({**comment.__dict__, "engagement": engagement}) for comment, engagement in zip(comments, engagements)]
 
         return {"feeds": schemas, "end": end}
@@ -381,9 +405,31 @@ async def remove_engagement(jwt: strictJwtDependency, feed_id: UUID, engagement_
 
 
 @feed_router.get(path="/search", response_model=FeedResponseSchema, status_code=200)
-async def feed_search(jwt: jwtDependency, query: str, offset: int = 0, limit: int = 10):
+async def feed_search(
+        jwt: jwtDependency,
+        query: str = "",
+        offset: int = 0,
+        limit: int = 10,
+        author_id: Optional[UUID] = None,
+        category_id: Optional[UUID] = None,
+        tag: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        sort: Optional[Literal["recent", "top"]] = None,
+):
     try:
-        return await cache_manager.search_feed(query=query, user_id=jwt.user_id.hex if jwt.user_id is not None else None, offset=offset, limit=limit)
+        return await cache_manager.search_feed(
+            query=query,
+            user_id=jwt.user_id.hex if jwt.user_id is not None else None,
+            offset=offset,
+            limit=limit,
+            author_id=author_id.hex if author_id is not None else None,
+            category_id=category_id.hex if category_id is not None else None,
+            tag=tag,
+            since=since.timestamp() if since is not None else None,
+            until=until.timestamp() if until is not None else None,
+            sort=sort,
+        )
     except Exception as exception:
         my_logger.critical(f"Exception in feed_search: {exception}")
         raise HTTPException(status_code=500, detail="🤯 WTF? Something just exploded on our end. Try again later!")
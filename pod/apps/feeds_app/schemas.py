@@ -61,6 +61,7 @@ class FeedSchema(BaseModel):
     comment_policy: CommentPolicy
     quote_id: Optional[UUID] = None
     parent_id: Optional[UUID] = None
+    category_id: Optional[UUID] = None
     category: Optional[CategorySchema] = None
     tags: list[TagSchema] = []
     engagement: Optional[EngagementSchema] = None
@@ -72,7 +73,13 @@ class FeedSchema(BaseModel):
 
 class FeedResponseSchema(BaseModel):
     feeds: list[FeedSchema]
-    end: int
+    end: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+
+class FanoutStatusSchema(BaseModel):
+    status: str
+    delivered: int = 0
 
 
 class ReportOut(BaseModel):
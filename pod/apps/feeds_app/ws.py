@@ -1,10 +1,9 @@
 import asyncio
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from redis.asyncio.client import PubSub
 
 from settings.my_dependency import websocketDependency
-from settings.my_redis import cache_manager, pubsub_manager
+from settings.my_redis import Subscription, cache_manager, pubsub_manager
 from settings.my_websocket import home_timeline_ws_manager
 from utility.my_enums import PubSubTopics
 from utility.my_logger import my_logger
@@ -35,10 +34,10 @@ async def home_timeline(websocket_dependency: websocketDependency):
         my_logger.info(f"WebSocket disconnected: {user_id}")
     finally:
         if pubsub is not None:
-            await _cleanup_connection(user_id, pubsub, listener_task, receiver_task)
+            await _cleanup_connection(user_id, websocket, pubsub, listener_task, receiver_task)
 
 
-async def _pubsub_listener(pubsub: PubSub, websocket: WebSocket):
+async def _pubsub_listener(pubsub: Subscription, websocket: WebSocket):
     try:
         async for message in pubsub.listen():
             if message["type"] == "message":
@@ -59,12 +58,13 @@ async def _websocket_receiver(websocket: WebSocket):
         my_logger.debug("WebSocket receiver disconnected")
 
 
-async def _cleanup_connection(user_id: str, pubsub: PubSub, *tasks):
+async def _cleanup_connection(user_id: str, websocket: WebSocket, pubsub: Subscription, *tasks):
     for task in tasks:
         if task and not task.done():
             task.cancel()
-    await home_timeline_ws_manager.disconnect(user_id=user_id)
-    await cache_manager.remove_user_from_feeds(user_id)
+    await home_timeline_ws_manager.disconnect(user_id=user_id, websocket=websocket)
+    if user_id not in home_timeline_ws_manager.authorized_connections:
+        await cache_manager.remove_user_from_feeds(user_id)
     if pubsub:
         await pubsub.close()
     my_logger.info(f"Cleaned up connection for {user_id}")
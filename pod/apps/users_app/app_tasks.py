@@ -1,17 +1,24 @@
-from typing import Annotated, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncIterator, Optional
 from uuid import UUID
 
-from sqlalchemy import exists, select, delete
+from sqlalchemy import Select, delete, exists, func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from taskiq import TaskiqDepends
+from sqlalchemy.orm import selectinload
+from taskiq import Context, TaskiqDepends
 
+from apps.feeds_app.models import EngagementModel, FeedModel
+from apps.feeds_app.schemas import FeedSchema
 from apps.users_app.models import FollowModel, UserModel, BlockModel
+from apps.users_app.schemas import ProfileSchema
 from services.zepto_service import ZeptoMail
 from settings.my_database import get_session
 from settings.my_exceptions import NotFoundException
-from settings.my_redis import pubsub_manager
+from settings.my_minio import wipe_objects_from_minio
+from settings.my_redis import cache_manager, pubsub_manager, search_index_manager
 from settings.my_taskiq import broker
-from utility.my_enums import FollowPolicy, FollowStatus, PubSubTopics
+from utility.my_enums import EngagementType, FollowPolicy, FollowStatus, PubSubTopics
 from utility.my_logger import my_logger
 
 
@@ -38,6 +45,16 @@ async def notify_settings_stats():
     return {"ok": True}
 
 
+@broker.task(task_name="delete_account_task", retry_on_error=True, max_retries=5)
+async def delete_account_task(user_id: str, context: Annotated[Context, TaskiqDepends()]):
+    """The taskiq task id doubles as the job id, retries keep it and resume from teardown:{job_id}."""
+    await wipe_objects_from_minio(user_id=user_id)
+    progress: dict[str, str] = await cache_manager.delete_profile(user_id=user_id, job_id=context.message.task_id)
+    my_logger.info(f"🧹 Account {user_id} torn down, {progress.get('deleted')} items removed")
+
+    return {"ok": True}
+
+
 @broker.task(task_name="add_follow_to_db")
 async def add_follow_to_db(user_id: UUID, following_id: UUID, session: Annotated[AsyncSession, TaskiqDepends(get_session)]):
     user: Optional[UserModel] = await session.get(UserModel, user_id)
@@ -93,9 +110,9 @@ async def toggle_block_user_task(blocker_id: UUID, blocked_id: UUID, symmetrical
     if existing_block:
         await session.delete(existing_block)
 
-        if symmetrical:
-            reverse_stmt = delete(BlockModel).where(BlockModel.blocker_id == blocked_id, BlockModel.blocked_id == blocker_id)
-            await session.execute(reverse_stmt)
+        # Blocking someone who already blocks you is refused below and by the cache first, so the reverse row can only come from a symmetrical block
+        reverse_stmt = delete(BlockModel).where(BlockModel.blocker_id == blocked_id, BlockModel.blocked_id == blocker_id)
+        await session.execute(reverse_stmt)
 
         await session.commit()
         return {"ok": True, "action": "unblocked"}
@@ -104,8 +121,10 @@ async def toggle_block_user_task(blocker_id: UUID, blocked_id: UUID, symmetrical
         is_blocked_by_target_stmt = select(BlockModel.id).where(BlockModel.blocker_id == blocked_id, BlockModel.blocked_id == blocker_id)
         is_blocked_by_target = (await session.execute(select(is_blocked_by_target_stmt.exists()))).scalar()
 
+        # The route refuses this through the cache already, retrying could never succeed
         if is_blocked_by_target:
-            raise ValueError("Cannot block a user who has already blocked you.")
+            my_logger.warning(f"{blocker_id} cannot block {blocked_id}, who already blocks them")
+            return {"ok": False, "action": "refused"}
 
         instances = [BlockModel(blocker_id=blocker_id, blocked_id=blocked_id)]
         if symmetrical:
@@ -114,3 +133,162 @@ async def toggle_block_user_task(blocker_id: UUID, blocked_id: UUID, symmetrical
         session.add_all(instances)
         await session.commit()
         return {"ok": True, "action": "blocked"}
+
+
+@broker.task(task_name="rebuild_cache_task")
+async def rebuild_cache_task(session: Annotated[AsyncSession, TaskiqDepends(get_session)], batch_size: int = 2000):
+    """Rebuild every key CacheManager reads from Postgres after Redis was flushed or a new node came up."""
+    return await _rebuild_cache(session=session, batch_size=batch_size)
+
+
+@broker.task(task_name="rebuild_user_cache_task")
+async def rebuild_user_cache_task(user_id: str, session: Annotated[AsyncSession, TaskiqDepends(get_session)], batch_size: int = 2000):
+    """Rebuild only one user's profile, feeds, follow edges, blocks and engagements, scheduled on a profile cache miss."""
+    return await _rebuild_cache(session=session, batch_size=batch_size, user_id=UUID(hex=user_id))
+
+
+@broker.task(task_name="reindex_search_task")
+async def reindex_search_task(alias: str):
+    """Rebuild one search index online, the alias only moves once the new build is complete."""
+    index_name: str = await search_index_manager.reindex(alias=alias)
+    return {"ok": True, "index": index_name}
+
+
+@broker.task(task_name="seed_identity_filters_task", retry_on_error=True, max_retries=3)
+async def seed_identity_filters_task(session: Annotated[AsyncSession, TaskiqDepends(get_session)], batch_size: int = 5000):
+    """
+    Rebuild the username and email Bloom filters from Postgres, enqueued once after the deploy by main.ROLLOUT_TASKS.
+    Registration treats every value as possibly taken until the seeded marker is written at the end.
+    """
+    await cache_manager.reset_identity_filters()
+    seeded = 0
+    async for rows in _stream(session=session, stmt=select(UserModel.username, UserModel.email), batch_size=batch_size):
+        await cache_manager.seed_identity_filters(usernames=[username for username, _ in rows], emails=[email for _, email in rows])
+        seeded += len(rows)
+    await cache_manager.mark_identity_filters_seeded()
+
+    my_logger.info(f"🌸 Identity filters seeded with {seeded} users")
+    return {"ok": True, "seeded": seeded}
+
+
+@broker.task(task_name="seed_username_suggestions_task", retry_on_error=True, max_retries=3)
+async def seed_username_suggestions_task(session: Annotated[AsyncSession, TaskiqDepends(get_session)], batch_size: int = 5000):
+    """Fill the username suggestions from Postgres, enqueued once after the deploy by main.ROLLOUT_TASKS and safe to run again."""
+    seeded = 0
+    async for rows in _stream(session=session, stmt=select(UserModel.id, UserModel.username), batch_size=batch_size):
+        await cache_manager.seed_username_suggestions(users=[(user_id.hex, username) for user_id, username in rows])
+        seeded += len(rows)
+
+    my_logger.info(f"🔤 Username suggestions seeded with {seeded} users")
+    return {"ok": True, "seeded": seeded}
+
+
+async def _rebuild_cache(session: AsyncSession, batch_size: int, user_id: Optional[UUID] = None) -> dict:
+    metrics: dict[str, dict] = {}
+
+    feeds_count = select(func.count(FeedModel.id)).where(FeedModel.author_id == UserModel.id, FeedModel.parent_id.is_(None)).correlate(UserModel).scalar_subquery()
+    stmt = select(UserModel, feeds_count)
+    if user_id is not None:
+        stmt = stmt.where(UserModel.id == user_id)
+    async with _throughput(metrics=metrics, phase="profiles") as phase_metrics:
+        async for rows in _stream(session=session, stmt=stmt, batch_size=batch_size):
+            mappings: list[dict] = []
+            for user, count in rows:
+                mapping: dict = ProfileSchema.model_validate(obj=user).model_dump(exclude_unset=True, exclude_defaults=True, exclude_none=True, mode="json")
+                mappings.append({**mapping, "feeds_count": count})
+            await cache_manager.rebuild_profiles(mappings=mappings)
+            phase_metrics["rows"] += len(rows)
+
+    stmt = select(FeedModel).order_by(FeedModel.created_at.asc()).options(selectinload(FeedModel.author), selectinload(FeedModel.tags), selectinload(FeedModel.category))
+    if user_id is not None:
+        stmt = stmt.where(FeedModel.author_id == user_id)
+    async with _throughput(metrics=metrics, phase="feeds") as phase_metrics:
+        async for rows in _stream(session=session, stmt=stmt, batch_size=batch_size):
+            feeds: list[dict] = [FeedSchema.model_validate(obj=feed).model_dump(exclude_unset=True, exclude_defaults=True, exclude_none=True, mode="json") for feed, in rows]
+            counts, comment_ids = await _feed_counts(session=session, feed_ids=[feed.id for feed, in rows])
+            await cache_manager.rebuild_feeds(feeds=feeds, counts=counts, comment_ids=comment_ids)
+            phase_metrics["rows"] += len(rows)
+
+    stmt = select(FollowModel.follower_id, FollowModel.following_id).where(FollowModel.follow_status == FollowStatus.accepted)
+    if user_id is not None:
+        stmt = stmt.where(or_(FollowModel.follower_id == user_id, FollowModel.following_id == user_id))
+    async with _throughput(metrics=metrics, phase="follows") as phase_metrics:
+        async for rows in _stream(session=session, stmt=stmt, batch_size=batch_size):
+            edges: list[tuple[str, str]] = [(follower_id.hex, following_id.hex) for follower_id, following_id in rows]
+            await cache_manager.rebuild_follows(edges=edges, user_id=user_id.hex if user_id else None)
+            phase_metrics["rows"] += len(rows)
+
+    # Only the user's own blocked set, blocks by others live in their sets
+    stmt = select(BlockModel.blocker_id, BlockModel.blocked_id)
+    if user_id is not None:
+        stmt = stmt.where(BlockModel.blocker_id == user_id)
+    async with _throughput(metrics=metrics, phase="blocks") as phase_metrics:
+        async for rows in _stream(session=session, stmt=stmt, batch_size=batch_size):
+            await cache_manager.rebuild_blocks(edges=[(blocker_id.hex, blocked_id.hex) for blocker_id, blocked_id in rows])
+            phase_metrics["rows"] += len(rows)
+
+    stmt = (
+        select(EngagementModel.user_id, EngagementModel.feed_id, EngagementModel.engagement_type, EngagementModel.created_at, FeedModel.parent_id.is_not(None))
+        .join(FeedModel, EngagementModel.feed_id == FeedModel.id)
+        .where(EngagementModel.engagement_type != EngagementType.feeds)
+    )
+    # A user's rebuild writes their engagement indexes and the engagement sets of their own feeds, never another user's keys
+    passes: list[tuple[Select, dict]] = [(stmt, {})]
+    if user_id is not None:
+        passes = [(stmt.where(EngagementModel.user_id == user_id), {"feed_sets": False}), (stmt.where(FeedModel.author_id == user_id), {"indexes": False})]
+    async with _throughput(metrics=metrics, phase="engagements") as phase_metrics:
+        for pass_stmt, targets in passes:
+            async for rows in _stream(session=session, stmt=pass_stmt, batch_size=batch_size):
+                engagements = [(uid.hex, fid.hex, engagement_type.value, created_at.timestamp(), bool(is_comment)) for uid, fid, engagement_type, created_at, is_comment in rows]
+                await cache_manager.rebuild_engagements(engagements=engagements, **targets)
+                phase_metrics["rows"] += len(rows)
+
+    # Pull authors have to be known for everyone before any following timeline is unioned
+    stmt = select(UserModel.id) if user_id is None else select(UserModel.id).where(UserModel.id == user_id)
+    for phase, rebuild in (("pull_authors", cache_manager.rebuild_pull_authors), ("following_timelines", cache_manager.rebuild_following_timelines)):
+        async with _throughput(metrics=metrics, phase=phase) as phase_metrics:
+            async for rows in _stream(session=session, stmt=stmt, batch_size=batch_size):
+                await rebuild(user_ids=[uid.hex for uid, in rows])
+                phase_metrics["rows"] += len(rows)
+
+    my_logger.info(f"♻️ Cache rebuilt{f' for {user_id.hex}' if user_id else ''}: {metrics}")
+    return {"ok": True, "metrics": metrics}
+
+
+async def _feed_counts(session: AsyncSession, feed_ids: list[UUID]) -> tuple[dict[str, dict[str, int]], dict[str, list[str]]]:
+    """Counters and comment ids of a batch of feeds and comments, grouped in Postgres rather than read from partially rebuilt sets."""
+    counts: dict[str, dict[str, int]] = {}
+    stmt = (
+        select(EngagementModel.feed_id, EngagementModel.engagement_type, func.count())
+        .where(EngagementModel.feed_id.in_(feed_ids), EngagementModel.engagement_type != EngagementType.feeds)
+        .group_by(EngagementModel.feed_id, EngagementModel.engagement_type)
+    )
+    for feed_id, engagement_type, count in await session.execute(stmt):
+        counts.setdefault(feed_id.hex, {})[engagement_type.value] = count
+
+    comment_ids: dict[str, list[str]] = {}
+    for parent_id, comment_id in await session.execute(select(FeedModel.parent_id, FeedModel.id).where(FeedModel.parent_id.in_(feed_ids))):
+        comment_ids.setdefault(parent_id.hex, []).append(comment_id.hex)
+    for parent_id, ids in comment_ids.items():
+        counts.setdefault(parent_id, {})["comments"] = len(ids)
+    return counts, comment_ids
+
+
+async def _stream(session: AsyncSession, stmt: Select, batch_size: int) -> AsyncIterator[list]:
+    """Server-side cursor over stmt, yielding batch_size rows at a time without loading the whole result."""
+    result = await session.stream(stmt.execution_options(yield_per=batch_size))
+    async for partition in result.partitions(batch_size):
+        yield partition
+
+
+@asynccontextmanager
+async def _throughput(metrics: dict, phase: str) -> AsyncIterator[dict]:
+    """Time one rebuild phase, the caller adds its processed rows to the yielded dict."""
+    phase_metrics: dict = {"rows": 0}
+    started_at = time.perf_counter()
+    yield phase_metrics
+
+    seconds = time.perf_counter() - started_at
+    phase_metrics.update({"seconds": round(seconds, 2), "rows_per_second": round(phase_metrics["rows"] / seconds) if seconds else phase_metrics["rows"]})
+    metrics[phase] = phase_metrics
+    my_logger.info(f"♻️ Rebuilt {phase}: {phase_metrics}")
@@ -7,10 +7,12 @@ from fastapi import APIRouter, File, HTTPException, UploadFile
 from firebase_admin.auth import UserRecord
 from sqlalchemy import exists, select
 
-from apps.users_app.app_tasks import (add_follow_to_db, delete_follow_from_db,
-                                      notify_settings_stats, send_email_task, toggle_block_user_task)
+from apps.users_app.app_tasks import (add_follow_to_db, delete_account_task, delete_follow_from_db,
+                                      notify_settings_stats, rebuild_user_cache_task, send_email_task,
+                                      toggle_block_user_task)
 from apps.users_app.models import FollowModel, UserModel
-from apps.users_app.schemas import (ForgotPasswordTokenSchema, LoginSchema,
+from apps.users_app.schemas import (AccountDeletionSchema, AccountDeletionStatusSchema,
+                                    ForgotPasswordTokenSchema, LoginSchema,
                                     ProfileSchema, ProfileSearchSchema,
                                     ProfileTokenSchema,
                                     ProfileUpdateMediaSchema,
@@ -19,7 +21,7 @@ from apps.users_app.schemas import (ForgotPasswordTokenSchema, LoginSchema,
                                     RequestForgotPasswordSchema,
                                     ResetPasswordSchema, ResultSchema,
                                     TokenSchema, UserSearchResponseSchema,
-                                    VerifySchema)
+                                    UserSuggestionResponseSchema, VerifySchema)
 from services.firebase_service import verify_id_token
 from settings.my_database import DBSession
 from settings.my_dependency import (create_jwt_token, headerTokenDependency,
@@ -27,8 +29,7 @@ from settings.my_dependency import (create_jwt_token, headerTokenDependency,
 from settings.my_exceptions import (AlreadyExistException,
                                     HeaderTokenException, NotFoundException,
                                     ValidationException)
-from settings.my_minio import (put_object_to_minio, remove_objects_from_minio,
-                               wipe_objects_from_minio)
+from settings.my_minio import put_object_to_minio, remove_objects_from_minio
 from settings.my_redis import cache_manager
 from utility.my_enums import FollowStatus
 from utility.my_logger import my_logger
@@ -46,17 +47,23 @@ async def register_route(schema: RegisterSchema, htd: headerTokenDependency) ->
         if await cache_manager.exists(name=f"tokens:registration:{htd.verify_token}"):
             raise HeaderTokenException(detail="Check your email! Your verification token is on its way.")
 
-    is_username_pending, is_email_pending = await cache_manager.is_username_or_email_pending(username=schema.username, email=schema.email)
+    reservation = await cache_manager.reserve_registration(username=schema.username, email=schema.email)
+    is_username_pending, is_email_pending, is_username_maybe_taken, is_email_maybe_taken = reservation
     if is_username_pending:
-        raise ValueError("Someone is already registering with this username.")
+        raise AlreadyExistException(detail="Someone is already registering with this username.")
     if is_email_pending:
-        raise ValueError("Someone is already registering with this email.")
+        raise AlreadyExistException(detail="Someone is already registering with this email.")
 
-    is_username_taken, is_email_taken = await cache_manager.is_username_or_email_taken(username=schema.username, email=schema.email)
-    if is_username_taken:
-        raise AlreadyExistException(detail="Username already exists.")
-    if is_email_taken:
-        raise AlreadyExistException(detail="Email already exists.")
+    if is_username_maybe_taken or is_email_maybe_taken:
+        is_username_taken, is_email_taken = await cache_manager.is_username_or_email_taken(
+            username=schema.username, email=schema.email, check_username=is_username_maybe_taken, check_email=is_email_maybe_taken
+        )
+        if is_username_taken or is_email_taken:
+            await cache_manager.release_registration(username=schema.username, email=schema.email)
+        if is_username_taken:
+            raise AlreadyExistException(detail="Username already exists.")
+        if is_email_taken:
+            raise AlreadyExistException(detail="Email already exists.")
 
     code = f"{randint(0, 9999):04}"
     mapping = {**schema.model_dump(), "code": code}
@@ -90,6 +97,7 @@ async def verify_route(htd: headerTokenDependency, schema: VerifySchema, session
     await session.refresh(instance=user)
 
     await cache_manager.remove_registration_credentials(verify_token=htd.verify_token)
+    await cache_manager.release_registration(username=cache.get("username", ""), email=cache.get("email", ""))
 
     await cache_manager.incr_statistics()
 
@@ -241,6 +249,10 @@ async def get_profile_route(jwt: strictJwtDependency, session: DBSession, target
     if not user:
         raise ValueError("User not found")
 
+    # A missing profile usually means the rest of the user's keys are gone too
+    if await cache_manager.claim_rebuild(user_id=user.id.hex):
+        await rebuild_user_cache_task.kiq(user_id=user.id.hex)
+
     return await cache_profile(user=user, user_id=jwt.user_id.hex, is_following=is_following)
 
 
@@ -365,24 +377,31 @@ async def update_profile_route(
         raise ValidationException(detail=str(e))
 
 
-@users_router.delete(path="/profile/delete", response_model=ResultSchema, status_code=200)
+@users_router.delete(path="/profile/delete", response_model=AccountDeletionSchema, status_code=200)
 async def delete_profile_route(jwt: strictJwtDependency, session: DBSession):
     user: Optional[UserModel] = await session.get(UserModel, jwt.user_id)
 
     if user is None:
         return {"ok": False}
 
-    # delete all media files
-    await wipe_objects_from_minio(user_id=jwt.user_id.hex)
-
-    # delete from redis
-    await cache_manager.delete_profile(user_id=jwt.user_id.hex)
-
-    # delete from database
+    # delete from database, media files and redis are torn down in the background
     await session.delete(instance=user)
     await session.commit()
 
-    return {"ok": True}
+    task = await delete_account_task.kiq(user_id=jwt.user_id.hex)
+
+    return {"ok": True, "job_id": task.task_id}
+
+
+@users_router.get(path="/profile/delete/{job_id}", response_model=AccountDeletionStatusSchema, status_code=200)
+async def delete_profile_status_route(jwt: strictJwtDependency, job_id: str):
+    progress: dict[str, str] = await cache_manager.get_teardown_progress(job_id=job_id)
+    if not progress:
+        return {"status": "queued"}
+    if progress.get("user_id") != jwt.user_id.hex:
+        raise NotFoundException(detail="Account deletion job not found")
+
+    return {"status": progress.get("status"), "phase": progress.get("phase") or None, "deleted": int(progress.get("deleted", 0))}
 
 
 @users_router.post(path="/follow", response_model=ResultSchema, status_code=200)
@@ -440,7 +459,7 @@ async def toggle_block_user(jwt: strictJwtDependency, blocked_id: UUID, symmetri
         await toggle_block_user_task.kiq(blocker_id=jwt.user_id, blocked_id=blocked_id, symmetrical=symmetrical)
         return {"ok": True}
     except ValueError as ve:
-        raise HTTPException(status_code=500, detail=str(ve))
+        raise HTTPException(status_code=403, detail=str(ve))
     except Exception as e:
         my_logger.exception(f"Exception while blocking the user, e: {e}")
         raise HTTPException(status_code=500, detail="We couldn't block the user.")
@@ -471,6 +490,18 @@ async def user_search(jwt: jwtDependency, query: str, offset: int = 0, limit: in
         raise HTTPException(status_code=500, detail="🤯 WTF? Something just exploded on our end. Try again later!")
 
 
+@users_router.get(path="/autocomplete", response_model=UserSuggestionResponseSchema, response_model_exclude_none=True, status_code=200)
+async def user_autocomplete(jwt: jwtDependency, prefix: str, limit: int = 10):
+    try:
+        if not prefix.strip():
+            return {"users": []}
+        users = await cache_manager.autocomplete_usernames(prefix=prefix, limit=min(limit, 20))
+        return {"users": users}
+    except Exception as exception:
+        my_logger.critical(f"Exception in user_autocomplete: {exception}")
+        raise HTTPException(status_code=500, detail="🤯 WTF? Something just exploded on our end. Try again later!")
+
+
 def generate_tokens(user_id: str) -> dict:
     subject = {"id": user_id}
     return {"access_token": create_jwt_token(subject=subject), "refresh_token": create_jwt_token(subject=subject, for_refresh=True)}
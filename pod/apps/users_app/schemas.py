@@ -205,6 +205,16 @@ class ResultSchema(BaseModel):
     ok: bool
 
 
+class AccountDeletionSchema(ResultSchema):
+    job_id: Optional[str] = None
+
+
+class AccountDeletionStatusSchema(BaseModel):
+    status: str
+    phase: Optional[str] = None
+    deleted: int = 0
+
+
 class ProfileSearchSchema(ProfileSchema):
     is_following: Optional[bool] = None
 
@@ -212,3 +222,13 @@ class ProfileSearchSchema(ProfileSchema):
 class UserSearchResponseSchema(BaseModel):
     users: list[ProfileSearchSchema]
     end: int
+
+
+class UserSuggestionSchema(BaseModel):
+    id: UUID
+    username: str
+    avatar_url: Optional[str] = None
+
+
+class UserSuggestionResponseSchema(BaseModel):
+    users: list[UserSuggestionSchema]
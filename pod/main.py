@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from typing import Optional
@@ -11,10 +12,12 @@ from prometheus_fastapi_instrumentator import Instrumentator
 
 from apps.admin_app.ws import admin_ws_router
 from apps.chats_app.routes import chats_router
-from apps.chats_app.ws import chat_ws_router
+from apps.chats_app.ws import chat_ws_router, flush_pending_offline, sweep_presence
+from apps.feeds_app.app_tasks import backfill_engagement_counts_task, migrate_user_engagement_indexes_task
 from apps.feeds_app.routes import feed_router
 from apps.feeds_app.ws import feed_ws_router
 from apps.notes_app.routes import notes_router
+from apps.users_app.app_tasks import seed_identity_filters_task, seed_username_suggestions_task
 from apps.users_app.routes import users_router
 from apps.vocabularies_app.routes import vocabularies_router
 from services.firebase_service import initialize_firebase
@@ -23,18 +26,23 @@ from settings.my_config import get_settings
 from settings.my_database import initialize_db
 from settings.my_exceptions import ApiException
 from settings.my_minio import initialize_minio
-from settings.my_redis import initialize_redis_indexes, cache_manager
+from settings.my_redis import cache_manager, pubsub_manager, search_index_manager, stream_manager
 from settings.my_taskiq import broker
+from settings.my_websocket import chat_event_router
 from utility.my_logger import my_logger
 
 settings = get_settings()
 
+# One-off backfills for keys written by earlier releases, each is enqueued by the first replica that starts after the deploy
+ROLLOUT_TASKS = [backfill_engagement_counts_task, migrate_user_engagement_indexes_task, seed_username_suggestions_task, seed_identity_filters_task]
+
 
 @asynccontextmanager
 async def app_lifespan(_app: FastAPI):
     my_logger.warning("🚀 Starting app_lifespan...")
     nltk.download("punkt_tab")
-    await initialize_redis_indexes()
+    # Index builds can take a while on large keyspaces, the aliases keep serving the previous versions meanwhile
+    index_builder: asyncio.Task = asyncio.create_task(search_index_manager.ensure())
 
     try:
         initialize_firebase()
@@ -56,11 +64,24 @@ async def app_lifespan(_app: FastAPI):
     except Exception as e:
         my_logger.exception(f"initialization exception startup, e: {e}")
 
-        instrumentator.expose(_app)
-        if not broker.is_worker_process:
-            await broker.startup()
+    instrumentator.expose(_app)
+    if not broker.is_worker_process:
+        await broker.startup()
+        await enqueue_rollout_tasks()
+    local_cache_listener: asyncio.Task = asyncio.create_task(cache_manager.listen_local_cache_invalidations())
+    chat_delivery: asyncio.Task = asyncio.create_task(chat_event_router.run())
+    presence_sweeper: asyncio.Task = asyncio.create_task(sweep_presence())
     yield
 
+    # Announced before the pubsub connection closes, the sweeper of another node would otherwise catch them much later
+    await flush_pending_offline()
+    background_tasks: list[asyncio.Task] = [local_cache_listener, index_builder, chat_delivery, presence_sweeper]
+    for task in background_tasks:
+        task.cancel()
+    # Their cleanup still unsubscribes from the shared pubsub connection, so it is closed only once they finished
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await stream_manager.close()
+    await pubsub_manager.close()
     try:
         if not broker.is_worker_process:
             await broker.shutdown()
@@ -68,6 +89,16 @@ async def app_lifespan(_app: FastAPI):
         my_logger.exception(f"Exception in app_lifespan shutdown, e: {e}")
 
 
+async def enqueue_rollout_tasks():
+    for task in ROLLOUT_TASKS:
+        try:
+            if await cache_manager.claim_rollout(name=task.task_name):
+                await task.kiq()
+                my_logger.info(f"🚚 Enqueued rollout task {task.task_name}")
+        except Exception as e:
+            my_logger.exception(f"Rollout task {task.task_name} could not be enqueued, e: {e}")
+
+
 app: FastAPI = FastAPI(lifespan=app_lifespan)
 instrumentator = Instrumentator().instrument(app)
 taskiq_fastapi.init(broker=broker, app_or_path=app)
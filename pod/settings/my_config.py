@@ -29,6 +29,41 @@ class Settings(BaseSettings):
 
     # REDIS
     REDIS_HOST: str = ""
+    PUBSUB_QUEUE_SIZE: int = 1000
+
+    # CACHE
+    COMPACT_CACHE_ENCODING: bool = False
+    AUTOCOMPLETE_CACHE_TTL: float = 10
+    IDENTITY_FILTER_CAPACITY: int = 1_000_000
+    IDENTITY_FILTER_ERROR_RATE: float = 0.001
+
+    # FEEDS
+    FANOUT_FOLLOWER_THRESHOLD: int = 10_000
+    # Pull authors only leave the pull set below this share of the threshold, so authors around it do not flap in and out
+    FANOUT_FOLLOWER_EXIT_RATIO: float = 0.8
+    FEED_HYDRATION_SCRIPT: bool = True
+    FEED_SEARCH_MAX_FOLLOWINGS: int = 1000
+    FEED_SCORE_EPSILON: float = 60
+    FEED_SCORE_HALF_LIFE_HOURS: float = 36
+    FEED_SCORE_WEIGHTS: dict[str, float] = {"comments": 5, "reposts": 5, "quotes": 5, "likes": 2, "views": 0.5, "bookmarks": 0}
+    LOCAL_CACHE_MAX_SIZE: int = 10_000
+    LOCAL_CACHE_TTL: float = 30
+    SCHEDULED_FEED_LEASE_SECONDS: int = 300
+    SCHEDULED_FEEDS_POLL_INTERVAL: float = 1
+
+    # CHATS
+    CHAT_STREAM_MAXLEN: int = 1000
+    CHAT_STREAM_TTL: int = 7 * 86400
+    CHAT_STREAM_BATCH_SIZE: int = 100
+    CHAT_STREAM_BLOCK_MS: int = 1000
+    CHAT_EPHEMERAL_EVENT_TTL: float = 10
+    PRESENCE_TTL: int = 60
+    PRESENCE_HEARTBEAT_INTERVAL: float = 20
+    PRESENCE_DEBOUNCE_SECONDS: float = 5
+    PRESENCE_BATCH_SECONDS: float = 1
+    TYPING_THROTTLE_SECONDS: float = 3
+    PRESENCE_SWEEP_INTERVAL: float = 30
+    PRESENCE_SWEEP_BATCH_SIZE: int = 500
 
     # FIREBASE ADMIN SDK
     FIREBASE_ADMINSDK: Optional[str] = None
@@ -0,0 +1,484 @@
+"""Server-side Lua scripts used by the cache managers, registered with Redis.register_script and executed through EVALSHA."""
+
+# KEYS[1] = viewer's blocked set, then {profile, followers, blocked} per author, then {counters, reposts, quotes, likes, views, bookmarks} per feed
+# ARGV[1..4] = stored profile fields of id, name, username and avatar_url, ARGV[5] = viewer id ("" for anonymous), ARGV[6] = number A of authors,
+# then one {author_id, "1" when its profile is wanted} pair per author and one {author index, feed_visibility} pair per feed
+# Returns one {counters, interactions, author_profile} entry per feed in the given order, an empty entry for feeds hidden from the viewer,
+# author_profile is left empty when the caller already holds it
+HYDRATE_FEEDS_LUA = """
+local viewer = ARGV[5]
+local authors = tonumber(ARGV[6])
+local engagement_keys = {"comments", "reposts", "quotes", "likes", "views", "bookmarks"}
+-- Stored fields first, then the plain names so hashes not migrated to the stored layout yet are still read
+local profile_fields = {ARGV[1], ARGV[2], ARGV[3], ARGV[4], "id", "name", "username", "avatar_url"}
+
+local function author_key(a, n)
+    return KEYS[1 + (a - 1) * 3 + n]
+end
+
+local profiles = {}
+local blocked = {}
+local following = {}
+
+local function get_profile(a)
+    if profiles[a] == nil then
+        profiles[a] = {}
+        if ARGV[6 + a * 2] == "1" then
+            local values = redis.call("HMGET", author_key(a, 1), unpack(profile_fields))
+            for k = 1, 4 do
+                profiles[a][k] = values[k] or values[k + 4]
+            end
+        end
+    end
+    return profiles[a]
+end
+
+local function is_blocked(a, author_id)
+    if viewer == "" then
+        return false
+    end
+    if blocked[a] == nil then
+        blocked[a] = redis.call("SISMEMBER", KEYS[1], author_id) == 1 or redis.call("SISMEMBER", author_key(a, 3), viewer) == 1
+    end
+    return blocked[a]
+end
+
+local function is_follower(a)
+    if following[a] == nil then
+        following[a] = redis.call("SISMEMBER", author_key(a, 2), viewer) == 1
+    end
+    return following[a]
+end
+
+local function is_visible(a, author_id, visibility)
+    if visibility == "public" then
+        return true
+    end
+    if viewer == "" then
+        return false
+    end
+    if visibility == "private" then
+        return viewer == author_id
+    end
+    if visibility == "followers" then
+        return viewer == author_id or is_follower(a)
+    end
+    return false
+end
+
+local feeds = {}
+local feeds_offset = 1 + authors * 3
+for i = 7 + authors * 2, #ARGV, 2 do
+    local a, visibility = tonumber(ARGV[i]), ARGV[i + 1]
+    local author_id = ARGV[5 + a * 2]
+    local feed_keys = feeds_offset + #feeds * 6
+
+    if is_visible(a, author_id, visibility) and not is_blocked(a, author_id) then
+        local counters = redis.call("HMGET", KEYS[feed_keys + 1], unpack(engagement_keys))
+        local interactions = {}
+        for k = 1, #engagement_keys do
+            counters[k] = tonumber(counters[k]) or 0
+            if viewer ~= "" and k > 1 then
+                interactions[k - 1] = redis.call("SISMEMBER", KEYS[feed_keys + k], viewer)
+            end
+        end
+        feeds[#feeds + 1] = {counters, interactions, get_profile(a)}
+    else
+        feeds[#feeds + 1] = {}
+    end
+end
+
+return feeds
+"""
+
+# KEYS[1] = users:{user_id}:{engagement type}, KEYS[2] = counts:{prefix}:{feed_id}, KEYS[3..8] = {prefix}:{feed_id}:{engagement key}
+# ARGV[1] = user id, ARGV[2] = feed id, ARGV[3] = engagement type, ARGV[4] = "1" to add or "0" to remove, ARGV[5] = engagement timestamp
+# Toggles the membership, keeps the counters hash in sync and returns {counters, interactions} for the user
+TOGGLE_ENGAGEMENT_LUA = """
+local engagement_keys = {"comments", "reposts", "quotes", "likes", "views", "bookmarks"}
+local user_id, feed_id, engagement_type, add, engaged_at = ARGV[1], ARGV[2], ARGV[3], ARGV[4] == "1", ARGV[5]
+
+-- The user index is a zset scored by engagement time, sets left over until the migration converts them are kept as sets
+local legacy_index = redis.call("TYPE", KEYS[1])["ok"] == "set"
+
+for k, key in ipairs(engagement_keys) do
+    if key == engagement_type then
+        local engagement_key = KEYS[k + 2]
+        local changed
+        if add then
+            changed = redis.call("SADD", engagement_key, user_id)
+            if legacy_index then
+                redis.call("SADD", KEYS[1], feed_id)
+            else
+                redis.call("ZADD", KEYS[1], "NX", engaged_at, feed_id)
+            end
+        else
+            changed = redis.call("SREM", engagement_key, user_id)
+            if legacy_index then
+                redis.call("SREM", KEYS[1], feed_id)
+            else
+                redis.call("ZREM", KEYS[1], feed_id)
+            end
+        end
+
+        -- Counters missing for feeds cached before the counters hash existed are seeded from the set itself
+        if redis.call("HEXISTS", KEYS[2], key) == 0 then
+            redis.call("HSET", KEYS[2], key, redis.call("SCARD", engagement_key))
+        elseif changed == 1 then
+            redis.call("HINCRBY", KEYS[2], key, add and 1 or -1)
+        end
+    end
+end
+
+local counters = redis.call("HMGET", KEYS[2], unpack(engagement_keys))
+local interactions = {}
+for k = 1, #engagement_keys do
+    counters[k] = tonumber(counters[k]) or 0
+    if k > 1 then
+        interactions[k - 1] = redis.call("SISMEMBER", KEYS[k + 2], user_id)
+    end
+end
+
+return {counters, interactions}
+"""
+
+# KEYS[1] = {prefix}:{parent_id}:comments, KEYS[2] = counts:{prefix}:{parent_id}, ARGV[1] = comment id, ARGV[2] = "1" to link or "0" to unlink
+# Keeps the comments counter in step with the set like TOGGLE_ENGAGEMENT_LUA, returns 1 when the set changed
+LINK_COMMENT_LUA = """
+local add = ARGV[2] == "1"
+local changed
+if add then
+    changed = redis.call("SADD", KEYS[1], ARGV[1])
+else
+    changed = redis.call("SREM", KEYS[1], ARGV[1])
+end
+
+-- Counters missing for parents cached before the counters hash existed are seeded from the set itself
+if redis.call("HEXISTS", KEYS[2], "comments") == 0 then
+    redis.call("HSET", KEYS[2], "comments", redis.call("SCARD", KEYS[1]))
+elseif changed == 1 then
+    redis.call("HINCRBY", KEYS[2], "comments", add and 1 or -1)
+end
+return changed
+"""
+
+# KEYS[1] = counts:{prefix}:{id}, KEYS[2..7] = {prefix}:{id}:{engagement key}
+# Rewrites every counter from its set in one step, so an engagement toggled meanwhile is never overwritten by a stale count
+SEED_ENGAGEMENT_COUNTS_LUA = """
+local engagement_keys = {"comments", "reposts", "quotes", "likes", "views", "bookmarks"}
+for k, key in ipairs(engagement_keys) do
+    redis.call("HSET", KEYS[1], key, redis.call("SCARD", KEYS[k + 1]))
+end
+return #engagement_keys
+"""
+
+# KEYS[1] = users:{user_id}:{engagement type}, ARGV[1] = fallback score, ARGV[2..] = {feed_id, engagement timestamp} pairs
+# Converts a legacy set index into a zset in place, members added after the caller read the set get the fallback score
+# Returns the number of converted members, 0 when the key is already a zset or missing
+MIGRATE_ENGAGEMENT_INDEX_LUA = """
+if redis.call("TYPE", KEYS[1])["ok"] ~= "set" then
+    return 0
+end
+
+local scores = {}
+for i = 2, #ARGV, 2 do
+    scores[ARGV[i]] = ARGV[i + 1]
+end
+
+local members = redis.call("SMEMBERS", KEYS[1])
+redis.call("DEL", KEYS[1])
+for _, feed_id in ipairs(members) do
+    redis.call("ZADD", KEYS[1], scores[feed_id] or ARGV[1], feed_id)
+end
+
+return #members
+"""
+
+# KEYS[1] = users:{user_id}:{engagement type} or users:{user_id}:comments, ARGV[1] = "1" to add or "0" to remove, ARGV[2] = score when adding, ARGV[3..] = feed ids
+# Engagement indexes are zsets, or sets until the migration converts them, so the command follows the stored type. Returns the number of changed members
+UPDATE_INDEX_LUA = """
+local add, score = ARGV[1] == "1", ARGV[2]
+local is_set = redis.call("TYPE", KEYS[1])["ok"] == "set"
+
+local changed = 0
+for i = 3, #ARGV do
+    if add and is_set then
+        changed = changed + redis.call("SADD", KEYS[1], ARGV[i])
+    elseif add then
+        changed = changed + redis.call("ZADD", KEYS[1], "NX", score, ARGV[i])
+    elseif is_set then
+        changed = changed + redis.call("SREM", KEYS[1], ARGV[i])
+    else
+        changed = changed + redis.call("ZREM", KEYS[1], ARGV[i])
+    end
+end
+return changed
+"""
+
+# KEYS[1..6] = blocker's blocked, followings, followers, profile, following_timeline and user_timeline, KEYS[7..12] = the same for the blocked user
+# ARGV[1] = blocker id, ARGV[2] = blocked id, ARGV[3] = "1" when the block also applies the other way around
+# Blocks when not blocked yet (cutting the follow edges and their counters and stripping the other user's feeds from the follower's
+# following timeline) and unblocks both directions otherwise, returns {blocker blocks blocked, blocked blocks blocker} after the toggle,
+# or -1 without changing anything when the blocked user already blocks the blocker
+TOGGLE_BLOCK_LUA = """
+local blocker, blocked, symmetrical = ARGV[1], ARGV[2], ARGV[3] == "1"
+local suffixes = {blocked = 1, followings = 2, followers = 3, profile = 4, following_timeline = 5, user_timeline = 6}
+local offsets = {[blocker] = 0, [blocked] = 6}
+
+local function key(user_id, suffix)
+    return KEYS[offsets[user_id] + suffixes[suffix]]
+end
+
+-- follower stops following followee, counters only move for edges that actually existed
+local function unfollow(follower, followee)
+    if redis.call("SREM", key(follower, "followings"), followee) == 1 then
+        redis.call("HINCRBY", key(follower, "profile"), "followings_count", -1)
+    end
+    if redis.call("SREM", key(followee, "followers"), follower) == 1 then
+        redis.call("HINCRBY", key(followee, "profile"), "followers_count", -1)
+    end
+
+    -- following timelines are trimmed, so walk them rather than the followee's whole user_timeline
+    local stale = {}
+    for _, feed_id in ipairs(redis.call("ZRANGE", key(follower, "following_timeline"), 0, -1)) do
+        if redis.call("ZSCORE", key(followee, "user_timeline"), feed_id) then
+            stale[#stale + 1] = feed_id
+        end
+    end
+    for i = 1, #stale, 500 do
+        redis.call("ZREM", key(follower, "following_timeline"), unpack(stale, i, math.min(i + 499, #stale)))
+    end
+end
+
+if redis.call("SISMEMBER", key(blocker, "blocked"), blocked) == 1 then
+    -- Blocking a user who already blocks you is refused below, so a reverse entry only exists because this block was symmetrical
+    redis.call("SREM", key(blocker, "blocked"), blocked)
+    redis.call("SREM", key(blocked, "blocked"), blocker)
+elseif redis.call("SISMEMBER", key(blocked, "blocked"), blocker) == 1 then
+    return -1
+else
+    redis.call("SADD", key(blocker, "blocked"), blocked)
+    unfollow(blocker, blocked)
+    if symmetrical then
+        redis.call("SADD", key(blocked, "blocked"), blocker)
+        unfollow(blocked, blocker)
+    end
+end
+
+return {redis.call("SISMEMBER", key(blocker, "blocked"), blocked), redis.call("SISMEMBER", key(blocked, "blocked"), blocker)}
+"""
+
+# KEYS[1] = follower's followings, KEYS[2] = followee's followers, KEYS[3] = follower's profile, KEYS[4] = followee's profile,
+# KEYS[5] = follower's following_timeline, KEYS[6] = followee's user_timeline, KEYS[7] = follower's blocked, KEYS[8] = followee's blocked,
+# KEYS[9] = pull authors set, ARGV[1] = follower id, ARGV[2] = followee id, ARGV[3] = following timeline size
+# Returns 1 when the followee blocks the follower, 2 when the follower blocks the followee and 0 once followed, copying only the newest
+# entries of the followee's user_timeline, authors in the pull set are merged at read time and are not copied at all
+FOLLOW_LUA = """
+local follower, followee, max_ft = ARGV[1], ARGV[2], tonumber(ARGV[3])
+
+if redis.call("SISMEMBER", KEYS[8], follower) == 1 then
+    return 1
+end
+if redis.call("SISMEMBER", KEYS[7], followee) == 1 then
+    return 2
+end
+
+if redis.call("SADD", KEYS[1], followee) == 1 then
+    redis.call("HINCRBY", KEYS[3], "followings_count", 1)
+end
+if redis.call("SADD", KEYS[2], follower) == 1 then
+    redis.call("HINCRBY", KEYS[4], "followers_count", 1)
+end
+
+if redis.call("SISMEMBER", KEYS[9], followee) == 0 then
+    local entries = redis.call("ZRANGE", KEYS[6], 0, max_ft - 1, "REV", "WITHSCORES")
+    if #entries > 0 then
+        local mapping = {}
+        for i = 1, #entries, 2 do
+            mapping[#mapping + 1] = entries[i + 1]
+            mapping[#mapping + 1] = entries[i]
+        end
+        redis.call("ZADD", KEYS[5], unpack(mapping))
+        redis.call("ZREMRANGEBYRANK", KEYS[5], 0, -max_ft - 1)
+    end
+end
+
+return 0
+"""
+
+# KEYS[1] = follower's followings, KEYS[2] = followee's followers, KEYS[3] = follower's profile, KEYS[4] = followee's profile,
+# KEYS[5] = follower's following_timeline, KEYS[6] = followee's user_timeline, ARGV[1] = follower id, ARGV[2] = followee id
+# Removes the follow edge and only the followee's feeds found in the trimmed following timeline, returns the number of removed feeds
+UNFOLLOW_LUA = """
+local follower, followee = ARGV[1], ARGV[2]
+
+if redis.call("SREM", KEYS[1], followee) == 1 then
+    redis.call("HINCRBY", KEYS[3], "followings_count", -1)
+end
+if redis.call("SREM", KEYS[2], follower) == 1 then
+    redis.call("HINCRBY", KEYS[4], "followers_count", -1)
+end
+
+-- ZINTER walks the smaller input, which is the trimmed following timeline
+local stale = redis.call("ZINTER", 2, KEYS[5], KEYS[6])
+for i = 1, #stale, 500 do
+    redis.call("ZREM", KEYS[5], unpack(stale, i, math.min(i + 499, #stale)))
+end
+
+return #stale
+"""
+
+# KEYS[1] = hash to rewrite, ARGV = {stored field, wanted field} pairs
+# Renames fields in place so writes racing with a migration are never lost, returns the number of renamed fields
+RENAME_HASH_FIELDS_LUA = """
+local renamed = 0
+for i = 1, #ARGV, 2 do
+    local value = redis.call("HGET", KEYS[1], ARGV[i])
+    if value then
+        redis.call("HSET", KEYS[1], ARGV[i + 1], value)
+        redis.call("HDEL", KEYS[1], ARGV[i])
+        renamed = renamed + 1
+    end
+end
+return renamed
+"""
+
+# KEYS[1] = lock key, ARGV[1] = token of the holder, ARGV[2] = new ttl in seconds, "0" to release
+# Extends or releases a SET NX lock only while the caller still holds it, returns 1 when it did
+EXTEND_LOCK_LUA = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+else
+    redis.call("DEL", KEYS[1])
+end
+return 1
+"""
+
+# KEYS[1] = hash, ARGV[1] = field, ARGV[2] = value
+# Writes the field only while the hash exists, so a hash deleted meanwhile never comes back partially, returns 1 when written
+SET_FIELD_IF_EXISTS_LUA = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS[1] = scheduled feeds zset scored by due time, KEYS[2] = their payloads hash, KEYS[3] = processing zset scored by claim time,
+# ARGV[1] = now, ARGV[2] = batch size, ARGV[3] = lease seconds
+# Moves the due feeds to the processing zset so concurrent drainers never release the same feed twice, and a feed claimed by a drainer
+# that died before acking it is queued again once its lease expired. Payloads stay until the ack, returns a flat {feed_id, payload, ...} list
+CLAIM_DUE_FEEDS_LUA = """
+local now, lease = tonumber(ARGV[1]), tonumber(ARGV[3])
+
+local expired = redis.call("ZRANGE", KEYS[3], "-inf", now - lease, "BYSCORE", "WITHSCORES")
+for i = 1, #expired, 2 do
+    redis.call("ZADD", KEYS[1], expired[i + 1], expired[i])
+    redis.call("ZREM", KEYS[3], expired[i])
+end
+
+local feed_ids = redis.call("ZRANGE", KEYS[1], "-inf", now, "BYSCORE", "LIMIT", 0, tonumber(ARGV[2]))
+local claimed = {}
+for _, feed_id in ipairs(feed_ids) do
+    redis.call("ZREM", KEYS[1], feed_id)
+    local payload = redis.call("HGET", KEYS[2], feed_id)
+    if payload then
+        redis.call("ZADD", KEYS[3], now, feed_id)
+        claimed[#claimed + 1] = feed_id
+        claimed[#claimed + 1] = payload
+    end
+end
+return claimed
+"""
+
+# KEYS = timeline zsets to merge, ARGV[1] = score of the last seen entry ("+inf" for the first page), ARGV[2] = its feed id ("" for the first page), ARGV[3] = page size
+# Returns a flat {feed_id, score, ...} page ordered by score then feed id, both descending, skipping everything up to and including the cursor
+PAGE_TIMELINES_LUA = """
+local max_score, cursor_id, limit = ARGV[1], ARGV[2], tonumber(ARGV[3])
+local cursor_score = tonumber(max_score)
+
+local rows = {}
+for _, key in ipairs(KEYS) do
+    -- Entries sharing the cursor score are fetched too and filtered by feed id below
+    local ties = 0
+    if cursor_id ~= "" then
+        ties = redis.call("ZCOUNT", key, max_score, max_score)
+    end
+
+    local entries = redis.call("ZRANGE", key, max_score, "-inf", "BYSCORE", "REV", "LIMIT", 0, limit + ties, "WITHSCORES")
+    for i = 1, #entries, 2 do
+        local feed_id, score = entries[i], entries[i + 1]
+        if cursor_id == "" or tonumber(score) < cursor_score or feed_id < cursor_id then
+            rows[#rows + 1] = {feed_id, score}
+        end
+    end
+end
+
+table.sort(rows, function(a, b)
+    local a_score, b_score = tonumber(a[2]), tonumber(b[2])
+    if a_score ~= b_score then
+        return a_score > b_score
+    end
+    return a[1] > b[1]
+end)
+
+local page, seen = {}, {}
+for _, row in ipairs(rows) do
+    if #page >= limit * 2 then
+        break
+    end
+    if not seen[row[1]] then
+        seen[row[1]] = true
+        page[#page + 1] = row[1]
+        page[#page + 1] = row[2]
+    end
+end
+
+return page
+"""
+
+# KEYS = timeline zsets, returns the number of distinct feed ids across them so a feed found in several timelines counts once
+COUNT_TIMELINES_LUA = """
+return #redis.call("ZUNION", #KEYS, unpack(KEYS))
+"""
+
+# KEYS[1] = Bloom filter, ARGV = items
+# Adds only to a filter that exists, BF.ADD would otherwise create it with the default capacity and error rate before the seed task reserves it
+ADD_TO_FILTER_LUA = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+for _, item in ipairs(ARGV) do
+    redis.call("BF.ADD", KEYS[1], item)
+end
+return 1
+"""
+
+# KEYS[1..2] = username and email Bloom filters, KEYS[3..4] = username and email reservation keys, KEYS[5] = marker set once the filters are seeded,
+# ARGV[1..2] = username and email, ARGV[3] = reservation ttl
+# Returns {username_pending, email_pending, username_maybe_taken, email_maybe_taken}, both reservations are taken with SET NX only when neither is pending
+# Until the seed task finished the filters miss existing users, so every value answers "maybe" and callers fall back to the exact lookup
+RESERVE_REGISTRATION_LUA = """
+local pending = {0, 0}
+for i = 1, 2 do
+    if redis.call("EXISTS", KEYS[i + 2]) == 1 then
+        pending[i] = 1
+    end
+end
+
+local maybe_taken = {1, 1}
+if redis.call("EXISTS", KEYS[5]) == 1 then
+    for i = 1, 2 do
+        maybe_taken[i] = redis.call("BF.EXISTS", KEYS[i], ARGV[i])
+    end
+end
+
+if pending[1] == 0 and pending[2] == 0 then
+    redis.call("SET", KEYS[3], 1, "NX", "EX", tonumber(ARGV[3]))
+    redis.call("SET", KEYS[4], 1, "NX", "EX", tonumber(ARGV[3]))
+end
+return {pending[1], pending[2], maybe_taken[1], maybe_taken[2]}
+"""
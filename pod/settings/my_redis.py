@@ -1,25 +1,35 @@
+import asyncio
 import json
 import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 import time
 from datetime import UTC, date, datetime, timedelta, timezone
 from enum import Enum
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
 from uuid import UUID, uuid4
 
+import numpy as np
 from coredis import PureToken
 from coredis import Redis as SearchRedis
-from coredis.exceptions import ResponseError
 from coredis.modules.response.types import SearchResult
 from coredis.modules.search import Field
 from redis.asyncio import Redis as CacheRedis
-from redis.asyncio.client import PubSub
+from redis.asyncio.client import Pipeline, PubSub
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError
 
 from apps.chats_app.schemas import (ChatMessageSchema, ChatResponseSchema,
                                     ChatSchema, ParticipantSchema)
 from settings.my_config import get_settings
-from utility.my_enums import EngagementType
+from settings.my_lua import (ADD_TO_FILTER_LUA, CLAIM_DUE_FEEDS_LUA, COUNT_TIMELINES_LUA, FOLLOW_LUA, HYDRATE_FEEDS_LUA, LINK_COMMENT_LUA, MIGRATE_ENGAGEMENT_INDEX_LUA,
+                             PAGE_TIMELINES_LUA, RENAME_HASH_FIELDS_LUA, RESERVE_REGISTRATION_LUA, SEED_ENGAGEMENT_COUNTS_LUA, SET_FIELD_IF_EXISTS_LUA,
+                             TOGGLE_BLOCK_LUA, TOGGLE_ENGAGEMENT_LUA, UNFOLLOW_LUA, UPDATE_INDEX_LUA)
+from utility.hash_codec import HashCodec
+from utility.local_cache import LocalCache
+from utility.my_enums import ChatEvent, EngagementType
 from utility.my_logger import my_logger
 from utility.my_types import StatisticsSchema
+from utility.search_index import SearchIndex, SearchIndexManager
 from utility.validators import escape_redisearch_special_chars
 
 settings = get_settings()
@@ -48,8 +58,49 @@ my_search_redis: SearchRedis = SearchRedis(
     ssl_check_hostname=True,
 )
 
+FEED_META_CODEC = HashCodec(
+    codes={
+        "id": "i", "created_at": "c", "updated_at": "u", "body": "b", "author_id": "a", "video_url": "vu", "video_aspect_ratio": "va", "image_url": "iu",
+        "image_aspect_ratio": "ia", "scheduled_at": "s", "feed_visibility": "fv", "comment_policy": "cp", "quote_id": "q", "parent_id": "p", "category_id": "ci",
+        "category": "ca", "tags": "t", "score": "sc",
+    },
+    enabled=settings.COMPACT_CACHE_ENCODING,
+)
+# Counters are left uncoded, Lua scripts increment them in place
+PROFILE_CODEC = HashCodec(
+    codes={
+        "id": "i", "created_at": "c", "updated_at": "u", "name": "n", "username": "un", "email": "e", "password": "pw", "avatar_url": "av", "banner_url": "bu",
+        "banner_color": "bc", "birthdate": "bd", "bio": "b", "country": "co", "city": "ci", "role": "r", "status": "st", "follow_policy": "fp", "last_seen_at": "ls",
+    },
+    enabled=settings.COMPACT_CACHE_ENCODING,
+)
+
+# Queries go through the aliases, a schema change creates the next version and swaps the alias onto it once it exists
 USER_INDEX_NAME = "idx:users"
+USER_INDEX_VERSION = 2
+USERNAME_SUGGESTIONS_KEY = "sug:usernames"
+USERNAMES_FILTER_KEY = "bf:usernames"
+EMAILS_FILTER_KEY = "bf:emails"
+IDENTITY_FILTERS_SEEDED_KEY = "bf:identities:seeded"
 feed_INDEX_NAME = "idx:feeds"
+FEED_INDEX_VERSION = 2
+FEED_TAG_SEPARATOR = ","
+FEED_SORT_FIELDS = {"recent": "created_at", "top": "score"}
+
+ENGAGEMENT_KEYS = ["comments", "reposts", "quotes", "likes", "views", "bookmarks"]
+INTERACTION_KEYS = ["reposted", "quoted", "liked", "viewed", "bookmarked"]
+PROFILE_KEYS = ["id", "name", "username", "avatar_url"]
+USER_ENGAGEMENT_TYPES = [engagement_type.value for engagement_type in EngagementType if engagement_type != EngagementType.feeds]
+
+LOCAL_CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+PULL_AUTHORS_KEY = "feeds:pull_authors"
+# Kept outside the feeds: prefix, the payloads hash would otherwise be picked up by idx:feeds
+SCHEDULED_FEEDS_KEY = "scheduled_feeds"
+SCHEDULED_FEED_PAYLOADS_KEY = "scheduled_feeds:payloads"
+SCHEDULED_FEEDS_PROCESSING_KEY = "scheduled_feeds:processing"
+FANOUT_PROGRESS_TTL = 86400
+TEARDOWN_PROGRESS_TTL = 7 * 86400
+TEARDOWN_PHASES = ["scheduled", "feeds", "comments", "followers", "followings", "blocked", *(f"engagements:{engagement_type}" for engagement_type in USER_ENGAGEMENT_TYPES)]
 
 
 async def redis_ready() -> bool:
@@ -64,46 +115,302 @@ async def redis_ready() -> bool:
         return False
 
 
-async def initialize_redis_indexes() -> None:
-    try:
-        my_logger.debug(f"creating index...")
-        await my_search_redis.search.create(
-            index=USER_INDEX_NAME, on=PureToken.HASH, schema=[Field("email", PureToken.TEXT), Field("username", PureToken.TEXT)], prefixes=["users:"]
-        )
-        my_logger.info("User index created/updated")
-    except ResponseError as e:
-        if "Index already exists" not in str(e):
-            raise
+def _search_fields(codec: HashCodec, names: list[str], kind: PureToken = PureToken.TEXT, **options) -> list[Field]:
+    """Fields over the stored field codes, aliased back to their names so queries keep using @name."""
+    return [Field(codec.field(name), kind, alias=name if codec.field(name) != name else None, **options) for name in names]
+
+
+search_index_manager = SearchIndexManager(
+    search_redis=my_search_redis,
+    indexes=[
+        SearchIndex(
+            alias=USER_INDEX_NAME,
+            version=USER_INDEX_VERSION,
+            schema=[
+                *_search_fields(codec=PROFILE_CODEC, names=["email", "username"]),
+                # Exact, case-insensitive lookups for the availability check next to the TEXT fields used by prefix search
+                Field(PROFILE_CODEC.field("email"), PureToken.TAG, alias="email_exact"),
+                Field(PROFILE_CODEC.field("username"), PureToken.TAG, alias="username_exact"),
+            ],
+            prefixes=["users:"],
+        ),
+        SearchIndex(
+            alias=feed_INDEX_NAME,
+            version=FEED_INDEX_VERSION,
+            schema=[
+                *_search_fields(codec=FEED_META_CODEC, names=["body"]),
+                *_search_fields(codec=FEED_META_CODEC, names=["author_id", "feed_visibility", "category_id"], kind=PureToken.TAG),
+                *_search_fields(codec=FEED_META_CODEC, names=["tags"], kind=PureToken.TAG, separator=FEED_TAG_SEPARATOR),
+                *_search_fields(codec=FEED_META_CODEC, names=["created_at", "score"], kind=PureToken.NUMERIC, sortable=True),
+            ],
+            prefixes=["feeds:"],
+        ),
+    ],
+)
 
-    try:
-        await my_search_redis.search.create(index=feed_INDEX_NAME, on=PureToken.HASH, schema=[Field("body", PureToken.TEXT)], prefixes=["feeds:"])
-        my_logger.info("Feed index created/updated")
-    except ResponseError as e:
-        if "Index already exists" not in str(e):
-            raise
+
+class Subscription:
+    """One local listener on a topic of the shared subscriber connection, with its own queue."""
+
+    def __init__(self, manager: "RedisPubSubManager", topic: str):
+        self.manager = manager
+        self.topic = topic
+        self.queue: asyncio.Queue[Optional[dict]] = asyncio.Queue(maxsize=settings.PUBSUB_QUEUE_SIZE)
+        self.closed = False
+
+    async def listen(self) -> AsyncIterator[dict]:
+        """Yield messages shaped like redis-py pub/sub messages until the subscription or the manager is closed."""
+        while not self.closed:
+            message: Optional[dict] = await self.queue.get()
+            if message is None:
+                return
+            yield message
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            _put_sentinel(queue=self.queue)
+            await self.manager.release(subscription=self)
 
 
 class RedisPubSubManager:
+    """
+    Multiplexes every topic this process listens on over one subscriber connection. A topic is subscribed when its
+    first local listener appears and unsubscribed when the last one closes, so the connection count stays constant.
+    """
+
     def __init__(self, cache_redis: CacheRedis):
         self.cache_redis = cache_redis
-        self.active_subscriptions: dict[str, PubSub] = {}
+        self.pubsub: Optional[PubSub] = None
+        self.subscriptions: dict[str, set[Subscription]] = {}
+        self.reader: Optional[asyncio.Task] = None
+        # The XREAD the reader is blocked in, cancelled to pick up a stream subscribed meanwhile right away
+        self.pending_read: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
 
     async def publish(self, topic: str, data: dict):
         await self.cache_redis.publish(channel=topic, message=json.dumps(data))
 
-    async def subscribe(self, topic: str) -> PubSub:
-        pubsub = self.cache_redis.pubsub()
-        await pubsub.subscribe(topic)
-        self.active_subscriptions[topic] = pubsub
-        return pubsub
+    async def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(manager=self, topic=topic)
+        async with self.lock:
+            if self.pubsub is None:
+                self.pubsub = self.cache_redis.pubsub()
+            if topic not in self.subscriptions:
+                await self.pubsub.subscribe(topic)
+                self.subscriptions[topic] = set()
+            self.subscriptions[topic].add(subscription)
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self._read())
+        return subscription
+
+    async def release(self, subscription: Subscription):
+        async with self.lock:
+            listeners: set[Subscription] = self.subscriptions.get(subscription.topic, set())
+            listeners.discard(subscription)
+            if not listeners and subscription.topic in self.subscriptions:
+                del self.subscriptions[subscription.topic]
+                # Closed by the manager already
+                if self.pubsub is not None:
+                    await self.pubsub.unsubscribe(subscription.topic)
+
+    async def close(self):
+        """Stop the reader before closing the connection it reads from, and wake every listener so it returns."""
+        if self.reader is not None:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
+            self.reader = None
+        for listeners in self.subscriptions.values():
+            for subscription in listeners:
+                _put_sentinel(queue=subscription.queue)
+        self.subscriptions.clear()
+        if self.pubsub is not None:
+            await self.pubsub.close()
+            self.pubsub = None
+
+    async def _read(self):
+        """Fan every message out to the queues of its topic, a slow socket loses its oldest messages rather than stalling the others."""
+        while self.subscriptions:
+            try:
+                message: Optional[dict] = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                my_logger.exception(f"Shared pubsub reader failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message.get("type") != "message":
+                continue
+
+            for subscription in list(self.subscriptions.get(message["channel"], ())):
+                if subscription.queue.full():
+                    subscription.queue.get_nowait()
+                    my_logger.warning(f"Pubsub queue for {subscription.topic} is full, dropping its oldest message")
+                subscription.queue.put_nowait(message)
 
-    async def unsubscribe(self, topic: str):
-        if pubsub := self.active_subscriptions.get(topic):
+
+class StreamSubscription:
+    """One socket's view of a user stream served by the shared reader, with its own queue and the last id it was given."""
+
+    def __init__(self, manager: "RedisStreamManager", stream: str, last_id: str):
+        self.manager = manager
+        self.stream = stream
+        self.last_id = last_id
+        self.queue: asyncio.Queue[Optional[tuple[str, dict]]] = asyncio.Queue(maxsize=settings.PUBSUB_QUEUE_SIZE)
+        self.closed = False
+
+    async def listen(self) -> AsyncIterator[tuple[str, dict]]:
+        """Yield (stream id, event) pairs until the subscription is closed, a resync event means entries were missed."""
+        while not self.closed:
+            item: Optional[tuple[str, dict]] = await self.queue.get()
+            if item is None:
+                return
+            yield item
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            _put_sentinel(queue=self.queue)
+            await self.manager.release(subscription=self)
+
+
+class RedisStreamManager:
+    """
+    Per-user event streams, unlike pub/sub every event stays readable until the stream is trimmed, so clients resume from their last seen id.
+    One reader per process serves every local socket with a single multi-stream XREAD, rather than one blocked connection per socket.
+    """
+
+    def __init__(self, cache_redis: CacheRedis):
+        self.cache_redis = cache_redis
+        self.subscriptions: dict[str, set[StreamSubscription]] = {}
+        # Id of the last entry the shared reader fetched per stream
+        self.positions: dict[str, str] = {}
+        self.reader: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    async def publish(self, streams: list[str], data: dict) -> list[str]:
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for stream in streams:
+                pipe.xadd(name=stream, fields={"data": json.dumps(data)}, maxlen=settings.CHAT_STREAM_MAXLEN, approximate=True)
+                pipe.expire(name=stream, time=settings.CHAT_STREAM_TTL)
+            results: list = await pipe.execute()
+        return results[::2]
+
+    async def latest_id(self, stream: str) -> str:
+        entries: list[tuple[str, dict]] = await self.cache_redis.xrevrange(name=stream, count=1)
+        return entries[0][0] if entries else "0-0"
+
+    async def subscribe(self, stream: str, last_id: Optional[str] = None) -> StreamSubscription:
+        """
+        Serve the stream to a new socket. Entries after last_id are replayed first, and a resync event is queued instead when they
+        were trimmed already or last_id is malformed. Without last_id, or with "$", delivery starts at the current latest entry.
+        """
+        async with self.lock:
+            latest: str = await self.latest_id(stream=stream)
+            subscription = StreamSubscription(manager=self, stream=stream, last_id=latest)
+            if last_id not in (None, "$"):
+                await self._replay(subscription=subscription, last_id=last_id, latest=latest)
+
+            is_new_stream: bool = stream not in self.positions
+            self.subscriptions.setdefault(stream, set()).add(subscription)
+            self.positions.setdefault(stream, latest)
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self._read())
+            elif is_new_stream and self.pending_read is not None:
+                self.pending_read.cancel()
+        return subscription
+
+    async def release(self, subscription: StreamSubscription):
+        async with self.lock:
+            subscriptions: set[StreamSubscription] = self.subscriptions.get(subscription.stream, set())
+            subscriptions.discard(subscription)
+            if not subscriptions and subscription.stream in self.subscriptions:
+                del self.subscriptions[subscription.stream]
+                self.positions.pop(subscription.stream, None)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
+            self.reader = None
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                _put_sentinel(queue=subscription.queue)
+        self.subscriptions.clear()
+        self.positions.clear()
+
+    async def _replay(self, subscription: StreamSubscription, last_id: str, latest: str):
+        """Queue the entries between last_id and latest, called under the lock so the reader cannot deliver any of them twice."""
+        last: Optional[tuple[int, int]] = _parse_stream_id(stream_id=last_id)
+        first_entries: list[tuple[str, dict]] = await self.cache_redis.xrange(name=subscription.stream, min="-", max="+", count=1)
+        if last is None:
+            my_logger.warning(f"Invalid stream id '{last_id}', resuming {subscription.stream} from its latest entry")
+            self._push(subscription=subscription, entry_id=latest, data={"type": ChatEvent.resync.value})
+            return
+        if (not first_entries and last > (0, 0)) or (first_entries and last < _parse_stream_id(stream_id=first_entries[0][0])):
+            # Entries after last_id were trimmed or the stream expired, so the client reloads its state instead
+            self._push(subscription=subscription, entry_id=latest, data={"type": ChatEvent.resync.value})
+            return
+        if not first_entries:
+            return
+
+        entries: list[tuple[str, dict]] = await self.cache_redis.xrange(name=subscription.stream, min=f"({last[0]}-{last[1]}", max=latest)
+        for entry_id, fields in entries:
+            data: Optional[dict] = _decode_stream_entry(entry_id=entry_id, fields=fields)
+            if data is not None:
+                self._push(subscription=subscription, entry_id=entry_id, data=data)
+        subscription.last_id = latest
+
+    async def _read(self):
+        """Read every stream with local subscribers in one blocking XREAD and fan the entries out to their queues."""
+        while True:
+            async with self.lock:
+                if not self.subscriptions:
+                    self.reader = None
+                    return
+                positions: dict[str, str] = dict(self.positions)
+
+            self.pending_read = asyncio.create_task(self.cache_redis.xread(streams=positions, count=settings.CHAT_STREAM_BATCH_SIZE, block=settings.CHAT_STREAM_BLOCK_MS))
             try:
-                await pubsub.unsubscribe(topic)
-                await pubsub.close()
+                response: list = await self.pending_read
+            except asyncio.CancelledError:
+                # Only the blocked XREAD was cancelled by subscribe, so read again with the new stream included
+                if asyncio.current_task().cancelling():
+                    raise
+                continue
+            except Exception as e:
+                my_logger.exception(f"Shared stream reader failed: {e}")
+                await asyncio.sleep(1)
+                continue
             finally:
-                self.active_subscriptions.pop(topic, None)
+                self.pending_read = None
+
+            async with self.lock:
+                for stream, entries in response or []:
+                    if stream not in self.subscriptions:
+                        continue
+                    for entry_id, fields in entries:
+                        parsed: tuple[int, int] = _parse_stream_id(stream_id=entry_id)
+                        if parsed > _parse_stream_id(stream_id=self.positions[stream]):
+                            self.positions[stream] = entry_id
+                        data: Optional[dict] = _decode_stream_entry(entry_id=entry_id, fields=fields)
+                        if data is None:
+                            continue
+                        for subscription in self.subscriptions[stream]:
+                            # Replayed or subscribed after this entry was written
+                            if parsed > _parse_stream_id(stream_id=subscription.last_id):
+                                self._push(subscription=subscription, entry_id=entry_id, data=data)
+
+    @staticmethod
+    def _push(subscription: StreamSubscription, entry_id: str, data: dict):
+        if subscription.queue.full():
+            # A socket that cannot keep up drops its backlog and reloads its state rather than silently missing entries
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            my_logger.warning(f"Stream queue for {subscription.stream} is full, asking the client to resync")
+            data = {"type": ChatEvent.resync.value}
+        subscription.queue.put_nowait((entry_id, data))
+        subscription.last_id = entry_id
 
 
 class ChatCacheManager:
@@ -162,7 +469,7 @@ class ChatCacheManager:
                 pipe.sismember("chats:online", pid)
             piped_results = await pipe.execute()
 
-        profiles: list[dict] = piped_results[: len(participant_ids)]
+        profiles: list[dict] = [PROFILE_CODEC.decode(profile) for profile in piped_results[: len(participant_ids)]]
         statuses: list[bool] = piped_results[len(participant_ids):]
 
         chat_list = []
@@ -205,7 +512,8 @@ class ChatCacheManager:
 
     """ ****************************************** EVENTS ****************************************** """
 
-    async def add_user_to_chats(self, user_id: str) -> tuple[set[str], set[str]]:
+    async def add_user_to_chats(self, user_id: str) -> dict[str, str]:
+        """Mark the user online and return the chat partners who are online too, each with the chat they share."""
         chat_ids: list[str] = await self.cache_redis.zrevrange(name=f"users:{user_id}:chats", start=0, end=-1)
 
         async with self.cache_redis.pipeline() as pipe:
@@ -214,39 +522,39 @@ class ChatCacheManager:
                 pipe.sinter(f"chats:{chat_id}:participants", "chats:online")
             results = await pipe.execute()
 
-        online_participants: set[str] = set()
-        chat_ids_with_online: set[str] = set()
-        online_users_per_chat_results: list[set[str]] = results[1:]
+        return _partner_chats(user_id=user_id, chat_ids=chat_ids, participants=results[1:])
 
-        for chat_id, online_in_chat in zip(chat_ids, online_users_per_chat_results):
-            other_online_users = {pid for pid in online_in_chat if pid != user_id}
-            if other_online_users:
-                chat_ids_with_online.add(chat_id)
-                online_participants.update(other_online_users)
-
-        return chat_ids_with_online, online_participants
-
-    async def remove_user_from_chats(self, user_id: str) -> tuple[set[str], set[str]]:
+    async def remove_user_from_chats(self, user_id: str, last_seen_at: int) -> dict[str, str]:
+        """Mark the user offline and return the chat partners who are still online, each with the chat they share."""
         chat_ids: list[str] = await self.cache_redis.zrevrange(name=f"users:{user_id}:chats", start=0, end=-1)
 
         async with self.cache_redis.pipeline() as pipe:
             pipe.srem(f"chats:online", user_id)
-            pipe.hset(f"users:{user_id}:profile", key="last_seen_at", value=int(datetime.now(UTC).timestamp()))
+            pipe.hset(f"users:{user_id}:profile", key=PROFILE_CODEC.field("last_seen_at"), value=last_seen_at)
             for chat_id in chat_ids:
                 pipe.sinter(f"chats:{chat_id}:participants", "chats:online")
             results = await pipe.execute()
 
-        online_participants: set[str] = set()
-        chat_ids_with_online: set[str] = set()
-        online_users_per_chat_results: list[set[str]] = results[2:]
+        return _partner_chats(user_id=user_id, chat_ids=chat_ids, participants=results[2:])
 
-        for chat_id, online_in_chat in zip(chat_ids, online_users_per_chat_results):
-            other_online_users = {pid for pid in online_in_chat if pid != user_id}
-            if other_online_users:
-                chat_ids_with_online.add(chat_id)
-                online_participants.update(other_online_users)
+    async def claim_presence_sweep(self, ttl: float) -> bool:
+        """Only the node that claims the sweep for the next ttl seconds sweeps."""
+        return bool(await self.cache_redis.set(name="chats:presence_sweep", value=int(time.time()), nx=True, px=int(ttl * 1000)))
+
+    async def scan_online_users(self, batch_size: int) -> AsyncIterator[list[str]]:
+        cursor = 0
+        while True:
+            cursor, user_ids = await self.cache_redis.sscan(name="chats:online", cursor=cursor, count=batch_size)
+            if user_ids:
+                yield list(user_ids)
+            if cursor == 0:
+                return
 
-        return chat_ids_with_online, online_participants
+    async def set_presence(self, user_id: str, online: bool) -> bool:
+        """Record the last announced presence and return True when it changed, so flapping connections announce nothing."""
+        state: str = "online" if online else "offline"
+        previous: Optional[str] = await self.cache_redis.set(name=f"users:{user_id}:presence", value=state, get=True)
+        return previous != state
 
     async def get_chat_participants(self, chat_id: str, user_id: str | None = None, online: bool = False) -> set[str]:
         if online:
@@ -262,58 +570,215 @@ class CacheManager:
     def __init__(self, cache_redis: CacheRedis, search_redis: SearchRedis):
         self.cache_redis = cache_redis
         self.search_redis = search_redis
+        self.hydrate_feeds_script: AsyncScript = cache_redis.register_script(HYDRATE_FEEDS_LUA)
+        self.toggle_engagement_script: AsyncScript = cache_redis.register_script(TOGGLE_ENGAGEMENT_LUA)
+        self.link_comment_script: AsyncScript = cache_redis.register_script(LINK_COMMENT_LUA)
+        self.seed_engagement_counts_script: AsyncScript = cache_redis.register_script(SEED_ENGAGEMENT_COUNTS_LUA)
+        self.page_timelines_script: AsyncScript = cache_redis.register_script(PAGE_TIMELINES_LUA)
+        self.count_timelines_script: AsyncScript = cache_redis.register_script(COUNT_TIMELINES_LUA)
+        self.migrate_engagement_index_script: AsyncScript = cache_redis.register_script(MIGRATE_ENGAGEMENT_INDEX_LUA)
+        self.update_index_script: AsyncScript = cache_redis.register_script(UPDATE_INDEX_LUA)
+        self.toggle_block_script: AsyncScript = cache_redis.register_script(TOGGLE_BLOCK_LUA)
+        self.follow_script: AsyncScript = cache_redis.register_script(FOLLOW_LUA)
+        self.unfollow_script: AsyncScript = cache_redis.register_script(UNFOLLOW_LUA)
+        self.rename_hash_fields_script: AsyncScript = cache_redis.register_script(RENAME_HASH_FIELDS_LUA)
+        self.set_field_if_exists_script: AsyncScript = cache_redis.register_script(SET_FIELD_IF_EXISTS_LUA)
+        self.claim_due_feeds_script: AsyncScript = cache_redis.register_script(CLAIM_DUE_FEEDS_LUA)
+        self.reserve_registration_script: AsyncScript = cache_redis.register_script(RESERVE_REGISTRATION_LUA)
+        self.add_to_filter_script: AsyncScript = cache_redis.register_script(ADD_TO_FILTER_LUA)
+        self.feed_meta_cache = LocalCache(name="feed_meta", max_size=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+        self.profile_cache = LocalCache(name="author_profile", max_size=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+        self.autocomplete_cache = LocalCache(name="username_autocomplete", max_size=settings.LOCAL_CACHE_MAX_SIZE, ttl=settings.AUTOCOMPLETE_CACHE_TTL)
+
+    """ ************************************* LOCAL CACHE INVALIDATION ************************************* """
+
+    async def invalidate_local_caches(self, kind: str, item_id: str):
+        """Evict locally right away and let every other replica evict through the invalidation channel."""
+        self._evict_local(kind=kind, item_id=item_id)
+        await self.cache_redis.publish(channel=LOCAL_CACHE_INVALIDATION_CHANNEL, message=json.dumps({"kind": kind, "id": item_id}))
+
+    async def listen_local_cache_invalidations(self):
+        while True:
+            pubsub: PubSub = self.cache_redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(LOCAL_CACHE_INVALIDATION_CHANNEL)
+                # Anything published while we were not subscribed is lost, so start from an empty cache
+                self.feed_meta_cache.clear()
+                self.profile_cache.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data: dict = json.loads(message["data"])
+                    self._evict_local(kind=data.get("kind", ""), item_id=data.get("id", ""))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                my_logger.exception(f"Local cache invalidation listener failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def _evict_local(self, kind: str, item_id: str):
+        if kind == "feed":
+            self.feed_meta_cache.invalidate(item_id)
+        elif kind == "profile":
+            self.profile_cache.invalidate(item_id)
 
     USER_TIMELINE_KEY = "user:{user_id}:user_timeline"
 
     """ ****************************************** TIMELINE ****************************************** """
 
-    async def get_discover_timeline(self, user_id: Optional[str] = None, start: int = 0, end: int = 10) -> dict[str, list[dict] | int]:
+    async def get_discover_timeline(self, user_id: Optional[str] = None, start: int = 0, end: int = 10, cursor: Optional[str] = None) -> dict[str, list[dict] | int | str]:
+        if cursor is not None:
+            return await self._get_timeline_page(timeline_keys=["global_timeline"], user_id=user_id, cursor=cursor, limit=end - start + 1)
+
         total_count: int = await self.cache_redis.zcard(name="global_timeline")
         if total_count == 0:
             return {"feeds": [], "end": 0}
 
-        feed_ids: list[str] = await self.cache_redis.zrevrange(name="global_timeline", start=start, end=end)
-        feeds = await self._get_feeds(user_id=user_id, feed_ids=feed_ids)
-        return {"feeds": feeds, "end": total_count}
+        entries: list[tuple[str, float]] = await self.cache_redis.zrevrange(name="global_timeline", start=start, end=end, withscores=True)
+        feeds = await self._get_feeds(user_id=user_id, feed_ids=[feed_id for feed_id, _ in entries])
+        return {"feeds": feeds, "end": total_count, "next_cursor": _next_timeline_cursor(entries=entries, limit=end - start + 1)}
+
+    async def get_following_timeline(self, user_id: str, start: int = 0, end: int = 10, cursor: Optional[str] = None) -> dict[str, list[dict] | int | str]:
+        # Authors above the fan-out threshold are never pushed into follower timelines, their feeds are pulled from their own timelines here
+        pull_author_ids: set[str] = await self.cache_redis.sinter(f"users:{user_id}:followings", PULL_AUTHORS_KEY)
+        timeline_keys: list[str] = [f"users:{user_id}:following_timeline", *(f"users:{author_id}:user_timeline" for author_id in pull_author_ids)]
+
+        if cursor is not None:
+            return await self._get_timeline_page(timeline_keys=timeline_keys, user_id=user_id, cursor=cursor, limit=end - start + 1)
+
+        if not pull_author_ids:
+            total_count: int = await self.cache_redis.zcard(name=f"users:{user_id}:following_timeline")
+            if total_count == 0:
+                return {"feeds": [], "end": 0}
+
+            entries: list[tuple[str, float]] = await self.cache_redis.zrevrange(name=f"users:{user_id}:following_timeline", start=start, end=end, withscores=True)
+            feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=[feed_id for feed_id, _ in entries])
+            return {"feeds": feeds, "end": total_count, "next_cursor": _next_timeline_cursor(entries=entries, limit=end - start + 1)}
+
+        # Feeds fanned out before their author crossed the threshold sit in both timelines, end counts them once
+        async with self.cache_redis.pipeline() as pipe:
+            await self.count_timelines_script(keys=timeline_keys, args=[], client=pipe)
+            for key in timeline_keys:
+                pipe.zrevrange(name=key, start=0, end=end, withscores=True)
+            total_count, *timelines = await pipe.execute()
 
-    async def get_following_timeline(self, user_id: str, start: int = 0, end: int = 10) -> dict[str, list[dict] | int]:
-        total_count: int = await self.cache_redis.zcard(name=f"users:{user_id}:following_timeline")
         if total_count == 0:
             return {"feeds": [], "end": 0}
 
-        feed_ids: list[str] = list(await self.cache_redis.zrevrange(name=f"users:{user_id}:following_timeline", start=start, end=end))
-        feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=feed_ids)
-        return {"feeds": feeds, "end": total_count}
+        entries: list[tuple[str, float]] = _merge_timelines(timelines=timelines, start=start, end=end)
+        feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=[feed_id for feed_id, _ in entries])
+        return {"feeds": feeds, "end": total_count, "next_cursor": _next_timeline_cursor(entries=entries, limit=end - start + 1)}
 
-    async def get_user_timeline(self, user_id: str, engagement_type: EngagementType, start: int = 0, end: int = 10) -> dict[str, list[dict] | int]:
+    async def get_user_timeline(self, user_id: str, engagement_type: EngagementType, start: int = 0, end: int = 10, cursor: Optional[str] = None) -> dict[str, list[dict] | int | str]:
+        # Authored feeds are scored by creation time and every engagement index by engagement time, so both page the same way newest-first
         prefix: str = "user_timeline" if engagement_type == EngagementType.feeds else engagement_type.value
+        timeline_key: str = f"users:{user_id}:{prefix}"
 
-        if engagement_type == EngagementType.feeds:
-            total_count: int = await self.cache_redis.zcard(name=f"users:{user_id}:{prefix}")
-        else:
-            total_count: int = await self.cache_redis.scard(name=f"users:{user_id}:{prefix}")
+        try:
+            if cursor is not None:
+                return await self._get_timeline_page(timeline_keys=[timeline_key], user_id=user_id, cursor=cursor, limit=end - start + 1)
+
+            total_count: int = await self.cache_redis.zcard(name=timeline_key)
+        except RedisError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            return await self._get_legacy_engagement_timeline(timeline_key=timeline_key, user_id=user_id, start=start, end=end)
 
         if total_count == 0:
             return {"feeds": [], "end": 0}
 
-        if engagement_type == EngagementType.feeds:
-            feed_ids = await self.cache_redis.zrevrange(name=f"users:{user_id}:{prefix}", start=start, end=end)
-        else:
-            all_feed_ids: set[str] = await self.cache_redis.smembers(name=f"users:{user_id}:{prefix}")
-            feed_ids = list(all_feed_ids)[start: end + 1]
-            # feed_ids = await self.cache_redis.lrange(name=f"users:{user_id}:{prefix}", start=start, end=end)
+        entries: list[tuple[str, float]] = await self.cache_redis.zrevrange(name=timeline_key, start=start, end=end, withscores=True)
+        feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=[feed_id for feed_id, _ in entries])
+        return {"feeds": feeds, "end": total_count, "next_cursor": _next_timeline_cursor(entries=entries, limit=end - start + 1)}
 
-        feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=feed_ids)
-        return {"feeds": feeds, "end": total_count}
+    async def _get_legacy_engagement_timeline(self, timeline_key: str, user_id: str, start: int, end: int) -> dict[str, list[dict] | int]:
+        """Engagement indexes still stored as sets until migrate_user_engagement_indexes has converted them, offset pages only."""
+        all_feed_ids: set[str] = await self.cache_redis.smembers(name=timeline_key)
+        if not all_feed_ids:
+            return {"feeds": [], "end": 0}
+
+        feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=sorted(all_feed_ids, reverse=True)[start: end + 1])
+        return {"feeds": feeds, "end": len(all_feed_ids)}
+
+    async def _get_timeline_page(self, timeline_keys: list[str], cursor: str, limit: int, user_id: Optional[str] = None) -> dict[str, list[dict] | str]:
+        """Page one or more timeline zsets by (score, feed id) instead of rank, an empty cursor starts from the newest entry."""
+        max_score, cursor_id = _decode_timeline_cursor(cursor=cursor) if cursor else ("+inf", "")
+        rows: list[str] = await self.page_timelines_script(keys=timeline_keys, args=[max_score, cursor_id, limit])
+        entries: list[tuple[str, str]] = list(zip(rows[::2], rows[1::2]))
+
+        feeds: list[dict] = await self._get_feeds(user_id=user_id, feed_ids=[feed_id for feed_id, _ in entries])
+        return {"feeds": feeds, "next_cursor": _next_timeline_cursor(entries=entries, limit=limit)}
 
     async def _get_feeds(self, feed_ids: list[str], user_id: Optional[str] = None) -> list[dict]:
+        if not feed_ids:
+            return []
+
+        if settings.FEED_HYDRATION_SCRIPT:
+            try:
+                return await self._get_feeds_scripted(feed_ids=feed_ids, user_id=user_id)
+            except RedisError as e:
+                my_logger.error(f"Feed hydration script failed, falling back to pipelines: {e}")
+
+        return await self._get_feeds_pipelined(feed_ids=feed_ids, user_id=user_id)
+
+    async def _get_feeds_scripted(self, feed_ids: list[str], user_id: Optional[str] = None) -> list[dict]:
+        # Metas and author profiles held in the local cache are not read again, the script only returns counters and per-viewer state
+        metas: dict[str, dict] = {feed_id: meta for feed_id in feed_ids if (meta := self.feed_meta_cache.get(feed_id)) is not None}
+        # The script has to be handed every key it touches, so metas naming the authors are read first
+        missing: list[str] = [feed_id for feed_id in feed_ids if feed_id not in metas]
+        if missing:
+            async with self.cache_redis.pipeline() as pipe:
+                for feed_id in missing:
+                    pipe.hgetall(f"feeds:{feed_id}:meta")
+                for feed_id, meta in zip(missing, await pipe.execute()):
+                    if meta:
+                        metas[feed_id] = _expand_feed_meta(FEED_META_CODEC.decode(meta))
+                        self.feed_meta_cache.set(feed_id, dict(metas[feed_id]))
+
+        feed_ids = [feed_id for feed_id in feed_ids if metas.get(feed_id, {}).get("author_id")]
+        author_ids: list[str] = list(dict.fromkeys(metas[feed_id]["author_id"] for feed_id in feed_ids))
+        author_indexes: dict[str, int] = {author_id: index for index, author_id in enumerate(author_ids, start=1)}
+        cached_profiles: dict[str, dict] = {author_id: profile for author_id in author_ids if (profile := self.profile_cache.get(author_id)) is not None}
+
+        keys: list[str] = [f"users:{user_id or ''}:blocked"]
+        args: list[str | int] = [*PROFILE_CODEC.fields(PROFILE_KEYS), user_id or "", len(author_ids)]
+        for author_id in author_ids:
+            keys.extend([f"users:{author_id}:profile", f"users:{author_id}:followers", f"users:{author_id}:blocked"])
+            args.extend([author_id, int(author_id not in cached_profiles)])
+        for feed_id in feed_ids:
+            keys.extend([_counts_key(prefix="feeds", item_id=feed_id), *(f"feeds:{feed_id}:{key}" for key in ENGAGEMENT_KEYS[1:])])
+            args.extend([author_indexes[metas[feed_id]["author_id"]], metas[feed_id].get("feed_visibility", "")])
+        rows: list[list] = await self.hydrate_feeds_script(keys=keys, args=args)
+
+        feeds: list[dict] = []
+        for feed_id, row in zip(feed_ids, rows):
+            if not row:
+                continue
+            counters, interactions, profile = row
+            feed: dict = dict(metas[feed_id])
+            author_id: str = feed.pop("author_id")
+            if profile:
+                author: dict = dict(zip(PROFILE_KEYS, profile)) if profile[0] else {}
+                if author:
+                    self.profile_cache.set(author_id, author)
+            else:
+                author: dict = cached_profiles.get(author_id, {})
+
+            feed["engagement"] = _decode_engagement(counters=counters, interactions=interactions)
+            feed["author"] = dict(author)
+            feeds.append(feed)
+        return feeds
+
+    async def _get_feeds_pipelined(self, feed_ids: list[str], user_id: Optional[str] = None) -> list[dict]:
         feeds: list[dict] = []
 
         # Fetch feed metadata
         async with self.cache_redis.pipeline() as pipe:
             for feed_id in feed_ids:
                 pipe.hgetall(f"feeds:{feed_id}:meta")
-            feed_metas: list[dict] = await pipe.execute()
+            feed_metas: list[dict] = [_expand_feed_meta(FEED_META_CODEC.decode(feed_meta)) for feed_meta in await pipe.execute()]
 
         # Process feed metadata and apply visibility filtering
         valid_feeds = []
@@ -392,8 +857,7 @@ class CacheManager:
         async with self.cache_redis.pipeline() as pipe:
             for feed in feeds:
                 feed_id = feed["id"]
-                for key in engagement_keys:
-                    pipe.scard(f"feeds:{feed_id}:{key}")
+                pipe.hmget(_counts_key(prefix="feeds", item_id=feed_id), engagement_keys)
                 if user_id:
                     for key in engagement_keys[1:]:
                         pipe.sismember(f"feeds:{feed_id}:{key}", user_id)
@@ -401,17 +865,11 @@ class CacheManager:
 
         for index, feed in enumerate(feeds):
             has_interactions = user_id is not None
-            chunk_size = len(engagement_keys) + (len(interaction_keys) if has_interactions else 0)
+            chunk_size = 1 + (len(interaction_keys) if has_interactions else 0)
             start = index * chunk_size
 
-            metrics = results[start: start + len(engagement_keys)]
-            engagement = {key: value for key, value in zip(engagement_keys, metrics) if value > 0}
-
-            if has_interactions:
-                interactions: list[bool] = results[start + len(engagement_keys): start + chunk_size]
-                engagement.update({interaction_key: True for interaction_key, interacted in zip(interaction_keys, interactions) if interacted})
-
-            feed["engagement"] = engagement
+            interactions: list[bool] = results[start + 1: start + chunk_size] if has_interactions else []
+            feed["engagement"] = _decode_engagement(counters=results[start], interactions=interactions)
 
         # Fetch author profiles
         author_ids = {feed["author_id"] for feed in feeds}
@@ -419,7 +877,7 @@ class CacheManager:
 
         async with self.cache_redis.pipeline() as pipe:
             for aid in author_ids:
-                pipe.hmget(f"users:{aid}:profile", keys)
+                pipe.hmget(f"users:{aid}:profile", PROFILE_CODEC.fields(keys))
             profiles = await pipe.execute()
 
         author_profiles = {profile[0]: dict(zip(keys, profile)) for profile in profiles if profile and profile[0]}
@@ -439,7 +897,8 @@ class CacheManager:
 
     """ ********************************************* FEED ********************************************* """
 
-    async def create_feed(self, mapping: dict, max_gt: int = 360, max_ft: int = 120, max_ut: int = 120):
+    async def create_feed(self, mapping: dict, max_gt: int = 360, max_ft: int = 120, max_ut: int = 120) -> bool:
+        """Cache the feed and return True when it still has to be fanned out to follower timelines."""
         try:
             author_id: str = mapping.pop("author", {}).get("id", "")
             feed_id: str = mapping.get("id", "")
@@ -447,6 +906,7 @@ class CacheManager:
             created_at: float = mapping.get("created_at", time.time())
 
             mapping.update({"author_id": author_id})
+            _flatten_feed_mapping(mapping=mapping)
 
             if parent_id is not None:
                 # Determine if parent is feed or comment
@@ -454,20 +914,26 @@ class CacheManager:
                 prefix = "feeds" if is_parent_feed else "comments"
 
                 async with self.cache_redis.pipeline() as pipe:
-                    pipe.sadd(f"{prefix}:{parent_id}:comments", feed_id)
+                    await self.link_comment_script(keys=[f"{prefix}:{parent_id}:comments", _counts_key(prefix=prefix, item_id=parent_id)], args=[feed_id, 1], client=pipe)
                     pipe.sadd(f"users:{author_id}:comments", feed_id)
                     pipe.set(name=f"comments:{feed_id}:author_id", value=author_id)
                     pipe.set(name=f"comments:{feed_id}:parent_id", value=parent_id)
                     await pipe.execute()
-                return
+                return False
 
-            # For top-level feeds only
-            followers: set[str] = await self.cache_redis.smembers(f"users:{author_id}:followers")
+            # For top-level feeds only, authors above the threshold are merged into follower timelines at read time
+            async with self.cache_redis.pipeline() as pipe:
+                pipe.scard(f"users:{author_id}:followers")
+                pipe.sismember(PULL_AUTHORS_KEY, author_id)
+                followers_count, was_pull_author = await pipe.execute()
+            threshold: float = settings.FANOUT_FOLLOWER_THRESHOLD * (settings.FANOUT_FOLLOWER_EXIT_RATIO if was_pull_author else 1)
+            is_pull_author: bool = followers_count > threshold
             initial_score = _calculate_score({"comments": 0, "reposts": 0, "quotes": 0, "likes": 0, "views": 0, "bookmarks": 0}, created_at)
+            mapping.update({"score": initial_score})
 
             async with self.cache_redis.pipeline() as pipe:
                 # Save feed metadata
-                pipe.hset(name=f"feeds:{feed_id}:meta", mapping=mapping)
+                pipe.hset(name=f"feeds:{feed_id}:meta", mapping=FEED_META_CODEC.encode(mapping))
 
                 # Add to global timeline
                 pipe.zadd(name="global_timeline", mapping={feed_id: initial_score})
@@ -481,164 +947,544 @@ class CacheManager:
                 pipe.zadd(name=f"users:{author_id}:user_timeline", mapping={feed_id: initial_score})
                 pipe.zremrangebyrank(name=f"users:{author_id}:user_timeline", min=0, max=-max_ut - 1)
 
-                # Add to followers' timelines
-                for follower_id in followers:
-                    pipe.zadd(name=f"users:{follower_id}:following_timeline", mapping={feed_id: initial_score})
-                    pipe.zremrangebyrank(name=f"users:{follower_id}:following_timeline", min=0, max=-max_ft - 1)
+                # Followers' timelines are written by fanout_feed in the background, an author leaving the pull set is removed by leave_pull_authors
+                # once its earlier posts were copied into them
+                if is_pull_author:
+                    pipe.sadd(PULL_AUTHORS_KEY, author_id)
+                elif was_pull_author and not followers_count:
+                    pipe.srem(PULL_AUTHORS_KEY, author_id)
 
                 # Increment user's own feeds_count
                 pipe.hincrby(name=f"users:{author_id}:profile", key="feeds_count")
 
                 await pipe.execute()
 
+            return not is_pull_author and followers_count > 0
+
         except Exception as e:
             my_logger.error(f"Exception while creating feed: {e}")
             raise ValueError(f"Exception while creating feed: {e}")
 
+    async def fanout_feed(self, author_id: str, feed_id: str, chunk_size: int = 500, max_ft: int = 120) -> int:
+        """Push the feed into follower timelines chunk by chunk, resuming from the last recorded SSCAN cursor."""
+        progress_key = f"fanout:{feed_id}"
+        progress: dict[str, str] = await self.cache_redis.hgetall(progress_key)
+        delivered = int(progress.get("delivered", 0))
+        if progress.get("status") == "done":
+            return delivered
+
+        score: Optional[float] = await self.cache_redis.zscore(name=f"users:{author_id}:user_timeline", value=feed_id)
+        cursor = int(progress.get("cursor", 0))
+        while True:
+            # The author's own timeline holds the feed score, a missing score means the feed was deleted meanwhile, delete_feed already
+            # stripped it from the chunks written so far
+            if score is None or not await self.cache_redis.exists(f"feeds:{feed_id}:meta"):
+                await self.cache_redis.delete(progress_key)
+                return delivered
+
+            cursor, follower_ids = await self.cache_redis.sscan(name=f"users:{author_id}:followers", cursor=cursor, count=chunk_size)
+            delivered += len(follower_ids)
+
+            async with self.cache_redis.pipeline() as pipe:
+                for follower_id in follower_ids:
+                    pipe.zadd(name=f"users:{follower_id}:following_timeline", mapping={feed_id: score})
+                    pipe.zremrangebyrank(name=f"users:{follower_id}:following_timeline", min=0, max=-max_ft - 1)
+                pipe.hset(name=progress_key, mapping={"author_id": author_id, "cursor": cursor, "delivered": delivered, "status": "running" if cursor else "done"})
+                pipe.expire(name=progress_key, time=FANOUT_PROGRESS_TTL)
+                await pipe.execute()
+
+            if cursor == 0:
+                return delivered
+
+    async def is_pull_author(self, author_id: str) -> bool:
+        return bool(await self.cache_redis.sismember(PULL_AUTHORS_KEY, author_id))
+
+    async def leave_pull_authors(self, author_id: str, chunk_size: int = 500, max_ft: int = 120) -> int:
+        """
+        Copy the author's recent posts into every follower's following timeline before dropping it from the pull set, posts that were
+        only merged at read time would vanish from those timelines otherwise. Resumes from the SSCAN cursor recorded in fanout:authors:{author_id}.
+        """
+        progress_key = f"fanout:authors:{author_id}"
+        cursor = int(await self.cache_redis.hget(progress_key, "cursor") or 0)
+        entries: list[tuple[str, float]] = await self.cache_redis.zrevrange(name=f"users:{author_id}:user_timeline", start=0, end=max_ft - 1, withscores=True)
+        delivered = 0
+        while True:
+            cursor, follower_ids = await self.cache_redis.sscan(name=f"users:{author_id}:followers", cursor=cursor, count=chunk_size)
+            delivered += len(follower_ids)
+
+            async with self.cache_redis.pipeline() as pipe:
+                for follower_id in follower_ids if entries else []:
+                    pipe.zadd(name=f"users:{follower_id}:following_timeline", mapping=dict(entries))
+                    pipe.zremrangebyrank(name=f"users:{follower_id}:following_timeline", min=0, max=-max_ft - 1)
+                pipe.hset(name=progress_key, key="cursor", value=cursor)
+                pipe.expire(name=progress_key, time=FANOUT_PROGRESS_TTL)
+                await pipe.execute()
+
+            if cursor == 0:
+                break
+
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.srem(PULL_AUTHORS_KEY, author_id)
+            pipe.delete(progress_key)
+            await pipe.execute()
+        return delivered
+
+    async def get_fanout_progress(self, feed_id: str) -> dict[str, str]:
+        """Progress of the feed's fan-out, "skipped" for feeds that are never fanned out and empty for unknown feeds."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.hgetall(f"fanout:{feed_id}")
+            pipe.hget(f"feeds:{feed_id}:meta", FEED_META_CODEC.field("author_id"))
+            pipe.hget(SCHEDULED_FEED_PAYLOADS_KEY, feed_id)
+            progress, author_id, scheduled = await pipe.execute()
+        if progress:
+            return progress
+        if scheduled:
+            return {"author_id": json.loads(scheduled)["mapping"].get("author", {}).get("id", ""), "status": "queued"}
+        if author_id is None:
+            return {}
+
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.sismember(PULL_AUTHORS_KEY, author_id)
+            pipe.scard(f"users:{author_id}:followers")
+            is_pull_author, followers_count = await pipe.execute()
+        # Pull authors are merged into timelines at read time, and without followers there is nobody to fan out to
+        return {"author_id": author_id, "status": "skipped" if is_pull_author or not followers_count else "queued"}
+
+    async def rerank_global_timeline(self, batch_size: int = 5000) -> int:
+        """
+        Recompute decayed engagement scores for every global_timeline member and write back only the ones that moved by more than
+        FEED_SCORE_EPSILON, with one ZADD. Returns the number of changed feeds.
+        """
+        entries: list[tuple[str, float]] = await self.cache_redis.zrange(name="global_timeline", start=0, end=-1, withscores=True)
+        if not entries:
+            return 0
+        feed_ids: list[str] = [feed_id for feed_id, _ in entries]
+
+        results: list = []
+        for index in range(0, len(feed_ids), batch_size):
+            async with self.cache_redis.pipeline(transaction=False) as pipe:
+                for feed_id in feed_ids[index: index + batch_size]:
+                    pipe.hmget(_counts_key(prefix="feeds", item_id=feed_id), ENGAGEMENT_KEYS)
+                    pipe.hget(f"feeds:{feed_id}:meta", FEED_META_CODEC.field("created_at"))
+                results.extend(await pipe.execute())
+
+        created_at = np.array([float(value) if value is not None else np.nan for value in results[1::2]], dtype=np.float64)
+        counters = np.array([[float(value or 0) for value in row] for row in results[::2]], dtype=np.float64).reshape(-1, len(ENGAGEMENT_KEYS))
+        current = np.array([score for _, score in entries], dtype=np.float64)
+
+        # Feeds whose meta disappeared meanwhile are left to delete_feed
+        alive = ~np.isnan(created_at)
+        scores = np.full(len(feed_ids), np.nan)
+        scores[alive] = _calculate_scores(counters=counters[alive], created_at=created_at[alive])
+        changed = alive & (np.abs(scores - current) > settings.FEED_SCORE_EPSILON)
+        mapping: dict[str, float] = dict(zip(np.array(feed_ids)[changed].tolist(), scores[changed].tolist()))
+        if mapping:
+            await self.cache_redis.zadd(name="global_timeline", mapping=mapping, xx=True)
+            # The copy in the meta hash is what idx:feeds sorts "top" searches by
+            items: list[tuple[str, float]] = list(mapping.items())
+            score_field: str = FEED_META_CODEC.field("score")
+            for index in range(0, len(items), batch_size):
+                async with self.cache_redis.pipeline(transaction=False) as pipe:
+                    for feed_id, score in items[index: index + batch_size]:
+                        await self.set_field_if_exists_script(keys=[f"feeds:{feed_id}:meta"], args=[score_field, score], client=pipe)
+                    await pipe.execute()
+        return len(mapping)
+
     async def update_feed(self, feed_id: str, key: str, value: Any):
+        # Scheduled feeds are not cached until they are released, and deleted ones must not come back as partial hashes
         if value is None:
-            await self.cache_redis.hdel(f"feeds:{feed_id}:meta", key)
+            if not await self.cache_redis.hdel(f"feeds:{feed_id}:meta", FEED_META_CODEC.field(key)):
+                return
         else:
             if isinstance(value, Enum):
                 value = value.value
-            await self.cache_redis.hset(name=f"feeds:{feed_id}:meta", key=key, value=value)
+            elif isinstance(value, list):
+                value = FEED_TAG_SEPARATOR.join(value)
+            if not await self.set_field_if_exists_script(keys=[f"feeds:{feed_id}:meta"], args=[FEED_META_CODEC.field(key), value]):
+                return
+        await self.invalidate_local_caches(kind="feed", item_id=feed_id)
+
+    """ ***************************************** SCHEDULED FEEDS ***************************************** """
+
+    async def schedule_feed(self, mapping: dict, due_at: float, notify: bool = False):
+        """Hold the feed out of every timeline until due_at, scheduling an already scheduled feed again replaces its payload and time."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.hset(SCHEDULED_FEED_PAYLOADS_KEY, key=mapping["id"], value=json.dumps({"mapping": mapping, "notify": notify}))
+            pipe.zadd(SCHEDULED_FEEDS_KEY, mapping={mapping["id"]: due_at})
+            await pipe.execute()
+
+    async def claim_due_feeds(self, now: float, limit: int = 500) -> list[tuple[str, dict]]:
+        """Claimed feeds stay leased in scheduled_feeds:processing until ack_scheduled_feeds, or are queued again once the lease expired."""
+        keys: list[str] = [SCHEDULED_FEEDS_KEY, SCHEDULED_FEED_PAYLOADS_KEY, SCHEDULED_FEEDS_PROCESSING_KEY]
+        rows: list[str] = await self.claim_due_feeds_script(keys=keys, args=[now, limit, settings.SCHEDULED_FEED_LEASE_SECONDS])
+        return [(feed_id, json.loads(payload)) for feed_id, payload in zip(rows[::2], rows[1::2])]
+
+    async def ack_scheduled_feeds(self, feed_ids: list[str]):
+        if not feed_ids:
+            return
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.zrem(SCHEDULED_FEEDS_PROCESSING_KEY, *feed_ids)
+            pipe.hdel(SCHEDULED_FEED_PAYLOADS_KEY, *feed_ids)
+            await pipe.execute()
 
-    async def delete_feed(self, author_id: str, feed_id: str):
+    async def requeue_scheduled_feed(self, feed_id: str, due_at: float):
+        """Hand a claimed feed whose publishing failed back to the queue, its payload was kept by the claim."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.zrem(SCHEDULED_FEEDS_PROCESSING_KEY, feed_id)
+            pipe.zadd(SCHEDULED_FEEDS_KEY, mapping={feed_id: due_at})
+            await pipe.execute()
+
+    async def get_next_due_at(self) -> Optional[float]:
+        entries: list[tuple[str, float]] = await self.cache_redis.zrange(SCHEDULED_FEEDS_KEY, 0, 0, withscores=True)
+        return entries[0][1] if entries else None
+
+    async def unschedule_feed(self, feed_id: str) -> bool:
+        """Returns True only when the feed was still waiting, a feed being published right now is deleted from the caches like any other."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.zrem(SCHEDULED_FEEDS_KEY, feed_id)
+            pipe.zrem(SCHEDULED_FEEDS_PROCESSING_KEY, feed_id)
+            pipe.hdel(SCHEDULED_FEED_PAYLOADS_KEY, feed_id)
+            removed, _, _ = await pipe.execute()
+        return bool(removed)
+
+    async def delete_feed(self, author_id: str, feed_id: str, batch_size: int = 500):
         my_logger.warning(f"Deleting feed: author_id={author_id}, feed_id={feed_id}")
+        if await self.unschedule_feed(feed_id=feed_id):
+            return
         is_feed = await self.cache_redis.exists(f"feeds:{feed_id}:meta") > 0
         is_comment = not is_feed
 
         try:
             # Get all nested comment IDs
-            comment_ids = await self.get_all_nested_comment_ids(feed_id, is_feed=is_feed)
+            comment_ids: list[str] = list(await self.get_all_nested_comment_ids(feed_id, is_feed=is_feed))
             if is_comment:
-                comment_ids.add(feed_id)
+                comment_ids.append(feed_id)
 
-            # Get comment authors
+            # Comment authors and everyone who engaged with the comments or the feed, in one round trip
+            items: list[tuple[str, str]] = [("comments", cid) for cid in comment_ids]
+            if is_feed:
+                items.append(("feeds", feed_id))
             async with self.cache_redis.pipeline() as pipe:
-                for cid in comment_ids:
-                    pipe.get(f"comments:{cid}:author_id")
-                author_ids = await pipe.execute()
+                for prefix, item_id in items:
+                    pipe.get(f"{prefix}:{item_id}:author_id")
+                    for engagement_type in USER_ENGAGEMENT_TYPES:
+                        pipe.smembers(f"{prefix}:{item_id}:{engagement_type}")
+                results = await pipe.execute()
+
+            step = len(USER_ENGAGEMENT_TYPES) + 1
+            unlinks: list[tuple[str, str]] = []
+            for index, (prefix, item_id) in enumerate(items):
+                item_author_id, *engaged_user_ids = results[index * step: (index + 1) * step]
+                if prefix == "comments" and item_author_id:
+                    unlinks.append((f"users:{item_author_id}:comments", item_id))
+                for engagement_type, user_ids in zip(USER_ENGAGEMENT_TYPES, engaged_user_ids):
+                    unlinks.extend((f"users:{user_id}:{engagement_type}", item_id) for user_id in user_ids)
+
+            # Indexes not migrated to zsets yet would fail a plain ZREM with WRONGTYPE and abort the whole batch
+            for offset in range(0, len(unlinks), batch_size):
+                async with self.cache_redis.pipeline() as pipe:
+                    for key, member in unlinks[offset: offset + batch_size]:
+                        await self.update_index_script(keys=[key], args=[0, 0, member], client=pipe)
+                    await pipe.execute()
 
             # Delete comments and their engagement links
-            async with self.cache_redis.pipeline() as pipe:
-                for cid, aid in zip(comment_ids, author_ids):
-                    for suffix in ["comments", "reposts", "quotes", "likes", "views", "bookmarks"]:
-                        pipe.delete(f"comments:{cid}:{suffix}")
-                        pipe.srem(f"users:{aid}:comments", cid)
-                        pipe.srem(f"users:{aid}:{suffix}", cid)
-                    pipe.delete(f"comments:{cid}:author_id")
-                    pipe.delete(f"comments:{cid}:parent_id")
-                    pipe.delete(f"comments:{cid}:comments")
-                await pipe.execute()
+            comment_keys: list[str] = [
+                f"comments:{cid}:{suffix}" for cid in comment_ids for suffix in ["author_id", "parent_id", "comments", "reposts", "quotes", "likes", "views", "bookmarks"]
+            ] + [_counts_key(prefix="comments", item_id=cid) for cid in comment_ids]
+            await self._unlink_keys(keys=comment_keys, batch_size=batch_size)
 
             if is_feed:
-                suffixes = ["comments", "reposts", "quotes", "likes", "views", "bookmarks"]
-
-                # Get all users who interacted with this feed
-                engagement_map = {suffix: await self.cache_redis.smembers(f"feeds:{feed_id}:{suffix}") for suffix in suffixes}
-
-                # Remove the feed ID from user:<user_id>:<suffix> sets
                 async with self.cache_redis.pipeline() as pipe:
                     pipe.zrem("global_timeline", feed_id)
                     pipe.zrem(f"users:{author_id}:user_timeline", feed_id)
                     pipe.zrem(f"users:{author_id}:following_timeline", feed_id)
-
-                    # Remove from followers' timelines
-                    follower_ids = await self.cache_redis.smembers(f"users:{author_id}:followers")
-                    for follower_id in follower_ids:
-                        pipe.zrem(f"users:{follower_id}:following_timeline", feed_id)
-
-                    # Remove feed from all engagement sets
-                    for suffix, user_ids in engagement_map.items():
-                        for user_id in user_ids:
-                            pipe.srem(f"users:{user_id}:{suffix}", feed_id)
-                        pipe.delete(f"feeds:{feed_id}:{suffix}")
-
-                    # Feed metadata and user’s post counter
-                    pipe.delete(f"feeds:{feed_id}:meta")
                     pipe.hincrby(f"users:{author_id}:profile", key="feeds_count", amount=-1)
-
                     await pipe.execute()
+
+                # Pull authors may have crossed the threshold after this feed was fanned out, so followers are always cleaned
+                await self._remove_from_follower_timelines(author_id=author_id, feed_id=feed_id, batch_size=batch_size)
+
+                # Feed metadata, counters and engagement sets
+                await self._unlink_keys(keys=[_counts_key(prefix="feeds", item_id=feed_id), *(f"feeds:{feed_id}:{suffix}" for suffix in ["meta", "comments", "reposts", "quotes", "likes", "views", "bookmarks"])])
+                await self.invalidate_local_caches(kind="feed", item_id=feed_id)
             else:
                 # Handle comment unlinking from parent
                 parent_id = await self.cache_redis.get(f"comments:{feed_id}:parent_id")
                 if parent_id:
                     is_parent_feed = await self.cache_redis.exists(f"feeds:{parent_id}:meta") > 0
                     prefix = "feeds" if is_parent_feed else "comments"
-                    await self.cache_redis.srem(f"{prefix}:{parent_id}:comments", feed_id)
+                    await self.link_comment_script(keys=[f"{prefix}:{parent_id}:comments", _counts_key(prefix=prefix, item_id=parent_id)], args=[feed_id, 0])
 
         except Exception as e:
             my_logger.error(f"Exception during feed deletion: {e}")
             raise ValueError(f"Failed to delete feed {feed_id}: {e}")
 
     async def get_all_nested_comment_ids(self, feed_id: str, is_feed: bool = False) -> set[str]:
-        collected = set()
-        queue = [feed_id]
-        prefix = "feeds" if is_feed else "comments"
-
-        while queue:
-            current = queue.pop()
-            key = f"{prefix}:{current}:comments"
-            children = await self.cache_redis.smembers(key)
+        """Walk the comment tree level by level, reading every node of a level in one pipeline."""
+        collected: set[str] = set()
+        level: list[str] = [f"{'feeds' if is_feed else 'comments'}:{feed_id}:comments"]
+
+        while level:
+            async with self.cache_redis.pipeline() as pipe:
+                for key in level:
+                    pipe.smembers(key)
+                results: list[set[str]] = await pipe.execute()
+
+            children: set[str] = set().union(*results) - collected
             collected.update(children)
-            queue.extend(children)
-            prefix = "comments"
+            level = [f"comments:{cid}:comments" for cid in children]
         return collected
 
+    async def _remove_from_follower_timelines(self, author_id: str, feed_id: str, batch_size: int = 500):
+        cursor = 0
+        while True:
+            cursor, follower_ids = await self.cache_redis.sscan(name=f"users:{author_id}:followers", cursor=cursor, count=batch_size)
+            if follower_ids:
+                async with self.cache_redis.pipeline() as pipe:
+                    for follower_id in follower_ids:
+                        pipe.zrem(f"users:{follower_id}:following_timeline", feed_id)
+                    await pipe.execute()
+            if cursor == 0:
+                break
+
+    async def _unlink_keys(self, keys: list[str], batch_size: int = 500):
+        for offset in range(0, len(keys), batch_size):
+            await self.cache_redis.unlink(*keys[offset: offset + batch_size])
+
     """ ***************************************** INTERACTION ***************************************** """
 
     async def set_engagement(self, user_id: str, feed_id: str, engagement_type: EngagementType, is_comment: bool = False):
-        engagement_key, user_key = _engagement_keys(feed_id=feed_id, user_id=user_id, engagement_type=engagement_type, is_comment=is_comment)
+        keys: list[str] = _engagement_keys(feed_id=feed_id, user_id=user_id, engagement_type=engagement_type, is_comment=is_comment)
+        engaged_at: float = datetime.now(UTC).timestamp()
+        counters, interactions = await self.toggle_engagement_script(keys=keys, args=[user_id, feed_id, engagement_type.value, 1, engaged_at])
+        return _decode_engagement(counters=counters, interactions=interactions)
 
-        if engagement_type == EngagementType.reposts:
-            follower_ids = await cache_manager.get_followers(user_id=user_id)
+    async def remove_engagement(self, user_id: str, feed_id: str, engagement_type: EngagementType, is_comment: bool = False):
+        keys: list[str] = _engagement_keys(feed_id=feed_id, user_id=user_id, engagement_type=engagement_type, is_comment=is_comment)
+        counters, interactions = await self.toggle_engagement_script(keys=keys, args=[user_id, feed_id, engagement_type.value, 0, 0])
+        return _decode_engagement(counters=counters, interactions=interactions)
 
-            async with cache_manager.cache_redis.pipeline() as pipe:
-                for fid in follower_ids:
-                    pipe.sadd(f"users:{fid}:following_timeline", feed_id)
+    async def get_engagement(self, user_id: str, feed_id: str, is_comment: bool = False):
+        engagements: list[dict] = await self.get_engagements(feed_ids=[feed_id], user_id=user_id, is_comment=is_comment)
+        return engagements[0]
 
+    async def get_engagements(self, feed_ids: list[str], user_id: str, is_comment: bool = False) -> list[dict]:
+        """Counters and the user's interaction flags for a whole page of feeds or comments, in one pipeline."""
         async with self.cache_redis.pipeline() as pipe:
-            pipe.sadd(engagement_key, user_id)
-            pipe.sadd(user_key, feed_id)
-            await pipe.execute()
+            _queue_engagements(pipe=pipe, feed_ids=feed_ids, user_id=user_id, is_comment=is_comment)
+            results = await pipe.execute()
+        return _decode_engagements(results=results, count=len(feed_ids))
 
-            return await self.get_engagement(user_id=user_id, feed_id=feed_id)
+    async def get_comments_engagements(self, feed_id: str, comment_ids: list[str], user_id: str) -> tuple[int, list[dict]]:
+        """Comments count of the feed together with the engagements of one page of its comments, in one pipeline."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.scard(f"feeds:{feed_id}:comments")
+            _queue_engagements(pipe=pipe, feed_ids=comment_ids, user_id=user_id, is_comment=True)
+            results = await pipe.execute()
+        return results[0], _decode_engagements(results=results[1:], count=len(comment_ids))
+
+    async def backfill_engagement_counts(self, batch_size: int = 500) -> int:
+        """Seed counts:{prefix}:{id} from the engagement sets for feeds and comments cached before the counters hash existed or moved there."""
+        backfilled = 0
+        for pattern, prefix in (("feeds:*:meta", "feeds"), ("comments:*:author_id", "comments")):
+            cursor = 0
+            while True:
+                cursor, keys = await self.cache_redis.scan(cursor=cursor, match=pattern, count=batch_size)
+                item_ids: list[str] = [key.split(":")[1] for key in keys]
+                await self.seed_engagement_counts(prefix=prefix, item_ids=item_ids)
+
+                backfilled += len(item_ids)
+                if cursor == 0:
+                    break
+        return backfilled
+
+    async def seed_engagement_counts(self, prefix: str, item_ids: list[str]):
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for item_id in item_ids:
+                keys: list[str] = [_counts_key(prefix=prefix, item_id=item_id), *(f"{prefix}:{item_id}:{key}" for key in ENGAGEMENT_KEYS)]
+                await self.seed_engagement_counts_script(keys=keys, args=[], client=pipe)
+                # Written by an earlier release under the feeds: prefix, where idx:feeds indexed every one as an empty document
+                pipe.unlink(f"{prefix}:{item_id}:counts")
+            await pipe.execute()
 
-    async def remove_engagement(self, user_id: str, feed_id: str, engagement_type: EngagementType, is_comment: bool = False):
-        engagement_key, user_key = _engagement_keys(feed_id=feed_id, user_id=user_id, engagement_type=engagement_type, is_comment=is_comment)
+    async def scan_legacy_engagement_indexes(self, batch_size: int = 500):
+        """Yield batches of (user_id, engagement type) whose users:{id}:{type} index is still a plain set."""
+        for engagement_type in USER_ENGAGEMENT_TYPES:
+            cursor = 0
+            while True:
+                cursor, keys = await self.cache_redis.scan(cursor=cursor, match=f"users:*:{engagement_type}", count=batch_size, _type="set")
+                if keys:
+                    yield [(key.split(":")[1], engagement_type) for key in keys]
+                if cursor == 0:
+                    break
+
+    async def migrate_user_engagement_index(self, user_id: str, engagement_type: str, engaged_at: dict[str, float]) -> int:
+        """Convert one legacy set index into a zset, feeds without a known engagement time fall back to their creation time."""
+        key = f"users:{user_id}:{engagement_type}"
+        feed_ids: list[str] = [feed_id for feed_id in await self.cache_redis.smembers(key) if feed_id not in engaged_at]
 
         async with self.cache_redis.pipeline() as pipe:
-            pipe.srem(engagement_key, user_id)
-            pipe.srem(user_key, feed_id)
+            for feed_id in feed_ids:
+                pipe.hget(f"feeds:{feed_id}:meta", FEED_META_CODEC.field("created_at"))
+            created_ats: list[Optional[str]] = await pipe.execute()
+
+        scores: dict[str, float] = dict(engaged_at)
+        scores.update({feed_id: float(created_at) for feed_id, created_at in zip(feed_ids, created_ats) if created_at is not None})
+        args: list[str | float] = [0, *(value for pair in scores.items() for value in pair)]
+        return await self.migrate_engagement_index_script(keys=[key], args=args)
+
+    async def migrate_hash_encoding(self, batch_size: int = 500) -> dict[str, dict[str, int]]:
+        """
+        Rewrite feed metas and profiles into the layout selected by COMPACT_CACHE_ENCODING and recreate the search
+        indexes over the stored fields. Returns MEMORY USAGE totals of the rewritten keys before and after.
+        """
+        report: dict[str, dict[str, int]] = {}
+        for name, pattern, codec in (("feeds", "feeds:*:meta", FEED_META_CODEC), ("profiles", "users:*:profile", PROFILE_CODEC)):
+            renames: list[str] = [field for pair in codec.renames() for field in pair]
+            totals: dict[str, int] = {"keys": 0, "fields_renamed": 0, "bytes_before": 0, "bytes_after": 0}
+            cursor = 0
+            while True:
+                cursor, keys = await self.cache_redis.scan(cursor=cursor, match=pattern, count=batch_size)
+                if keys:
+                    async with self.cache_redis.pipeline(transaction=False) as pipe:
+                        for key in keys:
+                            pipe.memory_usage(key)
+                        for key in keys:
+                            await self.rename_hash_fields_script(keys=[key], args=renames, client=pipe)
+                        for key in keys:
+                            pipe.memory_usage(key)
+                        results: list = await pipe.execute()
+
+                    totals["keys"] += len(keys)
+                    totals["bytes_before"] += sum(value or 0 for value in results[: len(keys)])
+                    totals["fields_renamed"] += sum(results[len(keys): 2 * len(keys)])
+                    totals["bytes_after"] += sum(value or 0 for value in results[2 * len(keys):])
+                if cursor == 0:
+                    break
+            report[name] = totals
+
+        self.feed_meta_cache.clear()
+        self.profile_cache.clear()
+        # The stored field names changed under the indexes, rebuild them before the aliases move
+        for alias in (USER_INDEX_NAME, feed_INDEX_NAME):
+            await search_index_manager.reindex(alias=alias)
+        return report
+
+    """ ******************************************** REBUILD ******************************************** """
+
+    async def claim_rebuild(self, user_id: str, ttl: int = 300) -> bool:
+        """Only the first cache miss for a user within ttl seconds schedules a rebuild."""
+        return bool(await self.cache_redis.set(name=f"rebuild:{user_id}", value=1, nx=True, ex=ttl))
+
+    async def claim_rollout(self, name: str) -> bool:
+        """Only the first replica starting after a deploy enqueues a one-off backfill, the marker is kept so later restarts skip it."""
+        return bool(await self.cache_redis.set(name=f"rollouts:{name}", value=int(time.time()), nx=True))
+
+    async def rebuild_profiles(self, mappings: list[dict]):
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for mapping in mappings:
+                pipe.hset(f"users:{mapping['id']}:profile", mapping=PROFILE_CODEC.encode(mapping))
+                await self._queue_identity_filters(pipe=pipe, mapping=mapping)
+                _queue_username_suggestion(pipe=pipe, user_id=mapping["id"], old_username=None, new_username=mapping.get("username"))
             await pipe.execute()
 
-        return await self.get_engagement(user_id=user_id, feed_id=feed_id)
+    async def seed_username_suggestions(self, users: list[tuple[str, str]]):
+        """Add a batch of (user id, username) pairs to the username suggestions, adding one again only replaces its score and payload."""
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for user_id, username in users:
+                _queue_username_suggestion(pipe=pipe, user_id=user_id, old_username=None, new_username=username)
+            await pipe.execute()
 
-    async def get_engagement(self, user_id: str, feed_id: str, is_comment: bool = False):
-        engagement_keys = ["comments", "reposts", "quotes", "likes", "views", "bookmarks"]
-        interaction_keys = ["reposted", "quoted", "liked", "viewed", "bookmarked"]
+    async def rebuild_feeds(self, feeds: list[dict], counts: dict[str, dict[str, int]], comment_ids: dict[str, list[str]], max_gt: int = 360, max_ut: int = 120):
+        """
+        Write feed and comment mappings the way create_feed does, without touching follower timelines. Counters and comment sets come from
+        the database, keyed by item id, so every item only writes its own keys and a parent's comments set is filled by the parent itself.
+        """
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for mapping in feeds:
+                mapping = dict(mapping)
+                author_id: str = mapping.pop("author", {}).get("id", "")
+                feed_id: str = mapping.get("id", "")
+                parent_id: Optional[str] = mapping.get("parent_id", None)
+                prefix = "feeds" if parent_id is None else "comments"
+
+                feed_counts: dict[str, int] = {key: 0 for key in ENGAGEMENT_KEYS} | counts.get(feed_id, {})
+                pipe.hset(_counts_key(prefix=prefix, item_id=feed_id), mapping=feed_counts)
+                if comment_ids.get(feed_id):
+                    pipe.sadd(f"{prefix}:{feed_id}:comments", *comment_ids[feed_id])
+
+                if parent_id is not None:
+                    pipe.sadd(f"users:{author_id}:comments", feed_id)
+                    pipe.set(name=f"comments:{feed_id}:author_id", value=author_id)
+                    pipe.set(name=f"comments:{feed_id}:parent_id", value=parent_id)
+                    continue
 
-        prefix = "comments" if is_comment else "feeds"
+                mapping.update({"author_id": author_id})
+                _flatten_feed_mapping(mapping=mapping)
+                score = _calculate_score(feed_counts, mapping.get("created_at", time.time()))
+                mapping.update({"score": score})
+                pipe.hset(name=f"feeds:{feed_id}:meta", mapping=FEED_META_CODEC.encode(mapping))
+                # NX keeps the score of a feed that is already ranked, a per-user rebuild must not reorder the global timeline
+                pipe.zadd(name="global_timeline", mapping={feed_id: score}, nx=True)
+                pipe.zremrangebyrank(name="global_timeline", min=0, max=-max_gt - 1)
+                pipe.zadd(name=f"users:{author_id}:user_timeline", mapping={feed_id: score})
+                pipe.zremrangebyrank(name=f"users:{author_id}:user_timeline", min=0, max=-max_ut - 1)
+            await pipe.execute()
 
-        async with self.cache_redis.pipeline() as pipe:
-            for key in engagement_keys:
-                pipe.scard(f"{prefix}:{feed_id}:{key}")
+    async def rebuild_follows(self, edges: list[tuple[str, str]], user_id: Optional[str] = None):
+        """Write (follower id, following id) edges into both sets, or only into the sets of user_id when given."""
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for follower_id, following_id in edges:
+                if user_id in (None, follower_id):
+                    pipe.sadd(f"users:{follower_id}:followings", following_id)
+                if user_id in (None, following_id):
+                    pipe.sadd(f"users:{following_id}:followers", follower_id)
+            await pipe.execute()
 
-            for key in engagement_keys[1:]:
-                pipe.sismember(f"{prefix}:{feed_id}:{key}", user_id)
+    async def rebuild_blocks(self, edges: list[tuple[str, str]]):
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for blocker_id, blocked_id in edges:
+                pipe.sadd(f"users:{blocker_id}:blocked", blocked_id)
+            await pipe.execute()
 
-            results = await pipe.execute()
+    async def rebuild_engagements(self, engagements: list[tuple[str, str, str, float, bool]], feed_sets: bool = True, indexes: bool = True):
+        """Write (user id, feed id, engagement type, engaged at, is comment) rows into the feed sets and/or the user's time-ordered index."""
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for user_id, feed_id, engagement_type, engaged_at, is_comment in engagements:
+                if feed_sets:
+                    pipe.sadd(f"{'comments' if is_comment else 'feeds'}:{feed_id}:{engagement_type}", user_id)
+                if indexes:
+                    await self.update_index_script(keys=[f"users:{user_id}:{engagement_type}"], args=[1, engaged_at, feed_id], client=pipe)
+            await pipe.execute()
 
-        engagement = {}
-        num_engagement_keys = len(engagement_keys)
-        engagement_values = results[:num_engagement_keys]
-        engagement.update({key: value for key, value in zip(engagement_keys, engagement_values) if value > 0})
+    async def rebuild_pull_authors(self, user_ids: list[str]):
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.scard(f"users:{user_id}:followers")
+            followers_counts: list[int] = await pipe.execute()
 
-        interaction_results = results[num_engagement_keys:]
-        engagement.update({interaction_key: True for interaction_key, interacted in zip(interaction_keys, interaction_results) if interacted})
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for user_id, followers_count in zip(user_ids, followers_counts):
+                if followers_count > settings.FANOUT_FOLLOWER_THRESHOLD:
+                    pipe.sadd(PULL_AUTHORS_KEY, user_id)
+                else:
+                    pipe.srem(PULL_AUTHORS_KEY, user_id)
+            await pipe.execute()
 
-        return engagement
+    async def rebuild_following_timelines(self, user_ids: list[str], max_ft: int = 120):
+        """Union the user's own and push-author followings' user timelines, pull authors are merged at read time anyway."""
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.smembers(f"users:{user_id}:followings")
+            pipe.smembers(PULL_AUTHORS_KEY)
+            *followings, pull_authors = await pipe.execute()
+
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            for user_id, following_ids in zip(user_ids, followings):
+                keys: list[str] = [f"users:{user_id}:user_timeline", *(f"users:{following_id}:user_timeline" for following_id in following_ids - pull_authors)]
+                pipe.zunionstore(dest=f"users:{user_id}:following_timeline", keys=keys, aggregate="MAX")
+                pipe.zremrangebyrank(name=f"users:{user_id}:following_timeline", min=0, max=-max_ft - 1)
+            await pipe.execute()
 
     """ ********************************************* USER ********************************************* """
 
@@ -647,9 +1493,11 @@ class CacheManager:
 
             uid = mapping.get("id")
             async with self.cache_redis.pipeline() as pipe:
-                pipe.hset(name=f"users:{uid}:profile", mapping=mapping)
+                pipe.hset(name=f"users:{uid}:profile", mapping=PROFILE_CODEC.encode(mapping))
                 if user_id is not None and is_following:
                     pipe.sadd(f"users:{uid}:followers", user_id)
+                await self._queue_identity_filters(pipe=pipe, mapping=mapping)
+                _queue_username_suggestion(pipe=pipe, user_id=uid, old_username=None, new_username=mapping.get("username"))
                 await pipe.execute()
         except Exception as e:
             raise ValueError(f"🥶 Exception while saving user data to cache: {e}")
@@ -663,32 +1511,51 @@ class CacheManager:
             elif isinstance(value, str):
                 value = value.strip()
 
-            if value is None:
-                await self.cache_redis.hdel(f"users:{user_id}:profile", key)
-            else:
-                await self.cache_redis.hset(name=f"users:{user_id}:profile", key=key, value=value)
+            old_username: Optional[str] = await self.cache_redis.hget(f"users:{user_id}:profile", PROFILE_CODEC.field("username")) if key == "username" else None
+            async with self.cache_redis.pipeline() as pipe:
+                if value is None:
+                    pipe.hdel(f"users:{user_id}:profile", PROFILE_CODEC.field(key))
+                else:
+                    pipe.hset(name=f"users:{user_id}:profile", key=PROFILE_CODEC.field(key), value=value)
+                if key == "username":
+                    _queue_username_suggestion(pipe=pipe, user_id=user_id, old_username=old_username, new_username=value)
+                if key in ("username", "email") and value is not None:
+                    await self._queue_identity_filters(pipe=pipe, mapping={key: value})
+                await pipe.execute()
+            await self.invalidate_local_caches(kind="profile", item_id=user_id)
         except Exception as e:
             raise ValueError(f"🥶 Exception while updating user data in cache: {e}")
 
     async def update_profile_from_mapping(self, user_id: str, mapping: dict[str, Any]):
         try:
             keys_for_deletion: list[str] = []
+            values: dict[str, Any] = {}
             for key, value in mapping.items():
                 if isinstance(value, datetime):
-                    mapping[key] = value.timestamp()
+                    value = value.timestamp()
                 elif isinstance(value, bool):
-                    mapping[key] = int(value)
+                    value = int(value)
                 elif isinstance(value, str):
-                    mapping[key] = value.strip()
+                    value = value.strip()
 
                 if value is None:
                     keys_for_deletion.append(key)
-                    mapping.pop(key)
+                else:
+                    values[key] = value
 
             async with self.cache_redis.pipeline() as pipe:
-                pipe.hset(f"users:{user_id}:profile", mapping=mapping)
-                pipe.hdel(f"users:{user_id}:profile", *keys_for_deletion)
-                await pipe.execute()
+                pipe.hget(f"users:{user_id}:profile", PROFILE_CODEC.field("username"))
+                if values:
+                    pipe.hset(f"users:{user_id}:profile", mapping=PROFILE_CODEC.encode(values))
+                if keys_for_deletion:
+                    pipe.hdel(f"users:{user_id}:profile", *PROFILE_CODEC.fields(keys_for_deletion))
+                await self._queue_identity_filters(pipe=pipe, mapping=values)
+                old_username, *_ = await pipe.execute()
+            if "username" in mapping:
+                async with self.cache_redis.pipeline() as pipe:
+                    _queue_username_suggestion(pipe=pipe, user_id=user_id, old_username=old_username, new_username=values.get("username"))
+                    await pipe.execute()
+            await self.invalidate_local_caches(kind="profile", item_id=user_id)
 
         except Exception as e:
             raise ValueError(f"🥶 Exception while updating user data in cache: {e}")
@@ -701,145 +1568,162 @@ class CacheManager:
                 pipe.sismember(name=f"users:{user_id}:followings", value=target_user_id)
             results = await pipe.execute()
 
-        user_dict: dict = results[0]
+        user_dict: dict = PROFILE_CODEC.decode(results[0])
         if target_user_id is not None:
             user_dict.update({"is_following": results[1]})
         return user_dict if user_dict else None
 
-    async def delete_profile(self, user_id: str):
-        followers: set[str] = await self.get_followers(user_id)
-        following: set[str] = await self.get_following(user_id)
+    async def delete_profile(self, user_id: str, job_id: Optional[str] = None, batch_size: int = 200) -> dict[str, str]:
+        """
+        Tear the account down phase by phase in bounded batches. Progress is kept in teardown:{job_id}
+        after every batch, so a retried job resumes at the recorded phase and scan cursor.
+        """
+        progress_key = f"teardown:{job_id or user_id}"
+        progress: dict[str, str] = await self.cache_redis.hgetall(progress_key)
+        if progress.get("status") == "done":
+            return progress
+
+        resume_phase: str = progress.get("phase", TEARDOWN_PHASES[0])
+        cursor = int(progress.get("cursor", 0))
+        deleted = int(progress.get("deleted", 0))
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.hset(progress_key, mapping={"user_id": user_id, "status": "running", "phase": resume_phase, "cursor": cursor, "deleted": deleted})
+            pipe.expire(progress_key, TEARDOWN_PROGRESS_TTL)
+            await pipe.execute()
 
-        feed_ids: list[str] = await self.cache_redis.lrange(name=f"user:{user_id}:user_timeline", start=0, end=-1)
+        for phase in TEARDOWN_PHASES[TEARDOWN_PHASES.index(resume_phase):]:
+            while True:
+                cursor, removed = await self._teardown_step(user_id=user_id, phase=phase, cursor=cursor, batch_size=batch_size)
+                deleted += removed
+                await self.cache_redis.hset(progress_key, mapping={"phase": phase, "cursor": cursor, "deleted": deleted})
+                if cursor == 0:
+                    break
 
-        async with my_cache_redis.pipeline() as pipe:
-            # Remove user profile
-            pipe.delete(
-                f"users:{user_id}:profile", f"users:{user_id}:user_timeline", f"user:{user_id}:following_timeline", f"users:{user_id}:followers", f"users:{user_id}:followings"
-            )
+        username: Optional[str] = await self.cache_redis.hget(f"users:{user_id}:profile", PROFILE_CODEC.field("username"))
+        async with self.cache_redis.pipeline() as pipe:
+            _queue_username_suggestion(pipe=pipe, user_id=user_id, old_username=username, new_username=None)
+            pipe.unlink(*(f"users:{user_id}:{suffix}" for suffix in ["profile", "user_timeline", "following_timeline", "followers", "followings", "blocked", "comments", "chat_stream", "presence", *USER_ENGAGEMENT_TYPES]))
+            pipe.srem("feeds:online", user_id)
+            pipe.srem("chats:online", user_id)
+            pipe.srem(PULL_AUTHORS_KEY, user_id)
+            pipe.hset(progress_key, mapping={"status": "done", "phase": "", "cursor": 0})
+            await pipe.execute()
 
-            # Remove follow relationships
-            for follower_id in followers:
-                pipe.srem(f"users:{follower_id}:followings", user_id)
-            for following_id in following:
-                pipe.srem(f"users:{following_id}:followers", user_id)
+        await self.invalidate_local_caches(kind="profile", item_id=user_id)
+        return await self.cache_redis.hgetall(progress_key)
 
-            # delete all feeds created by the user
-            for feed_id in feed_ids:
-                pipe.zrem("global_timeline", feed_id)
+    async def get_teardown_progress(self, job_id: str) -> dict[str, str]:
+        return await self.cache_redis.hgetall(f"teardown:{job_id}")
 
-                # Remove feed from all user followers home timelines
-                for follower_id in followers:
-                    pipe.zrem(f"users:{follower_id}:home_timeline", feed_id)
+    async def _teardown_step(self, user_id: str, phase: str, cursor: int, batch_size: int) -> tuple[int, int]:
+        """Run one batch of a teardown phase and return the next scan cursor (0 when the phase is finished) with the number of removed items."""
+        if phase == "scheduled":
+            # Pending posts are not cached yet, left here they would still be published after the account is gone
+            cursor, payloads = await self.cache_redis.hscan(name=SCHEDULED_FEED_PAYLOADS_KEY, cursor=cursor, count=batch_size)
+            feed_ids: list[str] = [feed_id for feed_id, payload in payloads.items() if json.loads(payload)["mapping"].get("author", {}).get("id") == user_id]
+            for feed_id in feed_ids:
+                await self.unschedule_feed(feed_id=feed_id)
+            return cursor, len(feed_ids)
 
-                # Delete feed metadata and stats
-                pipe.delete(f"feeds:{feed_id}:meta")
+        if phase == "feeds":
+            # user_timeline is trimmed to the latest posts, idx:feeds holds every cached one and drops each as it is deleted
+            results: SearchResult = await self.search_redis.search.search(
+                index=feed_INDEX_NAME, query=_tag_clause("author_id", [user_id]), nocontent=True, offset=0, limit=batch_size, dialect=2
+            )
+            feed_ids: list[str] = [str(document.id).split(":")[1] for document in results.documents]
+            for feed_id in feed_ids:
+                await self.delete_feed(author_id=user_id, feed_id=feed_id)
+            return (1 if results.total > len(feed_ids) else 0), len(feed_ids)
+
+        if phase == "comments":
+            cursor, comment_ids = await self.cache_redis.sscan(name=f"users:{user_id}:comments", cursor=cursor, count=batch_size)
+            for comment_id in comment_ids:
+                await self.delete_feed(author_id=user_id, feed_id=comment_id)
+            return cursor, len(comment_ids)
+
+        if phase in ("followers", "followings"):
+            # Each side of a follow edge lives in the other user's opposite set
+            reverse_suffix = "followings" if phase == "followers" else "followers"
+            cursor, other_ids = await self.cache_redis.sscan(name=f"users:{user_id}:{phase}", cursor=cursor, count=batch_size)
+            async with self.cache_redis.pipeline() as pipe:
+                for other_id in other_ids:
+                    pipe.srem(f"users:{other_id}:{reverse_suffix}", user_id)
+                await pipe.execute()
+            return cursor, len(other_ids)
 
-                # remove from feeds:online & chats:online
-                pipe.srem("feeds:online", user_id)
-                pipe.srem("chats:online", user_id)
+        if phase == "blocked":
+            # Unblocking also drops the other user's reverse entry left by a symmetrical block
+            cursor, other_ids = await self.cache_redis.sscan(name=f"users:{user_id}:blocked", cursor=cursor, count=batch_size)
+            async with self.cache_redis.pipeline() as pipe:
+                for other_id in other_ids:
+                    await self.toggle_block_script(keys=_block_keys(blocker_id=user_id, blocked_id=other_id), args=[user_id, other_id, 1], client=pipe)
+                await pipe.execute()
+            return cursor, len(other_ids)
 
-            await pipe.execute()
+        # engagements:{type}, undo every engagement so the feed sets and their counters stay in sync
+        engagement_type = EngagementType(phase.split(":")[1])
+        key = f"users:{user_id}:{engagement_type.value}"
+        if await self.cache_redis.type(key) == "set":
+            cursor, feed_ids = await self.cache_redis.sscan(name=key, cursor=cursor, count=batch_size)
+        else:
+            cursor, entries = await self.cache_redis.zscan(name=key, cursor=cursor, count=batch_size)
+            feed_ids = [feed_id for feed_id, _ in entries]
 
+        async with self.cache_redis.pipeline() as pipe:
             for feed_id in feed_ids:
-                await self.delete_feed(author_id=user_id, feed_id=feed_id)
+                pipe.exists(f"feeds:{feed_id}:meta")
+            is_feeds: list[int] = await pipe.execute()
+
+        async with self.cache_redis.pipeline() as pipe:
+            for feed_id, is_feed in zip(feed_ids, is_feeds):
+                keys: list[str] = _engagement_keys(feed_id=feed_id, user_id=user_id, engagement_type=engagement_type, is_comment=not is_feed)
+                await self.toggle_engagement_script(keys=keys, args=[user_id, feed_id, engagement_type.value, 0, 0], client=pipe)
+            await pipe.execute()
+        return cursor, len(feed_ids)
 
     async def get_profile_avatar_url(self, user_id: str) -> Optional[str]:
-        return await self.cache_redis.hget(name=f"users:{user_id}:profile", key="avatar")
+        return await self.cache_redis.hget(name=f"users:{user_id}:profile", key=PROFILE_CODEC.field("avatar_url"))
 
     """ ****************************************** BLOCKING ****************************************** """
 
     async def get_block_status(self, blocker_id: str, blocked_id: str) -> dict:
-        blocked_target = bool(await self.cache_redis.sismember(f"users:{blocker_id}:blocked", blocked_id))
-        blocked_by_target = bool(await self.cache_redis.sismember(f"users:{blocked_id}:blocked", blocker_id))
+        blocked_target, blocked_by_target = await self._get_block_flags(user_id=blocker_id, other_id=blocked_id)
         return {"blocked": blocked_target, "symmetrical": blocked_target and blocked_by_target}
 
-    async def toggle_block_user(self, blocker_id: str, blocked_id: str, symmetrical: bool = False):
-        is_already_blocked = await self.cache_redis.sismember(f"users:{blocker_id}:blocked", blocked_id)
-
-        blocker_follows_blocked = await self.cache_redis.sismember(f"users:{blocker_id}:followings", blocked_id)
-        blocked_follows_blocker = await self.cache_redis.sismember(f"users:{blocked_id}:followings", blocker_id)
-
-        blocked_user_feeds = await self.cache_redis.zrange(f"users:{blocked_id}:user_timeline", 0, -1) if blocker_follows_blocked else []
-        blocker_user_feeds = await self.cache_redis.zrange(f"users:{blocker_id}:user_timeline", 0, -1) if blocked_follows_blocker else []
-
-        async with self.cache_redis.pipeline() as pipe:
-            if is_already_blocked:
-                # 🔓 UNBLOCK logic
-                pipe.srem(f"users:{blocker_id}:blocked", blocked_id)
-
-                if symmetrical:
-                    pipe.srem(f"users:{blocked_id}:blocked", blocker_id)
-
-            else:
-                # 🚫 BLOCK logic
-                pipe.sadd(f"users:{blocker_id}:blocked", blocked_id)
-
-                # Remove blocker → blocked follow relation
-                if blocker_follows_blocked:
-                    pipe.srem(f"users:{blocker_id}:followers", blocked_id)
-                    pipe.srem(f"users:{blocked_id}:followings", blocker_id)
-                    pipe.hincrby(f"users:{blocked_id}:profile", "followers_count", -1)
-                    pipe.hincrby(f"users:{blocker_id}:profile", "followings_count", -1)
-                    if blocked_user_feeds:
-                        pipe.zrem(f"users:{blocker_id}:following_timeline", *blocked_user_feeds)
-
-                if symmetrical:
-                    pipe.sadd(f"users:{blocked_id}:blocked", blocker_id)
-
-                    # Remove blocked → blocker follow relation
-                    if blocked_follows_blocker:
-                        pipe.srem(f"users:{blocked_id}:followings", blocker_id)
-                        pipe.srem(f"users:{blocker_id}:followers", blocked_id)
-                        pipe.hincrby(f"users:{blocked_id}:profile", "followings_count", -1)
-                        pipe.hincrby(f"users:{blocker_id}:profile", "followers_count", -1)
-                        if blocker_user_feeds:
-                            pipe.zrem(f"users:{blocked_id}:following_timeline", *blocker_user_feeds)
-
-            await pipe.execute()
+    async def toggle_block_user(self, blocker_id: str, blocked_id: str, symmetrical: bool = False) -> dict:
+        result: int | list[int] = await self.toggle_block_script(keys=_block_keys(blocker_id=blocker_id, blocked_id=blocked_id), args=[blocker_id, blocked_id, int(symmetrical)])
+        if result == -1:
+            raise ValueError("You cannot block a user who has blocked you.")
+        blocked_target, blocked_by_target = result
+        return {"blocked": bool(blocked_target), "symmetrical": bool(blocked_target and blocked_by_target)}
 
     async def is_blocked_by_either(self, user_id: str, other_id: str) -> bool:
-        return await self.cache_redis.sismember(f"users:{user_id}:blocked", other_id) or await self.cache_redis.sismember(f"users:{other_id}:blocked", user_id)
+        return any(await self._get_block_flags(user_id=user_id, other_id=other_id))
 
     async def is_symmetrical_block(self, user_id: str, other_id: str) -> bool:
-        return await self.cache_redis.sismember(f"users:{user_id}:blocked", other_id) and await self.cache_redis.sismember(f"users:{other_id}:blocked", user_id)
+        return all(await self._get_block_flags(user_id=user_id, other_id=other_id))
+
+    async def _get_block_flags(self, user_id: str, other_id: str) -> tuple[bool, bool]:
+        """Whether user_id blocks other_id and whether other_id blocks user_id, in one round trip."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.sismember(f"users:{user_id}:blocked", other_id)
+            pipe.sismember(f"users:{other_id}:blocked", user_id)
+            blocks_other, blocked_by_other = await pipe.execute()
+        return bool(blocks_other), bool(blocked_by_other)
 
         # ******************************************************************** FOLLOW MANAGEMENT ********************************************************************
 
     async def add_follower(self, user_id: str, following_id: str, max_ft: int = 120):
-        blocked_by_target = await self.cache_redis.sismember(f"users:{following_id}:blocked", user_id)
-        blocks_target = await self.cache_redis.sismember(f"users:{user_id}:blocked", following_id)
+        keys: list[str] = [*_follow_keys(user_id=user_id, following_id=following_id), f"users:{user_id}:blocked", f"users:{following_id}:blocked", PULL_AUTHORS_KEY]
+        result: int = await self.follow_script(keys=keys, args=[user_id, following_id, max_ft])
 
-        if blocked_by_target:
+        if result == 1:
             raise ValueError("You are blocked by this user and cannot follow them.")
-        if blocks_target:
+        if result == 2:
             raise ValueError("You have blocked this user. Unblock them first to follow.")
 
-        following_feed_ids: list[tuple[str, float]] = await self.cache_redis.zrange(name=f"users:{following_id}:user_timeline", start=0, end=-1, withscores=True)
-
-        async with self.cache_redis.pipeline() as pipe:
-            pipe.sadd(f"users:{following_id}:followers", user_id)
-            pipe.sadd(f"users:{user_id}:followings", following_id)
-            pipe.hincrby(name=f"users:{following_id}:profile", key="followers_count")
-            pipe.hincrby(name=f"users:{user_id}:profile", key="followings_count")
-
-            if following_feed_ids:
-                mapping: dict[str, float] = {feed_id: score for feed_id, score in following_feed_ids}
-                pipe.zadd(f"users:{user_id}:following_timeline", mapping)
-                pipe.zremrangebyrank(name=f"users:{user_id}:following_timeline", min=0, max=-max_ft - 1)
-            await pipe.execute()
-
     async def remove_follower(self, user_id: str, following_id: str):
-        following_feed_ids: list[str] = await self.cache_redis.zrange(name=f"users:{following_id}:user_timeline", start=0, end=-1)
-        async with self.cache_redis.pipeline() as pipe:
-            pipe.srem(f"users:{following_id}:followers", user_id)
-            pipe.srem(f"users:{user_id}:followings", following_id)
-            pipe.hincrby(name=f"users:{following_id}:profile", key="followers_count", amount=-1)
-            pipe.hincrby(name=f"users:{user_id}:profile", key="followings_count", amount=-1)
-
-            if following_feed_ids:
-                pipe.zrem(f"users:{user_id}:following_timeline", *following_feed_ids)
-            await pipe.execute()
+        await self.unfollow_script(keys=_follow_keys(user_id=user_id, following_id=following_id), args=[user_id, following_id])
 
     async def get_followers(self, user_id: str) -> set[str]:
         return await self.cache_redis.smembers(f"users:{user_id}:followers")
@@ -865,6 +1749,51 @@ class CacheManager:
     async def remove_registration_credentials(self, verify_token: str):
         await self.cache_redis.delete(f"tokens:registration:{verify_token}")
 
+    async def reserve_registration(self, username: str, email: str, expiry: int = 600) -> tuple[bool, bool, bool, bool]:
+        """
+        Check both Bloom filters and reserve the username and email with SET NX in one round trip.
+        Returns (username_pending, email_pending, username_maybe_taken, email_maybe_taken), nothing is reserved while either is pending.
+        """
+        keys: list[str] = [USERNAMES_FILTER_KEY, EMAILS_FILTER_KEY, f"registration:usernames:{username.lower()}", f"registration:emails:{email.lower()}", IDENTITY_FILTERS_SEEDED_KEY]
+        flags: list[int] = await self.reserve_registration_script(keys=keys, args=[username.lower(), email.lower(), expiry])
+        return bool(flags[0]), bool(flags[1]), bool(flags[2]), bool(flags[3])
+
+    async def release_registration(self, username: str, email: str):
+        await self.cache_redis.delete(f"registration:usernames:{username.lower()}", f"registration:emails:{email.lower()}")
+
+    async def reset_identity_filters(self):
+        """Replace the filters with empty ones reserved at the configured capacity and error rate, registration ignores them until marked seeded."""
+        async with self.cache_redis.pipeline() as pipe:
+            pipe.delete(IDENTITY_FILTERS_SEEDED_KEY, USERNAMES_FILTER_KEY, EMAILS_FILTER_KEY)
+            for key in (USERNAMES_FILTER_KEY, EMAILS_FILTER_KEY):
+                pipe.bf().reserve(key, settings.IDENTITY_FILTER_ERROR_RATE, settings.IDENTITY_FILTER_CAPACITY)
+            await pipe.execute()
+
+    async def seed_identity_filters(self, usernames: list[str], emails: list[str]):
+        """Reserve the filters with the configured capacity and error rate on first use, then add a batch of existing identities."""
+        for key in (USERNAMES_FILTER_KEY, EMAILS_FILTER_KEY):
+            if not await self.cache_redis.exists(key):
+                try:
+                    await self.cache_redis.bf().reserve(key, settings.IDENTITY_FILTER_ERROR_RATE, settings.IDENTITY_FILTER_CAPACITY)
+                except RedisError as e:
+                    if "exists" not in str(e):
+                        raise
+        async with self.cache_redis.pipeline(transaction=False) as pipe:
+            if usernames:
+                pipe.bf().madd(USERNAMES_FILTER_KEY, *(username.lower() for username in usernames))
+            if emails:
+                pipe.bf().madd(EMAILS_FILTER_KEY, *(email.lower() for email in emails))
+            await pipe.execute()
+
+    async def mark_identity_filters_seeded(self):
+        await self.cache_redis.set(IDENTITY_FILTERS_SEEDED_KEY, int(time.time()))
+
+    async def _queue_identity_filters(self, pipe: Pipeline, mapping: dict):
+        if mapping.get("username"):
+            await self.add_to_filter_script(keys=[USERNAMES_FILTER_KEY], args=[mapping["username"].lower()], client=pipe)
+        if mapping.get("email"):
+            await self.add_to_filter_script(keys=[EMAILS_FILTER_KEY], args=[mapping["email"].lower()], client=pipe)
+
     async def set_forgot_password_credentials(self, mapping: dict, expiry: int = 600) -> tuple[str, str]:
         forgot_password_token = uuid4().hex
         await self.cache_redis.hset(name=f"tokens:forgot_password:{forgot_password_token}", mapping=mapping)
@@ -882,12 +1811,35 @@ class CacheManager:
 
     """ ****************************************** SEARCH ****************************************** """
 
-    async def is_username_or_email_taken(self, username: str, email: str) -> tuple[bool, bool]:
-        username_query = escape_redisearch_special_chars(username)
-        email_query = escape_redisearch_special_chars(email)
-        username_results: SearchResult = await self.search_redis.search.search(index=USER_INDEX_NAME, query=f"@username:{username_query}", offset=0, limit=1)
-        email_results: SearchResult = await self.search_redis.search.search(index=USER_INDEX_NAME, query=f"@email:{email_query}", offset=0, limit=1)
-        return username_results.total > 0, email_results.total > 0
+    async def is_username_or_email_taken(self, username: str, email: str, check_username: bool = True, check_email: bool = True) -> tuple[bool, bool]:
+        """Exact TAG lookups, only run for the values the Bloom filters could not rule out."""
+        taken: list[bool] = []
+        for field, value, check in (("username_exact", username, check_username), ("email_exact", email, check_email)):
+            if not check:
+                taken.append(False)
+                continue
+            results: SearchResult = await self.search_redis.search.search(index=USER_INDEX_NAME, query=_tag_clause(field, [value]), nocontent=True, offset=0, limit=0, dialect=2)
+            taken.append(results.total > 0)
+        return taken[0], taken[1]
+
+    async def autocomplete_usernames(self, prefix: str, limit: int = 10) -> list[dict]:
+        """Only id, username and avatar_url of the users whose username starts with prefix, cached per prefix for a few seconds."""
+        prefix = prefix.strip().lower()
+        cache_key = f"{prefix}:{limit}"
+        cached: Optional[list[dict]] = self.autocomplete_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        suggestions = await self.search_redis.autocomplete.sugget(key=USERNAME_SUGGESTIONS_KEY, prefix=prefix, withpayloads=True, max_suggestions=limit)
+        user_ids: list[str] = [str(suggestion.payload) for suggestion in suggestions if suggestion.payload]
+        async with self.cache_redis.pipeline() as pipe:
+            for user_id in user_ids:
+                pipe.hmget(f"users:{user_id}:profile", PROFILE_CODEC.fields(["id", "username", "avatar_url"]))
+            profiles: list[list[Optional[str]]] = await pipe.execute()
+
+        users: list[dict] = [{"id": uid, "username": username, "avatar_url": avatar_url} for uid, username, avatar_url in profiles if uid and username]
+        self.autocomplete_cache.set(cache_key, users)
+        return users
 
     async def search_user(self, query: str, user_id: Optional[str] = None, offset: int = 0, limit: int = 10) -> dict[str, list[dict] | int]:
         try:
@@ -903,7 +1855,7 @@ class CacheManager:
                     continue
                 if uid[1] != user_id:
                     user_ids.append(uid[1])
-                users.append(document.properties)
+                users.append(PROFILE_CODEC.decode(document.properties))
             if user_id is not None:
                 async with self.cache_redis.pipeline() as pipe:
                     for uid in user_ids:
@@ -919,8 +1871,61 @@ class CacheManager:
             my_logger.error(f"Search error: {str(e)}")
             return {"users": [], "end": 0}
 
-    async def search_feed(self, query: str, user_id: Optional[str] = None, offset: int = 0, limit: int = 10):
-        results: SearchResult = await self.search_redis.search.search(index=feed_INDEX_NAME, query=f"@body:{query}*", offset=offset, limit=limit, withpayloads=False)
+    async def search_feed(
+            self,
+            query: str,
+            user_id: Optional[str] = None,
+            offset: int = 0,
+            limit: int = 10,
+            author_id: Optional[str] = None,
+            category_id: Optional[str] = None,
+            tag: Optional[str] = None,
+            since: Optional[float] = None,
+            until: Optional[float] = None,
+            sort: Optional[str] = None,
+    ):
+        """
+        Visibility, own blocks and the requested filters are part of the FT.SEARCH query, so pages come back full and end counts only visible feeds.
+        Viewers following more than FEED_SEARCH_MAX_FOLLOWINGS authors get followers-only feeds filtered after the search, so their pages may come back short.
+        """
+        clauses: list[str] = [f"@body:{escape_redisearch_special_chars(query)}*"] if query.strip() else []
+        if user_id is None:
+            clauses.append(_tag_clause("feed_visibility", ["public"]))
+        else:
+            async with self.cache_redis.pipeline() as pipe:
+                pipe.scard(f"users:{user_id}:followings")
+                pipe.smembers(f"users:{user_id}:blocked")
+                followings_count, blocked = await pipe.execute()
+            visible: list[str] = [_tag_clause("feed_visibility", ["public"]), _tag_clause("author_id", [user_id])]
+            if followings_count > settings.FEED_SEARCH_MAX_FOLLOWINGS:
+                # Too many authors for one query, _get_feeds drops the followers-only feeds of authors the viewer does not follow instead
+                visible.append(_tag_clause("feed_visibility", ["followers"]))
+            elif followings_count:
+                followings: set[str] = await self.cache_redis.smembers(f"users:{user_id}:followings")
+                visible.append(f"({_tag_clause('feed_visibility', ['followers'])} {_tag_clause('author_id', list(followings))})")
+            clauses.append(f"({' | '.join(visible)})")
+            if blocked:
+                clauses.append(f"-{_tag_clause('author_id', list(blocked))}")
+        if author_id:
+            clauses.append(_tag_clause("author_id", [author_id]))
+        if category_id:
+            clauses.append(_tag_clause("category_id", [category_id]))
+        if tag:
+            clauses.append(_tag_clause("tags", [tag]))
+        if since is not None or until is not None:
+            clauses.append(f"@created_at:[{since if since is not None else '-inf'} {until if until is not None else '+inf'}]")
+
+        sortby: Optional[str] = FEED_SORT_FIELDS.get(sort or "")
+        results: SearchResult = await self.search_redis.search.search(
+            index=feed_INDEX_NAME,
+            query=" ".join(clauses) or "*",
+            nocontent=True,
+            sortby=sortby,
+            sortby_order=PureToken.DESC if sortby else None,
+            offset=offset,
+            limit=limit,
+            dialect=2,
+        )
 
         feed_ids: list[str] = []
         for document in results.documents:
@@ -952,11 +1957,6 @@ class CacheManager:
     async def exists(self, name: str):
         return bool(await self.cache_redis.exists(name))
 
-    async def is_username_or_email_pending(self, username: str, email: str):
-        username_exists = await self.cache_redis.exists(f"registration:usernames:{username}")
-        email_exists = await self.cache_redis.exists(f"registration:emails:{email}")
-        return bool(username_exists), bool(email_exists)
-
     async def is_user_exists(self, username: str, email: str) -> tuple[bool, bool]:
         is_username_exists = await self.cache_redis.hexists(name="user:usernames", key=username)
         is_email_exists = await self.cache_redis.hexists(name="user:emails", key=email)
@@ -972,31 +1972,117 @@ class CacheManager:
         return await self.cache_redis.smembers("feeds:online")
 
 
-def _scores_getter(stats: dict[str, int]) -> tuple[int, int, int, int, int, int]:
-    return stats.get("comments", 0), stats.get("reposts", 0), stats.get("quotes", 0), stats.get("likes", 0), stats.get("views", 0), stats.get("bookmarks", 0)
+def _merge_timelines(timelines: list[list[tuple[str, float]]], start: int, end: int) -> list[tuple[str, float]]:
+    merged: dict[str, float] = {}
+    for timeline in timelines:
+        for feed_id, score in timeline:
+            merged[feed_id] = max(score, merged.get(feed_id, score))
+    # Ties are broken by feed id the same way ZRANGE ... REV orders them, so cursors taken from a merged page stay valid
+    ordered: list[tuple[str, float]] = sorted(merged.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    return ordered[start: end + 1]
 
 
-def _calculate_score(stats_dict: dict[str, int], created_at: float) -> float:
-    comments, reposts, quotes, likes, views, bookmarks = _scores_getter(stats=stats_dict)
-    engagement_score = math.log(1 + (comments + reposts + quotes) * 5 + likes * 2 + views * 0.5)
-    return created_at + (engagement_score * 100)
+def _next_timeline_cursor(entries: list[tuple[str, float | str]], limit: int) -> Optional[str]:
+    if not entries or len(entries) < limit:
+        return None
+    feed_id, score = entries[-1]
+    # repr keeps every digit of a float score, scores returned by the paging script are already strings
+    score_text: str = repr(score) if isinstance(score, float) else score
+    return urlsafe_b64encode(f"{score_text}:{feed_id}".encode()).decode()
+
+
+def _decode_timeline_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        score, feed_id = urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        if math.isnan(float(score)):
+            raise ValueError("NaN score")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid timeline cursor: {cursor}") from e
+    return score, feed_id
+
+
+def is_timeline_cursor(cursor: str) -> bool:
+    """Whether the cursor was handed out by a timeline page, for the routes to reject anything else before paging."""
+    try:
+        _decode_timeline_cursor(cursor=cursor)
+    except ValueError:
+        return False
+    return True
+
+
+def _flatten_feed_mapping(mapping: dict):
+    """Hashes only hold flat values, the category and tags are kept as TAG-indexable strings."""
+    category: Optional[dict] = mapping.pop("category", None)
+    if category:
+        mapping["category"] = category["name"]
+    tags: list[dict] = mapping.pop("tags", [])
+    if tags:
+        mapping["tags"] = FEED_TAG_SEPARATOR.join(tag["name"] for tag in tags)
+
 
+def _expand_feed_meta(meta: dict) -> dict:
+    if meta.get("category"):
+        meta["category"] = {"name": meta["category"]}
+    if meta.get("tags"):
+        meta["tags"] = [{"name": name} for name in meta["tags"].split(FEED_TAG_SEPARATOR)]
+    return meta
 
-def _calculate_score_old(stats_dict: dict, created_at: float, half_life: float = 36, boost_factor: int = 12) -> float:
-    comments, likes, reposts, quotes, views, bookmarks = _scores_getter(stats=stats_dict)
-    age_hours = (time.time() - created_at) / 3600
 
-    # Weighted Engagement Score (log-scaled)
-    engagement_score = math.log(1 + comments * 5 + likes * 2 + views * 0.5)
+def _put_sentinel(queue: asyncio.Queue):
+    """Wake a listener blocked on its queue so it returns, making room by dropping the oldest item when the queue is full."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+def _parse_stream_id(stream_id: str) -> Optional[tuple[int, int]]:
+    """Stream ids as (milliseconds, sequence) so they compare in stream order, None when malformed."""
+    ms, _, sequence = stream_id.partition("-")
+    try:
+        parsed: tuple[int, int] = int(ms), int(sequence or 0)
+    except ValueError:
+        return None
+    return parsed if min(parsed) >= 0 else None
+
 
-    # Exponential Decay (half-life controls decay speed)
-    time_decay = math.exp(-age_hours / half_life)
+def _decode_stream_entry(entry_id: str, fields: dict) -> Optional[dict]:
+    try:
+        return json.loads(fields.get("data", ""))
+    except json.JSONDecodeError as e:
+        my_logger.error(f"Failed to decode stream entry {entry_id}: {e}")
+        return None
+
+
+def _partner_chats(user_id: str, chat_ids: list[str], participants: list[set[str]]) -> dict[str, str]:
+    """Map every online chat partner to the chat shared with the user, chats come newest first so the latest one wins."""
+    partners: dict[str, str] = {}
+    for chat_id, chat_participants in zip(chat_ids, participants):
+        for partner_id in chat_participants:
+            if partner_id != user_id:
+                partners.setdefault(partner_id, chat_id)
+    return partners
+
+
+def _tag_clause(field: str, values: list[str]) -> str:
+    escaped: list[str] = [escape_redisearch_special_chars(value).replace(" ", "\\ ") for value in values]
+    return f"@{field}:{{{' | '.join(escaped)}}}"
+
+
+def _calculate_score(stats_dict: dict[str, int], created_at: float) -> float:
+    counters = np.array([[stats_dict.get(key, 0) for key in ENGAGEMENT_KEYS]], dtype=np.float64)
+    return float(_calculate_scores(counters=counters, created_at=np.array([created_at], dtype=np.float64))[0])
 
-    # Freshness Boost (soft decay instead of sharp drop)
-    freshness_boost = 10 * math.exp(-age_hours / boost_factor)
 
-    # Final Score
-    return (engagement_score * time_decay) + freshness_boost
+def _calculate_scores(counters: np.ndarray, created_at: np.ndarray) -> np.ndarray:
+    """
+    Score = created_at + half_life / ln(2) * ln(1 + weighted engagement).
+
+    Ranking by this is the same as ranking by engagement decayed with the configured half-life, but the score never depends on the
+    current time, so fresh feeds scored at creation stay comparable with re-ranked ones. Doubling engagement equals one half-life of age.
+    """
+    weights = np.array([settings.FEED_SCORE_WEIGHTS.get(key, 0) for key in ENGAGEMENT_KEYS], dtype=np.float64)
+    half_life_seconds = settings.FEED_SCORE_HALF_LIFE_HOURS * 3600
+    return created_at + (half_life_seconds / math.log(2)) * np.log1p(counters @ weights)
 
 
 def _parse_statistics(statistics: dict[str, int]) -> StatisticsSchema:
@@ -1046,13 +2132,60 @@ def _parse_statistics(statistics: dict[str, int]) -> StatisticsSchema:
     return StatisticsSchema(weekly=weekly, monthly=monthly_totals, yearly=yearly_totals, total=total_count)
 
 
-def _engagement_keys(feed_id: str, user_id: str, engagement_type: EngagementType, is_comment: bool):
+def _counts_key(prefix: str, item_id: str) -> str:
+    """Engagement counters of a feed or comment, kept outside the feeds: prefix so idx:feeds does not index them as empty documents."""
+    return f"counts:{prefix}:{item_id}"
+
+
+def _engagement_keys(feed_id: str, user_id: str, engagement_type: EngagementType, is_comment: bool) -> list[str]:
     prefix = "comments" if is_comment else "feeds"
-    engagement_key = f"{prefix}:{feed_id}:{engagement_type.value}"
     user_key = f"users:{user_id}:{engagement_type.value}"
-    return engagement_key, user_key
+    return [user_key, _counts_key(prefix=prefix, item_id=feed_id), *(f"{prefix}:{feed_id}:{key}" for key in ENGAGEMENT_KEYS)]
+
+
+def _follow_keys(user_id: str, following_id: str) -> list[str]:
+    return [
+        f"users:{user_id}:followings",
+        f"users:{following_id}:followers",
+        f"users:{user_id}:profile",
+        f"users:{following_id}:profile",
+        f"users:{user_id}:following_timeline",
+        f"users:{following_id}:user_timeline",
+    ]
+
+
+def _block_keys(blocker_id: str, blocked_id: str) -> list[str]:
+    return [f"users:{user_id}:{suffix}" for user_id in (blocker_id, blocked_id) for suffix in ["blocked", "followings", "followers", "profile", "following_timeline", "user_timeline"]]
+
+
+def _queue_username_suggestion(pipe: Pipeline, user_id: str, old_username: Optional[str], new_username: Optional[str]):
+    """Every write to the username suggestions goes through here, the entry of a renamed or deleted user is dropped."""
+    if old_username and old_username != new_username:
+        pipe.execute_command("FT.SUGDEL", USERNAME_SUGGESTIONS_KEY, old_username)
+    if new_username:
+        pipe.execute_command("FT.SUGADD", USERNAME_SUGGESTIONS_KEY, new_username, 1, "PAYLOAD", user_id)
+
+
+def _queue_engagements(pipe: Pipeline, feed_ids: list[str], user_id: str, is_comment: bool):
+    prefix = "comments" if is_comment else "feeds"
+    for feed_id in feed_ids:
+        pipe.hmget(_counts_key(prefix=prefix, item_id=feed_id), ENGAGEMENT_KEYS)
+        for key in ENGAGEMENT_KEYS[1:]:
+            pipe.sismember(f"{prefix}:{feed_id}:{key}", user_id)
+
+
+def _decode_engagements(results: list, count: int) -> list[dict]:
+    step = len(ENGAGEMENT_KEYS)
+    return [_decode_engagement(counters=results[index * step], interactions=results[index * step + 1: (index + 1) * step]) for index in range(count)]
+
+
+def _decode_engagement(counters: list, interactions: list) -> dict:
+    engagement = {key: int(value) for key, value in zip(ENGAGEMENT_KEYS, counters) if value and int(value) > 0}
+    engagement.update({interaction_key: True for interaction_key, interacted in zip(INTERACTION_KEYS, interactions) if interacted})
+    return engagement
 
 
 chat_cache_manager = ChatCacheManager(cache_redis=my_cache_redis, search_redis=my_search_redis)
 cache_manager = CacheManager(cache_redis=my_cache_redis, search_redis=my_search_redis)
 pubsub_manager = RedisPubSubManager(cache_redis=my_cache_redis)
+stream_manager = RedisStreamManager(cache_redis=my_cache_redis)
@@ -1,4 +1,4 @@
-from taskiq import TaskiqScheduler
+from taskiq import SimpleRetryMiddleware, TaskiqScheduler
 from taskiq.schedule_sources import LabelScheduleSource
 from taskiq_redis import (ListQueueBroker, RedisAsyncResultBackend,
                           RedisScheduleSource)
@@ -9,7 +9,11 @@ settings = get_settings()
 
 redis_url = f"rediss://@{settings.REDIS_HOST}:6379/1?ssl_cert_reqs=required&ssl_ca_certs={str(settings.CA_PATH)}&ssl_certfile={str(settings.CLIENT_CERT_PATH)}&ssl_keyfile={str(settings.CLIENT_KEY_PATH)}"
 
-broker = ListQueueBroker(url=redis_url).with_result_backend(result_backend=RedisAsyncResultBackend(redis_url=redis_url, result_ex_time=600))
+broker = (
+    ListQueueBroker(url=redis_url)
+    .with_result_backend(result_backend=RedisAsyncResultBackend(redis_url=redis_url, result_ex_time=600))
+    .with_middlewares(SimpleRetryMiddleware(default_retry_count=3))
+)
 
 redis_schedule_source = RedisScheduleSource(url=redis_url)
 
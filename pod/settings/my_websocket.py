@@ -2,23 +2,33 @@ import asyncio
 import json
 import time
 from asyncio import Task
-from typing import Awaitable, Callable, Optional
+from typing import Awaitable, Callable, Iterable, Optional
+from uuid import uuid4
 
 from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.websockets import WebSocketState
 from redis.asyncio import Redis
-from redis.asyncio.client import PubSub
 
-from settings.my_redis import my_cache_redis, pubsub_manager
+from settings.my_config import get_settings
+from settings.my_redis import RedisPubSubManager, StreamSubscription, Subscription, my_cache_redis, pubsub_manager, stream_manager
 from utility.my_enums import ChatEvent
 from utility.my_logger import my_logger
 
+settings = get_settings()
+
+# Replaying a stale typing indicator or presence change after a reconnect would only be wrong, these are dropped once older than CHAT_EPHEMERAL_EVENT_TTL
+EPHEMERAL_EVENTS = {ChatEvent.typing_start.value, ChatEvent.typing_stop.value, ChatEvent.goes_online.value, ChatEvent.goes_offline.value}
+CONNECTION_KEY = "ws:nodes:{user_id}"
+NODE_CHANNEL = "ws:node:{node_id}"
+# Identifies this process in the connection registry and names its delivery channel
+NODE_ID = uuid4().hex
+
 
 class WebSocketManager:
     def __init__(self, redis: Redis):
         self.redis = redis
 
-        self.authorized_connections: dict[str, WebSocket] = {}
+        self.authorized_connections: dict[str, set[WebSocket]] = {}
         self.unauthorized_connections: list[WebSocket] = []
         self.event_handlers: dict[str, Callable[[dict], Awaitable[None]]] = {}
 
@@ -41,7 +51,8 @@ class WebSocketManager:
             await websocket.accept()
 
             if user_id:
-                self.authorized_connections[user_id] = websocket
+                # Every tab and device of a user keeps its own socket
+                self.authorized_connections.setdefault(user_id, set()).add(websocket)
                 my_logger.debug(f"User {user_id} connected")
             else:
                 self.unauthorized_connections.append(websocket)
@@ -53,7 +64,10 @@ class WebSocketManager:
     async def disconnect(self, websocket: Optional[WebSocket] = None, user_id: Optional[str] = None):
         try:
             if user_id:
-                self.authorized_connections.pop(user_id, None)
+                sockets: set[WebSocket] = self.authorized_connections.get(user_id, set())
+                sockets.discard(websocket)
+                if not sockets:
+                    self.authorized_connections.pop(user_id, None)
                 my_logger.debug(f"User with {user_id} ID disconnected")
             elif websocket:
                 self.unauthorized_connections.remove(websocket)
@@ -63,20 +77,8 @@ class WebSocketManager:
             my_logger.exception(f"Exception while disconnecting the websocket connection: {exception}")
             raise ValueError(f"Exception while disconnecting the websocket connection: {exception}")
 
-    async def send_personal_message(self, user_id: str, data: dict):
-        ws: Optional[WebSocket] = self.authorized_connections.get(user_id)
-        if ws is None:
-            my_logger.warning(f"WebSocket not found for user_id={user_id}. Skipping send.")
-            return
-
-        try:
-            await ws.send_json(data=data)
-        except Exception as exception:
-            my_logger.exception(f"Exception while sending personal message: {exception}")
-            raise ValueError(f"Exception while sending personal message: {exception}")
-
     async def broadcast(self, data: dict, user_ids: Optional[list[str]] = None):
-        targets = [self.authorized_connections[uid] for uid in user_ids if uid in self.authorized_connections] if user_ids else self.unauthorized_connections
+        targets = [ws for uid in user_ids for ws in self.authorized_connections.get(uid, ())] if user_ids else self.unauthorized_connections
 
         async def safe_send(ws: WebSocket):
             try:
@@ -87,23 +89,172 @@ class WebSocketManager:
         await asyncio.gather(*(safe_send(ws) for ws in targets))
 
 
+class ConnectionRegistry:
+    """
+    Cluster-wide user -> nodes map, a zset per user with one member per node scored by when its entry expires. Entries expire
+    after PRESENCE_TTL unless the owning node's heartbeat refreshes them, so users of a crashed node drop out on their own.
+    """
+
+    def __init__(self, redis: Redis, node_id: str):
+        self.redis = redis
+        self.node_id = node_id
+
+    async def register(self, user_id: str):
+        await self.refresh(user_ids=[user_id])
+
+    async def refresh(self, user_ids: list[str]):
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                key: str = CONNECTION_KEY.format(user_id=user_id)
+                pipe.zadd(name=key, mapping={self.node_id: now + settings.PRESENCE_TTL})
+                pipe.expire(name=key, time=settings.PRESENCE_TTL)
+                pipe.zremrangebyscore(name=key, min="-inf", max=now)
+            await pipe.execute()
+
+    async def unregister(self, user_id: str):
+        """Called once the last local socket of the user closed, the entries of other nodes stay."""
+        await self.redis.zrem(CONNECTION_KEY.format(user_id=user_id), self.node_id)
+
+    async def locate(self, user_ids: list[str]) -> dict[str, list[str]]:
+        """Live nodes per user, users connected nowhere are left out."""
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrangebyscore(name=CONNECTION_KEY.format(user_id=user_id), min=f"({now}", max="+inf")
+            nodes: list[list[str]] = await pipe.execute()
+        return {user_id: user_nodes for user_id, user_nodes in zip(user_ids, nodes) if user_nodes}
+
+
+class EventRouter:
+    """
+    Delivers ephemeral events straight to sockets of this process, and for users on other nodes publishes once per
+    destination node on that node's delivery channel. Users connected nowhere are skipped.
+    """
+
+    def __init__(self, ws_manager: WebSocketManager, registry: ConnectionRegistry, pubsub: RedisPubSubManager):
+        self.ws_manager = ws_manager
+        self.registry = registry
+        self.pubsub = pubsub
+
+    async def deliver(self, user_ids: Iterable[str], data: dict):
+        await self.deliver_events(events={user_id: data for user_id in user_ids})
+
+    async def deliver_events(self, events: dict[str, dict]):
+        """Deliver each user its own event, users on other nodes go out in one message per node."""
+        if not events:
+            return
+
+        # A user may have sockets here and on other nodes at the same time
+        local: list[str] = [user_id for user_id in events if user_id in self.ws_manager.authorized_connections]
+        if local:
+            await self._send_local(events={user_id: events[user_id] for user_id in local})
+
+        by_node: dict[str, dict[str, dict]] = {}
+        for user_id, nodes in (await self.registry.locate(user_ids=list(events))).items():
+            for node in nodes:
+                if node != self.registry.node_id:
+                    by_node.setdefault(node, {})[user_id] = events[user_id]
+        tasks = [self.pubsub.publish(topic=NODE_CHANNEL.format(node_id=node), data={"events": node_events}) for node, node_events in by_node.items()]
+        await asyncio.gather(*tasks)
+
+    async def run(self):
+        """Serve this node's delivery channel and keep its registry entries alive for the lifetime of the process, resubscribing after failures."""
+        heartbeat: Task = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                try:
+                    await self._serve()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    my_logger.exception(f"Node delivery channel failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _serve(self):
+        subscription: Subscription = await self.pubsub.subscribe(topic=NODE_CHANNEL.format(node_id=self.registry.node_id))
+        try:
+            async for message in subscription.listen():
+                try:
+                    payload: dict = json.loads(message["data"])
+                except (TypeError, json.JSONDecodeError) as e:
+                    my_logger.error(f"Failed to decode node delivery: {e}")
+                    continue
+                events: dict[str, dict] = {user_id: data for user_id, data in payload.get("events", {}).items() if user_id in self.ws_manager.authorized_connections}
+                if events:
+                    await self._send_local(events=events)
+        finally:
+            await subscription.close()
+
+    async def _send_local(self, events: dict[str, dict]):
+        await asyncio.gather(*(self.ws_manager.broadcast(data=data, user_ids=[user_id]) for user_id, data in events.items()))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                if self.ws_manager.authorized_connections:
+                    await self.registry.refresh(user_ids=list(self.ws_manager.authorized_connections))
+            except Exception as e:
+                my_logger.exception(f"Presence heartbeat failed: {e}")
+
+
+class PresenceBatcher:
+    """
+    Holds presence events per recipient for a short window and hands them to the router together, so a recipient whose partners change
+    presence at about the same time gets one message. A later transition of the same user replaces the one still waiting.
+    """
+
+    def __init__(self, router: EventRouter, window: float):
+        self.router = router
+        self.window = window
+        self.pending: dict[str, dict[str, dict]] = {}
+        self.flusher: Optional[Task] = None
+
+    def add(self, events: dict[str, dict]):
+        for recipient_id, event in events.items():
+            self.pending.setdefault(recipient_id, {})[event["user_id"]] = event
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        events: dict[str, dict] = {}
+        for recipient_id, batched in pending.items():
+            batch: list[dict] = list(batched.values())
+            # A lone event keeps its own shape, clients only unpack batches when there is something to batch
+            events[recipient_id] = batch[0] if len(batch) == 1 else {"type": ChatEvent.presence_batch.value, "events": batch}
+        await self.router.deliver_events(events=events)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        try:
+            await self.flush()
+        except Exception as e:
+            my_logger.exception(f"Presence batch could not be delivered: {e}")
+
+
 class WebSocketContextManager:
     def __init__(
             self,
             websocket: WebSocket,
             connect_handler: Callable[[str, WebSocket], Awaitable[None]],
             disconnect_handler: Callable[[str, WebSocket], Awaitable[None]],
-            pubsub_generator: Callable[[str], Awaitable[PubSub]],
             message_handlers: dict[ChatEvent, Callable[[str, dict], Awaitable[None]]],
             user_id: Optional[str] = None,
+            stream: Optional[str] = None,
+            last_id: Optional[str] = None,
     ):
         self.websocket = websocket
         self.user_id = user_id
         self.connect_handler = connect_handler
         self.disconnect_handler = disconnect_handler
-        self.pubsub_generator = pubsub_generator
         self.message_handlers = message_handlers
-        self.pubsub: Optional[PubSub] = None
+        self.stream = stream
+        self.last_id = last_id
         self.tasks: list[Task] = []
 
     async def __aenter__(self):
@@ -115,16 +266,11 @@ class WebSocketContextManager:
 
     async def _connect(self):
         await self.connect_handler(self.user_id, self.websocket)
-        self.pubsub = await self.pubsub_generator(self.user_id)
-        self.tasks = [asyncio.create_task(self._pubsub_listener()), asyncio.create_task(self._websocket_receiver())]
+        self.tasks = [asyncio.create_task(self._websocket_receiver())]
+        if self.stream:
+            self.tasks.append(asyncio.create_task(self._stream_listener()))
 
     async def _disconnect(self):
-        if self.pubsub:
-            try:
-                await self.pubsub.close()
-            except Exception as e:
-                my_logger.exception(f"Failed to close pubsub: {e}")
-
         try:
             await self.disconnect_handler(self.user_id, self.websocket)
         except Exception as e:
@@ -152,55 +298,41 @@ class WebSocketContextManager:
                     task.cancel()
             await asyncio.gather(*pending, return_exceptions=True)
 
-    async def _pubsub_listener(self):
-        """Listen to Redis pub/sub messages and dispatch them to registered handlers."""
+    async def _dispatch(self, event_type: str, data: dict):
+        """Run the handler of a client frame in this process, handlers decide themselves whether anything has to cross Redis."""
         try:
-            async for message in self.pubsub.listen():
-                if message.get("type") != "message":
-                    continue
-
-                pubsub_data = message.get("data")
-                my_logger.warning(f"pubsub_data in _pubsub_listener: {pubsub_data}, type: {type(pubsub_data)}")
-                if pubsub_data is None:
-                    continue
-
-                try:
-                    if isinstance(pubsub_data, bytes):
-                        pubsub_data: str = pubsub_data.decode("utf-8")
-                    data: dict = json.loads(pubsub_data)
-                except (TypeError, json.JSONDecodeError, UnicodeDecodeError) as e:
-                    my_logger.error(f"Failed to decode pubsub message: {e}")
-                    continue
+            chat_event = ChatEvent(event_type)
+        except ValueError:
+            my_logger.exception(f"Invalid event type received: '{event_type}'")
+            await self.websocket.send_json({"detail": f"Invalid event type: '{event_type}'."})
+            return
 
-                event_type: Optional[str] = data.get("type")
-                if event_type is None:
-                    my_logger.warning(f"Missing 'type' field in event data: {data}")
-                    await self.websocket.send_json({"detail": "Missing event type in pubsub message."})
-                    # await chat_ws_manager.send_personal_message(user_id="", data={"detail": "Missing event type in pubsub message."}) # TODO
-                    continue
+        handler: Optional[Callable[[str, dict], Awaitable[None]]] = self.message_handlers.get(chat_event)
+        if handler is None:
+            my_logger.warning(f"No handler registered for event type: '{event_type}'")
+            await self.websocket.send_json({"detail": f"No handler for event type: '{event_type}'."})
+            return
 
-                try:
-                    chat_event = ChatEvent(event_type)
-                except ValueError:
-                    my_logger.exception(f"Invalid event type received: '{event_type}'")
-                    await self.websocket.send_json({"detail": f"Invalid event type: '{event_type}'."})
-                    continue
+        try:
+            await handler(self.user_id, data)
+        except Exception as e:
+            my_logger.exception(f"Error while handling event '{event_type}': {e}")
+            await self.websocket.send_json({"detail": f"An error occurred while handling event: '{event_type}'."})
 
-                handler: Optional[Callable[[str, dict], Awaitable[None]]] = self.message_handlers.get(chat_event)
-                if handler is None:
-                    my_logger.warning(f"No handler registered for event type: '{event_type}'")
-                    await self.websocket.send_json({"detail": f"No handler for event type: '{event_type}'."})
+    async def _stream_listener(self):
+        """Deliver the user's stream to the socket, starting after the id the client last saw, every event carries its stream_id."""
+        subscription: StreamSubscription = await stream_manager.subscribe(stream=self.stream, last_id=self.last_id)
+        try:
+            async for entry_id, data in subscription.listen():
+                if data.get("type") in EPHEMERAL_EVENTS and int(entry_id.split("-")[0]) / 1000 < time.time() - settings.CHAT_EPHEMERAL_EVENT_TTL:
                     continue
-
-                try:
-                    await handler(self.user_id, data)
-                except Exception as e:
-                    my_logger.exception(f"Error while handling event '{event_type}': {e}")
-                    await self.websocket.send_json({"detail": f"An error occurred while handling event: '{event_type}'."})
+                await self.websocket.send_json({**data, "stream_id": entry_id})
         except asyncio.CancelledError:
-            my_logger.debug("PubSub listener cancelled")
+            my_logger.debug("Stream listener cancelled")
         except Exception as e:
-            my_logger.exception(f"Unexpected error in pubsub listener: {e}")
+            my_logger.exception(f"Unexpected error in stream listener: {e}")
+        finally:
+            await subscription.close()
 
     async def _websocket_receiver(self):
         """Receive incoming WebSocket messages and handle heartbeat checks."""
@@ -240,14 +372,7 @@ class WebSocketContextManager:
                     await self.websocket.send_json({"type": "heartbeat_ack"})
                     continue
 
-                try:
-                    ChatEvent(event_type)
-                except ValueError:
-                    my_logger.exception(f"Invalid event type received: '{event_type}'")
-                    await self.websocket.send_json({"detail": f"Invalid event type: '{event_type}'."})
-                    continue
-
-                await pubsub_manager.publish(topic=f"chats:home:{self.user_id}", data=received_json)
+                await self._dispatch(event_type=event_type, data=received_json)
         except asyncio.CancelledError:
             my_logger.debug("WebSocket receiver cancelled")
         except Exception as e:
@@ -261,3 +386,9 @@ settings_ws_manager = WebSocketManager(redis=my_cache_redis)
 home_timeline_ws_manager = WebSocketManager(redis=my_cache_redis)
 
 chat_ws_manager = WebSocketManager(redis=my_cache_redis)
+
+chat_connection_registry = ConnectionRegistry(redis=my_cache_redis, node_id=NODE_ID)
+
+chat_event_router = EventRouter(ws_manager=chat_ws_manager, registry=chat_connection_registry, pubsub=pubsub_manager)
+
+chat_presence_batcher = PresenceBatcher(router=chat_event_router, window=settings.PRESENCE_BATCH_SECONDS)
@@ -0,0 +1,89 @@
+"""
+Tests run against a disposable Redis Stack database named by TEST_REDIS_URL, which is flushed before and after every test.
+Tests using it are skipped when it is unreachable, the server-less ones only need the app dependencies installed.
+"""
+import os
+import time
+from importlib.util import find_spec
+from typing import Callable
+from uuid import uuid4
+
+import pytest
+
+TEST_REDIS_URL = os.environ.get("TEST_REDIS_URL", "redis://localhost:6379/15")
+# Every other test module imports the app, which imports these at import time
+APP_DEPENDENCIES = ("redis", "coredis", "numpy", "fastapi", "taskiq")
+STANDALONE_MODULES = {"test_hash_codec.py"}
+MISSING_DEPENDENCIES: list[str] = [name for name in APP_DEPENDENCIES if find_spec(name) is None]
+
+
+def pytest_ignore_collect(collection_path, config):
+    if MISSING_DEPENDENCIES and collection_path.name.startswith("test_") and collection_path.name not in STANDALONE_MODULES:
+        return True
+    return None
+
+
+def pytest_report_header(config):
+    if MISSING_DEPENDENCIES:
+        return f"app dependencies missing ({', '.join(MISSING_DEPENDENCIES)}), only {', '.join(sorted(STANDALONE_MODULES))} collected"
+    return None
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def cache_redis():
+    from redis.asyncio import Redis
+    from redis.exceptions import ConnectionError
+
+    redis = Redis.from_url(TEST_REDIS_URL, decode_responses=True)
+    try:
+        await redis.ping()
+    except ConnectionError:
+        await redis.close()
+        pytest.skip(f"No Redis at {TEST_REDIS_URL}")
+
+    await redis.flushdb()
+    yield redis
+    await redis.flushdb()
+    await redis.close()
+
+
+@pytest.fixture
+async def cache_manager(cache_redis):
+    from coredis import Redis as SearchRedis
+
+    from settings.my_redis import CacheManager
+
+    return CacheManager(cache_redis=cache_redis, search_redis=SearchRedis.from_url(TEST_REDIS_URL, decode_responses=True))
+
+
+@pytest.fixture
+def make_feed() -> Callable[..., dict]:
+    """Feed mappings shaped like FeedSchema dumps, the way the routes hand them to CacheManager.create_feed."""
+
+    def factory(author_id: str, created_at: float | None = None, **fields) -> dict:
+        return {
+            "id": uuid4().hex,
+            "author": {"id": author_id},
+            "created_at": created_at if created_at is not None else time.time(),
+            "body": "body",
+            "feed_visibility": "public",
+            "comment_policy": "everyone",
+            **fields,
+        }
+
+    return factory
+
+
+@pytest.fixture
+async def search_indexes(cache_manager):
+    """Builds idx:users and idx:feeds on the test database, for code paths that query them."""
+    from settings.my_redis import search_index_manager
+    from utility.search_index import SearchIndexManager
+
+    await SearchIndexManager(search_redis=cache_manager.search_redis, indexes=list(search_index_manager.indexes.values()), poll_interval=0.1).ensure()
+    return cache_manager
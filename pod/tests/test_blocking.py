@@ -0,0 +1,35 @@
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.mark.anyio
+async def test_unblocking_lifts_a_symmetrical_block_both_ways(cache_manager):
+    blocker_id, blocked_id = uuid4().hex, uuid4().hex
+    assert await cache_manager.toggle_block_user(blocker_id=blocker_id, blocked_id=blocked_id, symmetrical=True) == {"blocked": True, "symmetrical": True}
+
+    # The flag is not repeated on unblock
+    assert await cache_manager.toggle_block_user(blocker_id=blocker_id, blocked_id=blocked_id) == {"blocked": False, "symmetrical": False}
+    assert not await cache_manager.is_blocked_by_either(user_id=blocker_id, other_id=blocked_id)
+
+
+@pytest.mark.anyio
+async def test_teardown_drops_the_reverse_entries_of_symmetrical_blocks(cache_manager):
+    user_id, other_id = uuid4().hex, uuid4().hex
+    await cache_manager.toggle_block_user(blocker_id=user_id, blocked_id=other_id, symmetrical=True)
+
+    await cache_manager.delete_profile(user_id=user_id)
+
+    assert not await cache_manager.cache_redis.sismember(f"users:{other_id}:blocked", user_id)
+
+
+@pytest.mark.anyio
+async def test_blocking_back_is_refused_and_keeps_the_existing_block(cache_manager):
+    user_id, other_id = uuid4().hex, uuid4().hex
+    await cache_manager.toggle_block_user(blocker_id=other_id, blocked_id=user_id)
+
+    with pytest.raises(ValueError):
+        await cache_manager.toggle_block_user(blocker_id=user_id, blocked_id=other_id)
+
+    assert await cache_manager.get_block_status(blocker_id=other_id, blocked_id=user_id) == {"blocked": True, "symmetrical": False}
+    assert not await cache_manager.cache_redis.sismember(f"users:{user_id}:blocked", other_id)
@@ -0,0 +1,46 @@
+from uuid import uuid4
+
+import pytest
+
+from settings.my_redis import settings
+
+
+async def _thread(cache_manager, make_feed, author_id: str, size: int, fanout: int = 10) -> tuple[str, list[str]]:
+    """A feed with size comments, every comment answering one of the first ones so the tree is several levels deep."""
+    feed: dict = make_feed(author_id=author_id)
+    await cache_manager.create_feed(mapping=feed)
+    parent_ids: list[str] = [feed["id"]]
+    comment_ids: list[str] = []
+    for index in range(size):
+        comment: dict = make_feed(author_id=uuid4().hex, parent_id=parent_ids[index // fanout])
+        await cache_manager.create_feed(mapping=comment)
+        parent_ids.append(comment["id"])
+        comment_ids.append(comment["id"])
+    return feed["id"], comment_ids
+
+
+@pytest.mark.anyio
+async def test_delete_feed_removes_the_whole_thread(cache_manager, make_feed):
+    author_id = uuid4().hex
+    feed_id, comment_ids = await _thread(cache_manager=cache_manager, make_feed=make_feed, author_id=author_id, size=50, fanout=3)
+
+    assert await cache_manager.get_all_nested_comment_ids(feed_id, is_feed=True) == set(comment_ids)
+
+    await cache_manager.delete_feed(author_id=author_id, feed_id=feed_id)
+    assert not await cache_manager.cache_redis.exists(f"feeds:{feed_id}:meta", *(f"comments:{cid}:author_id" for cid in comment_ids))
+
+
+@pytest.mark.anyio
+async def test_delete_feed_of_a_pull_author_cleans_timelines_it_was_fanned_out_to(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "FANOUT_FOLLOWER_THRESHOLD", 1)
+    author_id, follower_id = uuid4().hex, uuid4().hex
+    await cache_manager.add_follower(user_id=follower_id, following_id=author_id)
+    feed: dict = make_feed(author_id=author_id)
+    assert await cache_manager.create_feed(mapping=feed)
+    await cache_manager.fanout_feed(author_id=author_id, feed_id=feed["id"])
+    # The author becomes a pull author after the fan-out
+    await cache_manager.add_follower(user_id=uuid4().hex, following_id=author_id)
+    assert not await cache_manager.create_feed(mapping=make_feed(author_id=author_id))
+
+    await cache_manager.delete_feed(author_id=author_id, feed_id=feed["id"])
+    assert await cache_manager.cache_redis.zscore(f"users:{follower_id}:following_timeline", feed["id"]) is None
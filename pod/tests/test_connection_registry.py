@@ -0,0 +1,34 @@
+from uuid import uuid4
+
+import pytest
+
+from settings.my_websocket import CONNECTION_KEY, ConnectionRegistry
+
+
+@pytest.mark.anyio
+async def test_a_user_stays_located_on_every_node_until_each_unregisters(cache_redis):
+    user_id = uuid4().hex
+    first, second = ConnectionRegistry(redis=cache_redis, node_id="first"), ConnectionRegistry(redis=cache_redis, node_id="second")
+    await first.register(user_id=user_id)
+    await second.register(user_id=user_id)
+
+    assert sorted((await first.locate(user_ids=[user_id, uuid4().hex]))[user_id]) == ["first", "second"]
+
+    await first.unregister(user_id=user_id)
+    assert await second.locate(user_ids=[user_id]) == {user_id: ["second"]}
+
+    await second.unregister(user_id=user_id)
+    assert await first.locate(user_ids=[user_id]) == {}
+
+
+@pytest.mark.anyio
+async def test_expired_nodes_are_skipped_and_pruned_on_refresh(cache_redis):
+    user_id = uuid4().hex
+    registry = ConnectionRegistry(redis=cache_redis, node_id="live")
+    # Left behind by a node that crashed without unregistering
+    await cache_redis.zadd(CONNECTION_KEY.format(user_id=user_id), mapping={"crashed": 1})
+
+    assert await registry.locate(user_ids=[user_id]) == {}
+
+    await registry.refresh(user_ids=[user_id])
+    assert await cache_redis.zrange(CONNECTION_KEY.format(user_id=user_id), 0, -1) == ["live"]
@@ -0,0 +1,33 @@
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.mark.anyio
+async def test_comment_counter_missing_on_a_legacy_feed_is_seeded_from_the_set(cache_manager, make_feed):
+    author_id = uuid4().hex
+    feed: dict = make_feed(author_id=author_id)
+    await cache_manager.create_feed(mapping=feed)
+    # Cached before the counters hash existed
+    await cache_manager.cache_redis.sadd(f"feeds:{feed['id']}:comments", uuid4().hex, uuid4().hex)
+
+    comment: dict = make_feed(author_id=author_id, parent_id=feed["id"])
+    await cache_manager.create_feed(mapping=comment)
+    assert await cache_manager.cache_redis.hget(f"counts:feeds:{feed['id']}", "comments") == "3"
+
+    await cache_manager.delete_feed(author_id=author_id, feed_id=comment["id"])
+    assert await cache_manager.cache_redis.hget(f"counts:feeds:{feed['id']}", "comments") == "2"
+
+
+@pytest.mark.anyio
+async def test_backfill_rewrites_counters_from_the_sets(cache_manager, make_feed):
+    feed: dict = make_feed(author_id=uuid4().hex)
+    await cache_manager.create_feed(mapping=feed)
+    await cache_manager.cache_redis.sadd(f"feeds:{feed['id']}:likes", uuid4().hex, uuid4().hex)
+    await cache_manager.cache_redis.hset(f"counts:feeds:{feed['id']}", mapping={"likes": 7})
+    # Left by the release that kept the counters under the indexed feeds: prefix
+    await cache_manager.cache_redis.hset(f"feeds:{feed['id']}:counts", mapping={"likes": 7})
+
+    assert await cache_manager.backfill_engagement_counts() == 1
+    assert await cache_manager.cache_redis.hgetall(f"counts:feeds:{feed['id']}") == {"comments": "0", "reposts": "0", "quotes": "0", "likes": "2", "views": "0", "bookmarks": "0"}
+    assert not await cache_manager.cache_redis.exists(f"feeds:{feed['id']}:counts")
@@ -0,0 +1,18 @@
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.mark.anyio
+async def test_delete_feed_unlinks_indexes_not_migrated_yet(cache_manager, make_feed):
+    author_id, user_id = uuid4().hex, uuid4().hex
+    feed: dict = make_feed(author_id=author_id)
+    await cache_manager.create_feed(mapping=feed)
+    # A users:{id}:likes index written before the zset migration
+    await cache_manager.cache_redis.sadd(f"feeds:{feed['id']}:likes", user_id)
+    await cache_manager.cache_redis.sadd(f"users:{user_id}:likes", feed["id"], uuid4().hex)
+
+    await cache_manager.delete_feed(author_id=author_id, feed_id=feed["id"])
+
+    assert await cache_manager.cache_redis.type(f"users:{user_id}:likes") == "set"
+    assert not await cache_manager.cache_redis.sismember(f"users:{user_id}:likes", feed["id"])
@@ -0,0 +1,63 @@
+from typing import Optional
+from uuid import uuid4
+
+import pytest
+
+from settings.my_redis import PROFILE_CODEC, settings
+from utility.my_enums import EngagementType
+
+
+async def _seed(cache_manager, make_feed) -> tuple[str, list[str]]:
+    """A viewer who follows friend and blocks blocked, and one feed for every visibility rule."""
+    viewer, friend, stranger, blocked = uuid4().hex, uuid4().hex, uuid4().hex, uuid4().hex
+    for user_id in (viewer, friend, stranger, blocked):
+        await cache_manager.cache_redis.hset(f"users:{user_id}:profile", mapping=PROFILE_CODEC.encode({"id": user_id, "name": user_id[:6], "username": user_id[:8]}))
+    await cache_manager.add_follower(user_id=viewer, following_id=friend)
+    await cache_manager.toggle_block_user(blocker_id=viewer, blocked_id=blocked)
+
+    feeds: list[dict] = [
+        make_feed(author_id=friend),
+        make_feed(author_id=friend, feed_visibility="followers"),
+        make_feed(author_id=stranger, feed_visibility="followers"),
+        make_feed(author_id=stranger, feed_visibility="private"),
+        make_feed(author_id=viewer, feed_visibility="private"),
+        make_feed(author_id=blocked),
+    ]
+    for feed in feeds:
+        await cache_manager.create_feed(mapping=feed)
+    await cache_manager.set_engagement(user_id=viewer, feed_id=feeds[0]["id"], engagement_type=EngagementType.likes)
+    return viewer, [feed["id"] for feed in feeds]
+
+
+def _by_id(feeds: list[dict]) -> list[dict]:
+    return sorted(feeds, key=lambda feed: feed["id"])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anonymous", [False, True])
+async def test_scripted_hydration_matches_the_pipelined_path(cache_manager, make_feed, anonymous):
+    viewer, feed_ids = await _seed(cache_manager=cache_manager, make_feed=make_feed)
+    user_id: Optional[str] = None if anonymous else viewer
+
+    pipelined: list[dict] = await cache_manager._get_feeds_pipelined(feed_ids=feed_ids, user_id=user_id)
+    scripted: list[dict] = await cache_manager._get_feeds_scripted(feed_ids=feed_ids, user_id=user_id)
+    # The second call is served from the local caches and only reads counters and interactions
+    cached: list[dict] = await cache_manager._get_feeds_scripted(feed_ids=feed_ids, user_id=user_id)
+
+    visible: set[str] = {feed_ids[index] for index in ((0, 5) if anonymous else (0, 1, 4))}
+    assert {feed["id"] for feed in scripted} == visible
+    assert _by_id(scripted) == _by_id(pipelined) == _by_id(cached)
+    if not anonymous:
+        assert next(feed for feed in scripted if feed["id"] == feed_ids[0])["engagement"] == {"likes": 1, "liked": True}
+
+
+@pytest.mark.anyio
+async def test_search_filters_followers_only_feeds_after_the_query_for_large_followings(search_indexes, make_feed, monkeypatch):
+    cache_manager = search_indexes
+    viewer, feed_ids = await _seed(cache_manager=cache_manager, make_feed=make_feed)
+    await cache_manager.add_follower(user_id=viewer, following_id=uuid4().hex)
+    monkeypatch.setattr(settings, "FEED_SEARCH_MAX_FOLLOWINGS", 1)
+
+    found: dict = await cache_manager.search_feed(query="", user_id=viewer, limit=20)
+
+    assert {feed["id"] for feed in found["feeds"]} == {feed_ids[index] for index in (0, 1, 4)}
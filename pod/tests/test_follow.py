@@ -0,0 +1,55 @@
+import time
+from uuid import uuid4
+
+import pytest
+
+
+async def _author_with_posts(cache_manager, posts_count: int, batch_size: int = 5000) -> tuple[str, list[str]]:
+    """An author whose user_timeline holds posts_count feed ids, newest last."""
+    author_id = uuid4().hex
+    now = time.time()
+    feed_ids: list[str] = [uuid4().hex for _ in range(posts_count)]
+    for offset in range(0, posts_count, batch_size):
+        mapping = {feed_id: now - posts_count + index for index, feed_id in enumerate(feed_ids[offset: offset + batch_size], start=offset)}
+        await cache_manager.cache_redis.zadd(f"users:{author_id}:user_timeline", mapping=mapping)
+    return author_id, feed_ids
+
+
+@pytest.mark.anyio
+async def test_follow_copies_only_the_newest_posts_and_counts_the_edge_once(cache_manager):
+    follower_id = uuid4().hex
+    author_id, feed_ids = await _author_with_posts(cache_manager=cache_manager, posts_count=200)
+
+    await cache_manager.add_follower(user_id=follower_id, following_id=author_id, max_ft=120)
+    await cache_manager.add_follower(user_id=follower_id, following_id=author_id, max_ft=120)
+
+    assert await cache_manager.cache_redis.zrange(f"users:{follower_id}:following_timeline", 0, -1) == feed_ids[-120:]
+    assert await cache_manager.cache_redis.hget(f"users:{follower_id}:profile", "followings_count") == "1"
+    assert await cache_manager.cache_redis.hget(f"users:{author_id}:profile", "followers_count") == "1"
+
+
+@pytest.mark.anyio
+async def test_unfollow_strips_only_the_followees_posts(cache_manager):
+    follower_id = uuid4().hex
+    author_id, _ = await _author_with_posts(cache_manager=cache_manager, posts_count=30)
+    other_id, other_feed_ids = await _author_with_posts(cache_manager=cache_manager, posts_count=5)
+    await cache_manager.add_follower(user_id=follower_id, following_id=author_id)
+    await cache_manager.add_follower(user_id=follower_id, following_id=other_id)
+
+    await cache_manager.remove_follower(user_id=follower_id, following_id=author_id)
+    await cache_manager.remove_follower(user_id=follower_id, following_id=author_id)
+
+    assert set(await cache_manager.cache_redis.zrange(f"users:{follower_id}:following_timeline", 0, -1)) == set(other_feed_ids)
+    assert await cache_manager.get_following(user_id=follower_id) == {other_id}
+    assert await cache_manager.cache_redis.hget(f"users:{follower_id}:profile", "followings_count") == "1"
+    assert await cache_manager.cache_redis.hget(f"users:{author_id}:profile", "followers_count") == "0"
+
+
+@pytest.mark.anyio
+async def test_follow_is_refused_across_a_block(cache_manager):
+    user_id, other_id = uuid4().hex, uuid4().hex
+    await cache_manager.toggle_block_user(blocker_id=other_id, blocked_id=user_id)
+
+    with pytest.raises(ValueError):
+        await cache_manager.add_follower(user_id=user_id, following_id=other_id)
+    assert not await cache_manager.is_following(user_id=user_id, follower_id=other_id)
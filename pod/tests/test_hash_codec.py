@@ -0,0 +1,30 @@
+from utility.hash_codec import HashCodec
+
+CODES: dict[str, str] = {"created_at": "c", "body": "b"}
+
+
+def test_enabled_codec_writes_codes_and_leaves_unknown_fields_alone():
+    codec = HashCodec(codes=CODES, enabled=True)
+
+    assert codec.encode({"created_at": 1.0, "body": "hi", "likes": 2}) == {"c": 1.0, "b": "hi", "likes": 2}
+    assert codec.fields(["body", "likes"]) == ["b", "likes"]
+
+
+def test_disabled_codec_writes_names_as_they_are():
+    codec = HashCodec(codes=CODES, enabled=False)
+    mapping: dict = {"created_at": 1.0, "body": "hi"}
+
+    assert codec.encode(mapping) == mapping
+    assert codec.field("body") == "body"
+
+
+def test_decoding_reads_both_layouts_whichever_is_enabled():
+    for enabled in (True, False):
+        codec = HashCodec(codes=CODES, enabled=enabled)
+
+        assert codec.decode({"c": "1.0", "b": "hi"}) == codec.decode({"created_at": "1.0", "body": "hi"}) == {"created_at": "1.0", "body": "hi"}
+
+
+def test_renames_bring_either_layout_to_the_enabled_one():
+    assert HashCodec(codes=CODES, enabled=True).renames() == [("created_at", "c"), ("body", "b")]
+    assert HashCodec(codes=CODES, enabled=False).renames() == [("c", "created_at"), ("b", "body")]
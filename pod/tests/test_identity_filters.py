@@ -0,0 +1,27 @@
+from uuid import uuid4
+
+import pytest
+
+from settings.my_redis import USERNAMES_FILTER_KEY
+
+
+@pytest.mark.anyio
+async def test_profile_writes_never_create_the_filters(cache_manager):
+    await cache_manager.create_profile(mapping={"id": uuid4().hex, "name": "Kronk", "username": "kronk", "email": "kronk@example.com"})
+
+    assert not await cache_manager.cache_redis.exists(USERNAMES_FILTER_KEY)
+
+
+@pytest.mark.anyio
+async def test_filters_are_trusted_only_once_seeded(cache_manager):
+    await cache_manager.reset_identity_filters()
+    await cache_manager.seed_identity_filters(usernames=["Kronk"], emails=["kronk@example.com"])
+
+    # Seeding has not finished, so even a value missing from the filters may be taken
+    assert await cache_manager.reserve_registration(username="yzma", email="yzma@example.com") == (False, False, True, True)
+    await cache_manager.release_registration(username="yzma", email="yzma@example.com")
+
+    await cache_manager.mark_identity_filters_seeded()
+    await cache_manager.create_profile(mapping={"id": uuid4().hex, "name": "Pacha", "username": "Pacha", "email": "pacha@example.com"})
+    assert await cache_manager.reserve_registration(username="yzma", email="yzma@example.com") == (False, False, False, False)
+    assert await cache_manager.reserve_registration(username="pacha", email="kronk@example.com") == (False, False, True, True)
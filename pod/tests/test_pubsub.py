@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from settings.my_redis import RedisPubSubManager
+
+
+@pytest.mark.anyio
+async def test_messages_reach_every_listener_of_the_topic(cache_redis):
+    manager = RedisPubSubManager(cache_redis=cache_redis)
+    try:
+        first, second = await manager.subscribe(topic="t"), await manager.subscribe(topic="t")
+        await manager.publish(topic="t", data={"n": 1})
+
+        for subscription in (first, second):
+            message: dict = await asyncio.wait_for(anext(subscription.listen()), timeout=3)
+            assert message["data"] == '{"n": 1}'
+    finally:
+        await manager.close()
+
+
+@pytest.mark.anyio
+async def test_close_wakes_listeners_and_tolerates_late_releases(cache_redis):
+    manager = RedisPubSubManager(cache_redis=cache_redis)
+    subscription = await manager.subscribe(topic="t")
+    listener = asyncio.create_task(anext(subscription.listen(), None))
+    await asyncio.sleep(0)
+
+    await manager.close()
+
+    assert await asyncio.wait_for(listener, timeout=3) is None
+    assert manager.pubsub is None and manager.reader is None
+    await subscription.close()
@@ -0,0 +1,54 @@
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.mark.anyio
+async def test_rebuild_feeds_seeds_counters_and_keeps_ranked_scores(cache_manager, make_feed):
+    author_id = uuid4().hex
+    ranked: dict = make_feed(author_id=author_id)
+    fresh: dict = make_feed(author_id=author_id)
+    comment: dict = make_feed(author_id=uuid4().hex, parent_id=fresh["id"])
+    await cache_manager.cache_redis.zadd("global_timeline", mapping={ranked["id"]: 1.0})
+
+    counts = {fresh["id"]: {"likes": 4, "comments": 1}}
+    await cache_manager.rebuild_feeds(feeds=[ranked, fresh, comment], counts=counts, comment_ids={fresh["id"]: [comment["id"]]})
+
+    assert await cache_manager.cache_redis.zscore("global_timeline", ranked["id"]) == 1.0
+    assert await cache_manager.cache_redis.zscore("global_timeline", fresh["id"]) > fresh["created_at"]
+    assert await cache_manager.cache_redis.hgetall(f"counts:feeds:{fresh['id']}") == {"comments": "1", "reposts": "0", "quotes": "0", "likes": "4", "views": "0", "bookmarks": "0"}
+    assert await cache_manager.cache_redis.smembers(f"feeds:{fresh['id']}:comments") == {comment["id"]}
+    assert await cache_manager.cache_redis.get(f"comments:{comment['id']}:parent_id") == fresh["id"]
+
+
+@pytest.mark.anyio
+async def test_user_rebuild_only_writes_the_users_follow_sets(cache_manager):
+    user_id, other_id = uuid4().hex, uuid4().hex
+
+    await cache_manager.rebuild_follows(edges=[(user_id, other_id), (other_id, user_id)], user_id=user_id)
+
+    assert await cache_manager.get_following(user_id=user_id) == {other_id}
+    assert await cache_manager.get_followers(user_id=user_id) == {other_id}
+    assert not await cache_manager.cache_redis.exists(f"users:{other_id}:followers", f"users:{other_id}:followings")
+
+
+@pytest.mark.anyio
+async def test_username_suggestions_are_seeded_in_one_pipeline(cache_manager):
+    user_id = uuid4().hex
+
+    await cache_manager.seed_username_suggestions(users=[(user_id, "kronk"), (uuid4().hex, "yzma")])
+    await cache_manager.seed_username_suggestions(users=[(user_id, "kronk")])
+
+    assert await cache_manager.cache_redis.execute_command("FT.SUGLEN", "sug:usernames") == 2
+    assert await cache_manager.cache_redis.execute_command("FT.SUGGET", "sug:usernames", "kr", "WITHPAYLOADS") == ["kronk", user_id]
+
+
+@pytest.mark.anyio
+async def test_renaming_a_user_replaces_its_username_suggestion(cache_manager):
+    user_id = uuid4().hex
+    await cache_manager.create_profile(mapping={"id": user_id, "name": "Kronk", "username": "kronk"})
+
+    await cache_manager.update_profile(user_id=user_id, key="username", value="pacha")
+
+    assert await cache_manager.cache_redis.execute_command("FT.SUGGET", "sug:usernames", "kr") in ([], None)
+    assert await cache_manager.cache_redis.execute_command("FT.SUGGET", "sug:usernames", "pa", "WITHPAYLOADS") == ["pacha", user_id]
@@ -0,0 +1,80 @@
+import math
+import time
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from settings.my_redis import ENGAGEMENT_KEYS, FEED_META_CODEC, _calculate_score, _calculate_scores, settings
+from utility.my_enums import EngagementType
+
+
+def test_doubling_engagement_is_worth_one_half_life(monkeypatch):
+    monkeypatch.setattr(settings, "FEED_SCORE_WEIGHTS", {"likes": 1})
+    monkeypatch.setattr(settings, "FEED_SCORE_HALF_LIFE_HOURS", 10)
+    likes = ENGAGEMENT_KEYS.index("likes")
+    counters = np.zeros((3, len(ENGAGEMENT_KEYS)))
+    counters[1, likes], counters[2, likes] = 3, 7
+
+    scores = _calculate_scores(counters=counters, created_at=np.array([1000.0, 1000.0, 1000.0]))
+
+    assert scores[0] == 1000
+    # 1 + 7 is twice 1 + 3
+    assert math.isclose(scores[2] - scores[1], 10 * 3600)
+
+
+def test_single_feed_score_matches_the_vectorised_one():
+    created_at = np.array([1000.0, 2000.0])
+    counters = np.zeros((2, len(ENGAGEMENT_KEYS)))
+    counters[1] = range(len(ENGAGEMENT_KEYS))
+
+    scores = _calculate_scores(counters=counters, created_at=created_at)
+
+    assert _calculate_score(stats_dict={}, created_at=1000.0) == scores[0]
+    assert math.isclose(_calculate_score(stats_dict=dict(zip(ENGAGEMENT_KEYS, range(len(ENGAGEMENT_KEYS)))), created_at=2000.0), scores[1])
+
+
+@pytest.mark.anyio
+async def test_rerank_moves_engaged_feeds_up(cache_manager, make_feed):
+    now = time.time()
+    older: dict = make_feed(author_id=uuid4().hex, created_at=now - 3600)
+    newer: dict = make_feed(author_id=uuid4().hex, created_at=now)
+    for feed in (older, newer):
+        await cache_manager.create_feed(mapping=feed)
+    for _ in range(20):
+        await cache_manager.set_engagement(user_id=uuid4().hex, feed_id=older["id"], engagement_type=EngagementType.likes)
+
+    await cache_manager.rerank_global_timeline()
+
+    assert await cache_manager.cache_redis.zrevrange("global_timeline", 0, -1) == [older["id"], newer["id"]]
+    score: float = await cache_manager.cache_redis.zscore("global_timeline", older["id"])
+    assert float(await cache_manager.cache_redis.hget(f"feeds:{older['id']}:meta", FEED_META_CODEC.field("score"))) == score
+
+
+@pytest.mark.anyio
+async def test_rerank_only_writes_moved_scores_and_never_recreates_deleted_meta(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "FEED_SCORE_EPSILON", 60)
+    feed: dict = make_feed(author_id=uuid4().hex)
+    await cache_manager.create_feed(mapping=feed)
+    await cache_manager.set_engagement(user_id=uuid4().hex, feed_id=feed["id"], engagement_type=EngagementType.likes)
+
+    assert await cache_manager.rerank_global_timeline() == 1
+    assert await cache_manager.rerank_global_timeline() == 0
+
+    await cache_manager.cache_redis.hset(f"counts:feeds:{feed['id']}", mapping={"likes": 100})
+    # The meta is gone while the feed is still ranked, as when delete_feed runs concurrently
+    await cache_manager.cache_redis.delete(f"feeds:{feed['id']}:meta")
+    assert await cache_manager.rerank_global_timeline() == 0
+    assert not await cache_manager.cache_redis.exists(f"feeds:{feed['id']}:meta")
+
+
+@pytest.mark.anyio
+async def test_update_feed_never_recreates_a_deleted_meta(cache_manager, make_feed):
+    feed: dict = make_feed(author_id=uuid4().hex)
+    await cache_manager.create_feed(mapping=feed)
+    await cache_manager.update_feed(feed_id=feed["id"], key="body", value="edited")
+    assert await cache_manager.cache_redis.hget(f"feeds:{feed['id']}:meta", FEED_META_CODEC.field("body")) == "edited"
+
+    await cache_manager.cache_redis.delete(f"feeds:{feed['id']}:meta")
+    await cache_manager.update_feed(feed_id=feed["id"], key="body", value="edited again")
+    assert not await cache_manager.cache_redis.exists(f"feeds:{feed['id']}:meta")
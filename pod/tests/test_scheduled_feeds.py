@@ -0,0 +1,40 @@
+import time
+from uuid import uuid4
+
+import pytest
+
+from settings.my_redis import SCHEDULED_FEEDS_PROCESSING_KEY, settings
+
+
+@pytest.mark.anyio
+async def test_a_claimed_feed_comes_back_when_its_lease_expires_without_an_ack(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULED_FEED_LEASE_SECONDS", 60)
+    feed: dict = make_feed(author_id=uuid4().hex)
+    now = time.time()
+    await cache_manager.schedule_feed(mapping=feed, due_at=now - 1)
+
+    assert [feed_id for feed_id, _ in await cache_manager.claim_due_feeds(now=now)] == [feed["id"]]
+    # Still leased to the first drainer
+    assert await cache_manager.claim_due_feeds(now=now + 30) == []
+
+    claimed: list[tuple[str, dict]] = await cache_manager.claim_due_feeds(now=now + 61)
+    assert claimed == [(feed["id"], {"mapping": feed, "notify": False})]
+
+    await cache_manager.ack_scheduled_feeds(feed_ids=[feed["id"]])
+    assert await cache_manager.claim_due_feeds(now=now + 200) == []
+
+
+@pytest.mark.anyio
+async def test_requeued_and_unscheduled_feeds(cache_manager, make_feed):
+    feed: dict = make_feed(author_id=uuid4().hex)
+    now = time.time()
+    await cache_manager.schedule_feed(mapping=feed, due_at=now - 1)
+    await cache_manager.claim_due_feeds(now=now)
+
+    await cache_manager.requeue_scheduled_feed(feed_id=feed["id"], due_at=now + 5)
+    assert await cache_manager.get_next_due_at() == now + 5
+
+    await cache_manager.claim_due_feeds(now=now + 5)
+    # Already claimed, so deleting it goes through the regular cache cleanup
+    assert await cache_manager.unschedule_feed(feed_id=feed["id"]) is False
+    assert not await cache_manager.cache_redis.exists(SCHEDULED_FEEDS_PROCESSING_KEY)
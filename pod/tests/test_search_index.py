@@ -0,0 +1,10 @@
+from utility.search_index import SearchIndex
+
+
+def test_version_is_read_from_versioned_and_reindexed_names():
+    index = SearchIndex(alias="idx:feeds", version=3, schema=[], prefixes=["feeds:"])
+
+    assert index.version_of("idx:feeds:v3") == 3
+    assert index.version_of("idx:feeds:v2-1760000000") == 2
+    assert index.version_of("idx:feeds") is None
+    assert index.version_of("idx:feeds:v3-backup") is None
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from settings.my_redis import RedisStreamManager, settings
+
+
+@pytest.fixture
+async def stream_manager(cache_redis):
+    manager = RedisStreamManager(cache_redis=cache_redis)
+    yield manager
+    await manager.close()
+
+
+async def _next(subscription, timeout: float = 3) -> tuple[str, dict]:
+    return await asyncio.wait_for(anext(subscription.listen()), timeout=timeout)
+
+
+@pytest.mark.anyio
+async def test_replays_after_last_id_then_delivers_live_entries_once(stream_manager):
+    first, second = await stream_manager.publish(streams=["s:1"], data={"n": 1}) + await stream_manager.publish(streams=["s:1"], data={"n": 2})
+    subscription = await stream_manager.subscribe(stream="s:1", last_id=first)
+    other = await stream_manager.subscribe(stream="s:1")
+    assert await _next(subscription) == (second, {"n": 2})
+
+    [third] = await stream_manager.publish(streams=["s:1"], data={"n": 3})
+    assert await _next(subscription) == (third, {"n": 3})
+    assert await _next(other) == (third, {"n": 3})
+    assert subscription.queue.empty() and other.queue.empty()
+
+
+@pytest.mark.anyio
+async def test_a_stream_subscribed_while_the_reader_is_blocked_is_read_right_away(stream_manager, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_STREAM_BLOCK_MS", 30_000)
+    await stream_manager.subscribe(stream="s:1")
+    await asyncio.sleep(0.1)
+    subscription = await stream_manager.subscribe(stream="s:2")
+
+    [entry_id] = await stream_manager.publish(streams=["s:2"], data={"n": 1})
+    assert await _next(subscription, timeout=1) == (entry_id, {"n": 1})
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("last_id", ["1-0", "not-an-id"])
+async def test_trimmed_or_malformed_resume_ids_ask_for_a_resync(stream_manager, last_id):
+    await stream_manager.cache_redis.xadd("s:1", {"data": "{}"}, id="5-0")
+    [latest] = await stream_manager.publish(streams=["s:1"], data={"n": 1})
+    subscription = await stream_manager.subscribe(stream="s:1", last_id=last_id)
+    assert await _next(subscription) == (latest, {"type": "resync"})
+
+
+@pytest.mark.anyio
+async def test_a_full_queue_is_replaced_by_a_resync(stream_manager, monkeypatch):
+    monkeypatch.setattr(settings, "PUBSUB_QUEUE_SIZE", 2)
+    subscription = await stream_manager.subscribe(stream="s:1")
+    for n in range(3):
+        [last] = await stream_manager.publish(streams=["s:1"], data={"n": n})
+    await asyncio.sleep(0.5)
+    assert await _next(subscription) == (last, {"type": "resync"})
+
+
+@pytest.mark.anyio
+async def test_close_wakes_listeners(stream_manager):
+    subscription = await stream_manager.subscribe(stream="s:1")
+
+    await stream_manager.close()
+    assert [item async for item in subscription.listen()] == []
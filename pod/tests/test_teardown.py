@@ -0,0 +1,31 @@
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.mark.anyio
+async def test_teardown_deletes_posts_trimmed_out_of_the_user_timeline(search_indexes, make_feed):
+    cache_manager = search_indexes
+    user_id = uuid4().hex
+    feeds: list[dict] = [make_feed(author_id=user_id) for _ in range(5)]
+    for feed in feeds:
+        await cache_manager.create_feed(mapping=feed, max_ut=2)
+    assert await cache_manager.cache_redis.zcard(f"users:{user_id}:user_timeline") == 2
+
+    await cache_manager.delete_profile(user_id=user_id, batch_size=2)
+
+    for feed in feeds:
+        assert not await cache_manager.cache_redis.exists(f"feeds:{feed['id']}:meta")
+
+
+@pytest.mark.anyio
+async def test_teardown_unschedules_pending_posts(search_indexes, make_feed):
+    cache_manager = search_indexes
+    user_id, other_id = uuid4().hex, uuid4().hex
+    own, other = make_feed(author_id=user_id), make_feed(author_id=other_id)
+    for feed in (own, other):
+        await cache_manager.schedule_feed(mapping=feed, due_at=0)
+
+    await cache_manager.delete_profile(user_id=user_id)
+
+    assert [feed_id for feed_id, _ in await cache_manager.claim_due_feeds(now=1)] == [other["id"]]
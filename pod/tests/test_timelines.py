@@ -0,0 +1,116 @@
+import time
+from uuid import uuid4
+
+import pytest
+
+from settings.my_redis import PULL_AUTHORS_KEY, _decode_timeline_cursor, _merge_timelines, _next_timeline_cursor, is_timeline_cursor, settings
+
+
+def test_merge_timelines_keeps_the_best_score_and_orders_like_zrevrange():
+    timelines = [[("b", 3.0), ("a", 1.0)], [("c", 3.0), ("b", 2.0), ("d", 0.5)]]
+
+    assert _merge_timelines(timelines=timelines, start=0, end=2) == [("c", 3.0), ("b", 3.0), ("a", 1.0)]
+    assert _merge_timelines(timelines=timelines, start=3, end=9) == [("d", 0.5)]
+
+
+def test_timeline_cursor_round_trips_and_rejects_anything_else():
+    cursor: str = _next_timeline_cursor(entries=[("a", 2.0), ("b", 1.0000000001)], limit=2)
+
+    assert _decode_timeline_cursor(cursor=cursor) == ("1.0000000001", "b")
+    assert _next_timeline_cursor(entries=[("a", 2.0)], limit=2) is None
+    # Scores handed back by the paging script are strings and are kept as they are
+    assert _decode_timeline_cursor(cursor=_next_timeline_cursor(entries=[("a", "2.5")], limit=1)) == ("2.5", "a")
+    assert is_timeline_cursor(cursor=cursor)
+    for malformed in ("not base64!", "bm9jb2xvbg==", "bmFuOmE="):
+        assert not is_timeline_cursor(cursor=malformed)
+
+
+@pytest.mark.anyio
+async def test_authors_above_the_threshold_are_not_fanned_out(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "FANOUT_FOLLOWER_THRESHOLD", 2)
+    pull_author, push_author = uuid4().hex, uuid4().hex
+    for _ in range(3):
+        await cache_manager.add_follower(user_id=uuid4().hex, following_id=pull_author)
+    await cache_manager.add_follower(user_id=uuid4().hex, following_id=push_author)
+
+    assert await cache_manager.create_feed(mapping=make_feed(author_id=pull_author)) is False
+    assert await cache_manager.create_feed(mapping=make_feed(author_id=push_author)) is True
+    assert await cache_manager.cache_redis.smembers(PULL_AUTHORS_KEY) == {pull_author}
+
+
+@pytest.mark.anyio
+async def test_fanout_status_tells_skipped_and_unknown_feeds_apart(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "FANOUT_FOLLOWER_THRESHOLD", 1)
+    author_id = uuid4().hex
+    for _ in range(2):
+        await cache_manager.add_follower(user_id=uuid4().hex, following_id=author_id)
+    feed: dict = make_feed(author_id=author_id)
+    await cache_manager.create_feed(mapping=feed)
+
+    assert await cache_manager.get_fanout_progress(feed_id=feed["id"]) == {"author_id": author_id, "status": "skipped"}
+    assert await cache_manager.get_fanout_progress(feed_id=uuid4().hex) == {}
+
+
+@pytest.mark.anyio
+async def test_fanout_stops_once_the_feed_is_deleted(cache_manager, make_feed):
+    author_id, follower_id = uuid4().hex, uuid4().hex
+    await cache_manager.add_follower(user_id=follower_id, following_id=author_id)
+    feed: dict = make_feed(author_id=author_id)
+    assert await cache_manager.create_feed(mapping=feed) is True
+    await cache_manager.delete_feed(author_id=author_id, feed_id=feed["id"])
+
+    assert await cache_manager.fanout_feed(author_id=author_id, feed_id=feed["id"]) == 0
+    assert await cache_manager.cache_redis.zscore(f"users:{follower_id}:following_timeline", feed["id"]) is None
+
+
+@pytest.mark.anyio
+async def test_pull_authors_leave_below_the_exit_threshold_and_keep_their_posts_visible(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "FANOUT_FOLLOWER_THRESHOLD", 4)
+    monkeypatch.setattr(settings, "FANOUT_FOLLOWER_EXIT_RATIO", 0.5)
+    author_id = uuid4().hex
+    follower_ids: list[str] = [uuid4().hex for _ in range(5)]
+    for follower_id in follower_ids:
+        await cache_manager.add_follower(user_id=follower_id, following_id=author_id)
+    pulled: dict = make_feed(author_id=author_id)
+    assert await cache_manager.create_feed(mapping=pulled) is False
+
+    # Below the threshold but above the exit threshold
+    await cache_manager.remove_follower(user_id=follower_ids.pop(), following_id=author_id)
+    await cache_manager.remove_follower(user_id=follower_ids.pop(), following_id=author_id)
+    assert await cache_manager.create_feed(mapping=make_feed(author_id=author_id)) is False
+
+    await cache_manager.remove_follower(user_id=follower_ids.pop(), following_id=author_id)
+    assert await cache_manager.create_feed(mapping=make_feed(author_id=author_id)) is True
+    assert await cache_manager.is_pull_author(author_id=author_id)
+
+    assert await cache_manager.leave_pull_authors(author_id=author_id) == 2
+    assert not await cache_manager.is_pull_author(author_id=author_id)
+    for follower_id in follower_ids:
+        assert await cache_manager.cache_redis.zscore(f"users:{follower_id}:following_timeline", pulled["id"]) is not None
+
+
+@pytest.mark.anyio
+async def test_following_timeline_merges_pull_authors_and_counts_each_feed_once(cache_manager, make_feed, monkeypatch):
+    monkeypatch.setattr(settings, "FANOUT_FOLLOWER_THRESHOLD", 1)
+    viewer, pull_author, push_author = uuid4().hex, uuid4().hex, uuid4().hex
+    await cache_manager.add_follower(user_id=viewer, following_id=pull_author)
+    await cache_manager.add_follower(user_id=viewer, following_id=push_author)
+    now = time.time()
+
+    # Fanned out while its author was still below the threshold, so it is in both timelines
+    early = make_feed(author_id=pull_author, created_at=now - 30)
+    assert await cache_manager.create_feed(mapping=early)
+    await cache_manager.fanout_feed(author_id=pull_author, feed_id=early["id"])
+
+    await cache_manager.add_follower(user_id=uuid4().hex, following_id=pull_author)
+    late = make_feed(author_id=pull_author, created_at=now - 10)
+    assert not await cache_manager.create_feed(mapping=late)
+
+    pushed = make_feed(author_id=push_author, created_at=now - 20)
+    assert await cache_manager.create_feed(mapping=pushed)
+    await cache_manager.fanout_feed(author_id=push_author, feed_id=pushed["id"])
+
+    page = await cache_manager.get_following_timeline(user_id=viewer, start=0, end=9)
+
+    assert [feed["id"] for feed in page["feeds"]] == [late["id"], pushed["id"], early["id"]]
+    assert page["end"] == 3
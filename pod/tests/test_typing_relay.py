@@ -0,0 +1,87 @@
+from uuid import uuid4
+
+import pytest
+
+from apps.chats_app import ws
+from settings.my_websocket import PresenceBatcher
+from utility.my_enums import ChatEvent
+
+
+@pytest.fixture
+def relay(monkeypatch):
+    """Chats of three online participants, counting the participant lookups and the events handed to the router."""
+    chats: dict[str, set[str]] = {}
+    counts: dict[str, int] = {"lookups": 0, "deliveries": 0, "recipients": 0}
+
+    async def get_chat_participants(chat_id: str, user_id: str | None = None, online: bool = False) -> set[str]:
+        counts["lookups"] += 1
+        return set(chats[chat_id])
+
+    async def deliver(user_ids, data: dict):
+        counts["deliveries"] += 1
+        counts["recipients"] += len(list(user_ids))
+
+    monkeypatch.setattr(ws.chat_cache_manager, "get_chat_participants", get_chat_participants)
+    monkeypatch.setattr(ws.chat_event_router, "deliver", deliver)
+    ws.typing_state.clear()
+    ws.online_participants_cache.clear()
+    yield chats, counts
+    ws.typing_state.clear()
+    ws.online_participants_cache.clear()
+
+
+@pytest.mark.anyio
+async def test_repeated_keystrokes_reach_the_router_once_per_state_change(relay, chats: int = 50, keystrokes: int = 40):
+    chat_participants, counts = relay
+    for _ in range(chats):
+        chat_participants[uuid4().hex] = {uuid4().hex, uuid4().hex, uuid4().hex}
+
+    for chat_id, participants in chat_participants.items():
+        for user_id in participants:
+            for _ in range(keystrokes):
+                await ws.relay_typing(user_id=user_id, data={"type": ChatEvent.typing_start.value, "id": chat_id})
+            await ws.relay_typing(user_id=user_id, data={"type": ChatEvent.typing_stop.value, "id": chat_id})
+
+    # A start and a stop per typist instead of one event per keystroke, and one participant lookup per chat
+    assert counts["deliveries"] == chats * 3 * 2
+    assert counts["recipients"] == chats * 3 * 2 * 2
+    assert counts["lookups"] == chats
+
+
+@pytest.mark.anyio
+async def test_typing_in_a_foreign_chat_is_dropped(relay):
+    chat_participants, counts = relay
+    chat_id = uuid4().hex
+    chat_participants[chat_id] = {uuid4().hex, uuid4().hex}
+
+    await ws.relay_typing(user_id=uuid4().hex, data={"type": ChatEvent.typing_start.value, "id": chat_id})
+
+    assert counts["deliveries"] == 0
+
+
+class _CountingRouter:
+    def __init__(self):
+        self.messages: list[tuple[str, dict]] = []
+
+    async def deliver_events(self, events: dict[str, dict]):
+        self.messages.extend(events.items())
+
+
+@pytest.mark.anyio
+async def test_presence_transitions_reach_each_recipient_once_per_window(partners: int = 20, recipients: int = 50):
+    router = _CountingRouter()
+    batcher = PresenceBatcher(router=router, window=60)
+    recipient_ids: list[str] = [uuid4().hex for _ in range(recipients)]
+    for partner_id in (uuid4().hex for _ in range(partners)):
+        for event_type in (ChatEvent.goes_online, ChatEvent.goes_offline):
+            batcher.add(events={recipient_id: {"type": event_type.value, "user_id": partner_id} for recipient_id in recipient_ids})
+
+    await batcher.flush()
+    batcher.flusher.cancel()
+
+    # One message per recipient instead of one per transition and partner, holding only the latest state of every partner
+    assert len(router.messages) == recipients
+    for _, message in router.messages:
+        assert message["type"] == ChatEvent.presence_batch.value
+        assert len(message["events"]) == partners
+        assert {event["type"] for event in message["events"]} == {ChatEvent.goes_offline.value}
@@ -0,0 +1,32 @@
+from typing import Any, Iterable
+
+
+class HashCodec:
+    """
+    Maps the field names of a cached hash to short field codes. Keys stay hashes, so Lua scripts and
+    RediSearch keep reading single fields, and small hashes stay in the compact listpack encoding.
+    Decoding accepts both layouts, so reads keep working while a migration is rewriting the fields.
+    """
+
+    def __init__(self, codes: dict[str, str], enabled: bool):
+        self.codes = codes
+        self.names = {code: name for name, code in codes.items()}
+        self.enabled = enabled
+
+    def field(self, name: str) -> str:
+        return self.codes.get(name, name) if self.enabled else name
+
+    def fields(self, names: Iterable[str]) -> list[str]:
+        return [self.field(name) for name in names]
+
+    def encode(self, mapping: dict[str, Any]) -> dict[str, Any]:
+        return {self.field(name): value for name, value in mapping.items()} if self.enabled else mapping
+
+    def decode(self, raw: dict[str, Any]) -> dict[str, Any]:
+        return {self.names.get(field, field): value for field, value in raw.items()}
+
+    def renames(self) -> list[tuple[str, str]]:
+        """(stored field, wanted field) pairs that bring a hash written in either layout to the current one."""
+        if self.enabled:
+            return list(self.codes.items())
+        return [(code, name) for name, code in self.codes.items()]
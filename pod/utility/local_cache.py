@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from prometheus_client import Counter, Gauge
+
+local_cache_hits = Counter("local_cache_hits", "In-process cache hits", ["cache"])
+local_cache_misses = Counter("local_cache_misses", "In-process cache misses", ["cache"])
+local_cache_evictions = Counter("local_cache_evictions", "In-process cache evictions", ["cache", "reason"])
+local_cache_size = Gauge("local_cache_size", "In-process cache entries", ["cache"])
+
+
+class LocalCache:
+    """Bounded in-process LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry: Optional[tuple[float, Any]] = self._entries.get(key)
+        if entry is None:
+            local_cache_misses.labels(cache=self.name).inc()
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            local_cache_evictions.labels(cache=self.name, reason="expired").inc()
+            local_cache_misses.labels(cache=self.name).inc()
+            local_cache_size.labels(cache=self.name).set(len(self._entries))
+            return None
+
+        self._entries.move_to_end(key)
+        local_cache_hits.labels(cache=self.name).inc()
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            local_cache_evictions.labels(cache=self.name, reason="size").inc()
+        local_cache_size.labels(cache=self.name).set(len(self._entries))
+
+    def invalidate(self, key: str):
+        if self._entries.pop(key, None) is not None:
+            local_cache_evictions.labels(cache=self.name, reason="invalidated").inc()
+            local_cache_size.labels(cache=self.name).set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        local_cache_size.labels(cache=self.name).set(0)
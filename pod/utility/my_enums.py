@@ -89,6 +89,7 @@ class PubSubTopics(AutoName):
     FEEDS = "feeds:{follower_id}"
     CHATS = "chats:{participant_id}"
     SETTINGS_STATS = "settings:stats"
+    CHAT_STREAM = "users:{user_id}:chat_stream"
 
 
 class GroupType(AutoName):
@@ -115,3 +116,5 @@ class ChatEvent(AutoName):
     typing_stop = auto()
     sent_message = auto()
     created_chat = auto()
+    resync = auto()
+    presence_batch = auto()
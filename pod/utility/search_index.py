@@ -0,0 +1,154 @@
+import asyncio
+import re
+import time
+from typing import Optional
+from uuid import uuid4
+
+from coredis import PureToken
+from coredis import Redis as SearchRedis
+from coredis.exceptions import ResponseError
+from coredis.modules.search import Field
+
+from settings.my_lua import EXTEND_LOCK_LUA
+from utility.my_logger import my_logger
+
+
+class SearchIndex:
+    """A RediSearch index served through an alias, every schema change bumps the version and builds a new physical index."""
+
+    def __init__(self, alias: str, version: int, schema: list[Field], prefixes: list[str]):
+        self.alias = alias
+        self.version = version
+        self.schema = schema
+        self.prefixes = prefixes
+
+    @property
+    def name(self) -> str:
+        return f"{self.alias}:v{self.version}"
+
+    def version_of(self, name: Optional[str]) -> Optional[int]:
+        """Schema version of a physical index named {alias}:v{N} or {alias}:v{N}-{timestamp}, None for the legacy unversioned one."""
+        match = re.fullmatch(rf"{re.escape(self.alias)}:v(\d+)(?:-\d+)?", name or "")
+        return int(match.group(1)) if match else None
+
+
+class SearchIndexManager:
+    """
+    Builds versioned indexes next to the live ones and moves the alias over with FT.ALIASUPDATE once FT.INFO reports
+    the new index fully built, so queries keep hitting a complete index during schema changes and rebuilds.
+    A per-alias SET NX lock keeps replicas starting together from building and dropping each other's indexes.
+    """
+
+    def __init__(self, search_redis: SearchRedis, indexes: list[SearchIndex], poll_interval: float = 1.0, lock_ttl: int = 60):
+        self.search_redis = search_redis
+        self.indexes = {index.alias: index for index in indexes}
+        self.poll_interval = poll_interval
+        self.lock_ttl = lock_ttl
+        self.extend_lock_script = search_redis.register_script(EXTEND_LOCK_LUA)
+
+    async def ensure(self):
+        """Bring every alias to its current version, meant to run in the background on startup."""
+        results = await asyncio.gather(*(self._ensure(index=index) for index in self.indexes.values()), return_exceptions=True)
+        for alias, result in zip(self.indexes, results):
+            if isinstance(result, Exception):
+                my_logger.error(f"🔎 Index for {alias} could not be brought up to date: {result}")
+
+    async def reindex(self, alias: str) -> str:
+        """Rebuild the current version under a fresh name, for when the indexed hashes were rewritten in place."""
+        index: SearchIndex = self.indexes[alias]
+        name = f"{index.name}-{int(time.time())}"
+        if not await self._cut_over(index=index, name=name):
+            raise ValueError(f"{alias} is already being cut over by another node")
+        return name
+
+    async def status(self) -> dict[str, dict]:
+        report: dict[str, dict] = {}
+        for alias in self.indexes:
+            info: Optional[dict] = await self._info(alias)
+            report[alias] = {
+                "index": info.get("index_name") if info else None,
+                "docs": int(info.get("num_docs", 0)) if info else 0,
+                "percent_indexed": float(info.get("percent_indexed", 0)) if info else 0.0,
+            }
+        return report
+
+    async def _ensure(self, index: SearchIndex):
+        live: Optional[dict] = await self._info(index.alias)
+        # A reindex leaves the alias on {alias}:v{N}-{timestamp}, which already serves the current schema
+        live_version: Optional[int] = index.version_of(live.get("index_name")) if live else None
+        if live_version is not None and live_version >= index.version:
+            return
+        await self._cut_over(index=index, name=index.name)
+
+    async def _cut_over(self, index: SearchIndex, name: str) -> bool:
+        """Returns False without touching anything when another node holds the alias lock."""
+        lock_key = f"search:cutover:{index.alias}"
+        token = uuid4().hex
+        if not await self.search_redis.set(lock_key, token, condition=PureToken.NX, ex=self.lock_ttl):
+            my_logger.info(f"🔎 {index.alias} is being cut over by another node")
+            return False
+
+        try:
+            live: Optional[dict] = await self._info(index.alias)
+            existing: set[str] = set(await self.search_redis.search.list())
+            # Before versioning the index itself carried the alias name, it keeps serving until its replacement is built
+            legacy: bool = index.alias in existing
+            if live is not None and live.get("index_name") == name:
+                return True
+
+            if name not in existing:
+                try:
+                    await self.search_redis.search.create(index=name, on=PureToken.HASH, schema=index.schema, prefixes=index.prefixes)
+                    my_logger.info(f"🔎 Index {name} created, building in the background")
+                except ResponseError as e:
+                    if "Index already exists" not in str(e):
+                        raise
+
+            # Nothing is served yet on a fresh deployment, so the alias can point at the index while it is still being built
+            if live is not None:
+                await self._wait_until_indexed(name=name, lock_key=lock_key, token=token)
+
+            if legacy:
+                await self._drop(name=index.alias)
+            await self.search_redis.search.aliasupdate(alias=index.alias, index=name)
+            my_logger.info(f"🔎 {index.alias} now points at {name}")
+
+            for previous in existing:
+                if previous != name and previous.startswith(f"{index.alias}:v"):
+                    await self._drop(name=previous)
+            return True
+        finally:
+            await self.extend_lock_script(keys=[lock_key], args=[token, 0])
+
+    async def _wait_until_indexed(self, name: str, lock_key: str, token: str):
+        while True:
+            info: Optional[dict] = await self._info(name)
+            percent_indexed = float(info.get("percent_indexed", 0)) if info else 0.0
+            if info is not None and not int(info.get("indexing", 0)) and percent_indexed >= 1:
+                return
+            my_logger.debug(f"🔎 Index {name} is {percent_indexed:.0%} built")
+            # Large builds outlast the lock ttl, so it is extended for as long as this node keeps polling
+            if not await self.extend_lock_script(keys=[lock_key], args=[token, self.lock_ttl]):
+                raise ValueError(f"Lost the cut-over lock while building {name}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _drop(self, name: str):
+        try:
+            await self.search_redis.search.dropindex(index=name)
+            my_logger.info(f"🔎 Index {name} dropped")
+        except ResponseError as e:
+            if not _is_unknown_index(e):
+                raise
+
+    async def _info(self, name: str) -> Optional[dict]:
+        try:
+            return await self.search_redis.search.info(index=name)
+        except ResponseError as e:
+            if _is_unknown_index(e):
+                return None
+            raise
+
+
+def _is_unknown_index(error: ResponseError) -> bool:
+    message = str(error).lower()
+    return "unknown" in message or "no such index" in message